@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+
+# Benchmark the whole fetch, paginate and cache pipeline of
+# HistoricDataAPI offline, against the local Poloniex stand-in server of
+# the tests (with the real limit of 50000 trades per request), then
+# replay the recorded responses and finally read everything from the
+# cache.
+#
+# Usage: python -m benchmarks.bench_api_fetch [days] [seconds_between_trades]
+
+from __future__ import division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from ccgains import cache, historic_data, network
+from tests.poloniex_standin import PoloniexStandIn
+
+
+def run(folder, url, transport, dtimes):
+    """Fetch prices at *dtimes*; return the seconds needed."""
+    historic_data.HistoricDataAPI._tickers.clear()
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    t0 = time.time()
+    hd = historic_data.HistoricDataAPI(
+        folder, 'BTC/XMR', url=url, transport=transport,
+        rate_limiter=network.TokenBucket(1000), day_cache=cache.LRUCache())
+    hd.get_prices(dtimes)
+    return time.time() - t0
+
+def main(days=10, spacing=1):
+    folder = tempfile.mkdtemp()
+    try:
+        dtimes = pd.date_range(
+            '2017-01-01', periods=days * 24, freq='H', tz='UTC')
+        fixtures = os.path.join(folder, 'fixtures')
+        with PoloniexStandIn({'BTC_XMR': spacing}) as server:
+            url = server.url
+            t_fetch = run(
+                os.path.join(folder, 'fetch'), url,
+                network.RecordingTransport(fixtures), dtimes)
+            num_requests = len(server.requests)
+        t_replay = run(os.path.join(folder, 'replay'), url,
+                       network.ReplayTransport(fixtures), dtimes)
+        t_cached = run(os.path.join(folder, 'fetch'), url,
+                       network.ReplayTransport(fixtures), dtimes)
+        print('%i days with %i trades each:' % (days, 86400 // spacing))
+        print('  fetch from stand-in (%i requests): %8.3f s' % (
+            num_requests, t_fetch))
+        print('  replay recorded responses:        %8.3f s' % t_replay)
+        print('  load from cache:                  %8.3f s' % t_cached)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+# Compare the startup time of HistoricDataCSV with a cold cache (parsing
+# the csv), with only the raw trades cached in the HDF5 file (as before
+# the resampled data was cached too), with a warm cache, after a day
+# of trades has been appended to the csv (incremental update), lazily
+# (nothing loaded) and with a window of one year out of five.
+#
+# Usage: python -m benchmarks.bench_csv_startup [number_of_trades]
+
+from __future__ import division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ccgains import historic_data
+
+
+def make_csv(file_name, num):
+    """Write a bitcoincharts-like csv with *num* made-up trades."""
+    times = np.sort(np.random.randint(1356998400, 1514764800, num))
+    prices = np.random.uniform(100, 20000, num).round(2)
+    amounts = np.random.exponential(0.5, num).round(8)
+    pd.DataFrame({'t': times, 'p': prices, 'a': amounts}).to_csv(
+            file_name, header=False, index=False, columns=['t', 'p', 'a'])
+
+def timed(func):
+    t0 = time.time()
+    func()
+    return time.time() - t0
+
+def main(num=2000000):
+    folder = tempfile.mkdtemp()
+    try:
+        csv = os.path.join(folder, 'trades.csv')
+        make_csv(csv, num)
+        load = lambda: historic_data.HistoricDataCSV(csv, 'EUR/BTC')
+        t_cold = timed(load)
+        # Remove the cached resampled data, leaving the raw trades:
+        with pd.HDFStore(os.path.join(folder, 'trades.h5')) as store:
+            store.remove('EUR_BTC_H')
+        t_raw = timed(load)
+        t_warm = timed(load)
+        with open(csv, 'a') as f:
+            for i in range(1000):
+                f.write('%i,15000.00,0.5\n' % (1514764800 + 86 * i))
+        t_append = timed(load)
+        t_lazy = timed(lambda: historic_data.HistoricDataCSV(
+            csv, 'EUR/BTC', lazy=True))
+        t_window = timed(lambda: historic_data.HistoricDataCSV(
+            csv, 'EUR/BTC', window=('2016-01-01', '2016-12-31 23:00')))
+        print('%i trades:' % num)
+        print('  cold start (parse csv):       %8.3f s' % t_cold)
+        print('  raw trades from HDF5:         %8.3f s' % t_raw)
+        print('  warm start (resampled cache): %8.3f s' % t_warm)
+        print('  1000 trades appended to csv:  %8.3f s' % t_append)
+        print('  lazy (nothing loaded):        %8.3f s' % t_lazy)
+        print('  window of one year:           %8.3f s' % t_window)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
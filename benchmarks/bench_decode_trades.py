@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+
+# Benchmark decoding responses of Poloniex' trade history (50000 trades
+# each) and resampling them: pandas.read_json, as used by earlier
+# versions of ccGains, against historic_data.decode_trades. The
+# responses are recorded from the local Poloniex stand-in server of the
+# tests first. Peak memory is measured with tracemalloc.
+#
+# Usage: python -m benchmarks.bench_decode_trades [number_of_responses]
+
+from __future__ import division, print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from ccgains import historic_data, network
+from tests.poloniex_standin import PoloniexStandIn
+
+
+def read_json(text):
+    """Decode and resample *text* like earlier versions of ccGains."""
+    df = pd.read_json(
+        text, orient='records', precise_float=True,
+        convert_axes=False, convert_dates=['date'],
+        keep_default_dates=False, dtype={
+            'tradeID': False, 'globalTradeID': False,
+            'total': False, 'type': False, 'date': False,
+            'rate': float, 'amount': float})
+    df.set_index('date', inplace=True)
+    return historic_data.resample_weighted_average(
+        df, 'H', 'rate', 'amount')
+
+def decode_trades(text):
+    """Decode and resample *text* with decode_trades."""
+    trades = historic_data.decode_trades(text)
+    df = pd.DataFrame(
+        {'rate': trades['rate'], 'amount': trades['amount']},
+        index=pd.DatetimeIndex(trades['date']))
+    return historic_data.resample_weighted_average(
+        df, 'H', 'rate', 'amount')
+
+def measure(func, texts):
+    """Return the mean seconds and the peak memory (MB) needed to
+    decode each of *texts* with *func*."""
+    t0 = time.time()
+    for text in texts:
+        func(text)
+    seconds = (time.time() - t0) / len(texts)
+    tracemalloc.start()
+    func(texts[0])
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return seconds, peak
+
+def main(num=5):
+    folder = tempfile.mkdtemp()
+    try:
+        # Record the responses:
+        recorder = network.RecordingTransport(folder)
+        with PoloniexStandIn({'BTC_XMR': 1}) as server:
+            for i in range(num):
+                start = 1483228800 + i * 86400
+                recorder.get(server.url, {
+                    'command': 'returnTradeHistory',
+                    'currencyPair': 'BTC_XMR',
+                    'start': start, 'end': start + 86399})
+        texts = []
+        for name in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, name)) as f:
+                texts.append(json.load(f)['text'])
+        print('%i responses with %i trades each:' % (
+            num, len(historic_data.decode_trades(texts[0])['date'])))
+        for func in (read_json, decode_trades):
+            print('  %-14s %8.3f s per response, peak memory %6.1f MB'
+                  % ((func.__name__ + ':',) + measure(func, texts)))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+# Compare the scalar price lookup `HistoricData.get_price` with the
+# batch lookup `HistoricData.get_prices`.
+#
+# Usage: python -m benchmarks.bench_get_prices [number_of_lookups]
+
+from __future__ import division, print_function
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from ccgains import historic_data
+
+
+def make_historic_data(years=5):
+    """Return a HistoricData object with hourly prices spanning
+    *years* years."""
+    rng = pd.date_range(
+            '2013-01-01', periods=years * 365 * 24, freq='H', tz='UTC')
+    hd = historic_data.HistoricData('EUR/BTC')
+    hd.data = pd.Series(
+            np.random.uniform(100, 20000, len(rng)), index=rng)
+    return hd
+
+def main(num=100000):
+    hd = make_historic_data()
+    start = hd.data.index[0].value // 10 ** 9
+    end = hd.data.index[-1].value // 10 ** 9
+    epochs = np.sort(np.random.randint(start, end, num))
+    dtimes = pd.to_datetime(epochs, unit='s', utc=True)
+
+    t0 = time.time()
+    scalar = [hd.get_price(t) for t in dtimes]
+    t_scalar = time.time() - t0
+
+    t0 = time.time()
+    batch = hd.get_prices(dtimes)
+    t_batch = time.time() - t0
+
+    assert np.array_equal(np.array(scalar), batch)
+    print('%i lookups:' % num)
+    print('  get_price  (scalar): %8.3f s' % t_scalar)
+    print('  get_prices (batch):  %8.3f s' % t_batch)
+    print('  speedup:             %8.1fx' % (t_scalar / t_batch))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+# Compare resample_weighted_average (numpy.bincount kernel) with the
+# previous implementation using two pandas resample passes.
+#
+# Usage: python -m benchmarks.bench_resample [number_of_trades]
+
+from __future__ import division, print_function
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from ccgains import historic_data
+
+
+def pandas_resample(df, freq, data_col, weight_col):
+    """The previous implementation of resample_weighted_average."""
+    df['data_times_weight'] = df[data_col] * df[weight_col]
+    g = df.resample(freq)
+    avgs = g['data_times_weight'].sum() / g[weight_col].sum()
+    del df['data_times_weight']
+    return avgs
+
+def main(num=10000000):
+    times = np.sort(np.random.randint(1356998400, 1514764800, num))
+    df = pd.DataFrame(
+        {'rate': np.random.uniform(100, 20000, num),
+         'amount': np.random.exponential(0.5, num)},
+        index=pd.to_datetime(times, unit='s', utc=True))
+    print('%i trades:' % num)
+    for freq in ('T', 'H', 'D'):
+        t0 = time.time()
+        expected = pandas_resample(df, freq, 'rate', 'amount')
+        t_pandas = time.time() - t0
+        t0 = time.time()
+        result = historic_data.resample_weighted_average(
+            df, freq, 'rate', 'amount')
+        t_kernel = time.time() - t0
+        assert np.allclose(result.values, expected.values, equal_nan=True)
+        print('  %-3s pandas: %7.3f s, bincount: %7.3f s (%.1fx)' % (
+            freq, t_pandas, t_kernel, t_pandas / t_kernel))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
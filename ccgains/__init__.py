@@ -32,3 +32,4 @@ from .relations import CurrencyRelation
 from .trades import Trade, TradeHistory
 from .bags import Bag, BagFIFO
 from .reports import PaymentReport, CapitalGainsReport
+from .prefetch import PrefetchPlanner, BackgroundPrefetcher
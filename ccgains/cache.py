@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+import sys
+import threading
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger(__name__)
+
+def _sizeof(obj):
+    """Return the approximate memory footprint of *obj* in bytes."""
+    if hasattr(obj, 'memory_usage'):
+        # pandas objects:
+        size = obj.memory_usage(index=True, deep=True)
+        if hasattr(size, 'sum'):
+            # (DataFrames return one value per column)
+            size = size.sum()
+        return int(size)
+    if hasattr(obj, 'nbytes'):
+        # numpy arrays:
+        return int(obj.nbytes)
+    return sys.getsizeof(obj)
+
+
+class LRUCache(object):
+    def __init__(self, max_entries=None, max_bytes=None, policy='lru'):
+        """Create an in-memory cache with bounded size.
+
+        :param max_entries: int or None (default);
+            The maximum number of entries kept in the cache.
+        :param max_bytes: int or None (default);
+            The maximum total memory (approximately, in bytes) used by
+            the values in the cache.
+        :param policy: 'lru' (default) or 'fifo';
+            Which entries to evict first if one of the bounds is
+            exceeded: 'lru' evicts the least recently used entry,
+            'fifo' the entry that was added first, regardless of how
+            often it has been used since.
+
+        If both *max_entries* and *max_bytes* are None, the cache
+        will grow without bounds.
+
+        The number of cache hits, misses and evictions are counted
+        in `hits`, `misses` and `evictions`. Access to the cache is
+        thread-safe.
+
+        """
+        if policy not in ('lru', 'fifo'):
+            raise ValueError(
+                'Unknown eviction policy "%s", must be "lru" or "fifo"'
+                % policy)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the value cached for *key*, or *default* if *key* is
+        not in the cache.
+
+        """
+        with self._lock:
+            try:
+                value, size = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.policy == 'lru':
+                # mark as most recently used:
+                del self._entries[key]
+                self._entries[key] = (value, size)
+            return value
+
+    def put(self, key, value):
+        """Add *value* to the cache under *key*, replacing any value
+        cached before with the same key. Evict old entries if the cache
+        grows too big.
+
+        """
+        size = _sizeof(value)
+        with self._lock:
+            self.pop(key)
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Remove *key* from the cache and return its value, or
+        *default* if *key* is not in the cache.
+
+        """
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return default
+            self.nbytes -= size
+            return value
+
+    def clear(self):
+        """Remove all entries from the cache. The statistics are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self._entries and (
+                (self.max_entries is not None
+                 and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None
+                    and self.nbytes > self.max_bytes)):
+            key, (value, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            log.debug('Evicted %s from cache', key)
+
+    @property
+    def stats(self):
+        """Return a dict with the statistics of this cache."""
+        return {'entries': len(self._entries), 'nbytes': self.nbytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
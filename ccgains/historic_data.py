@@ -24,22 +24,83 @@
 # Get the latest version at: https://github.com/probstj/ccGains
 #
 
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
 from os import path
+import numpy as np
 import pandas as pd
 import requests
-from time import sleep
 from dateutil import tz
 
+from .cache import LRUCache
+from .network import HTTPTransport, get_rate_limiter, get_session
+from .storage import get_backend, _replace, _slice
+
 import logging
 log = logging.getLogger(__name__)
 
+def _resample_sums(df, freq, data_col, weight_col):
+    """Resample a DataFrame with a DatetimeIndex. Return the sums of
+    weights and of weighted data of each group, as a DataFrame with
+    the columns 'data_times_weight' and 'weight'. NaNs in the data are
+    ignored, like in `pandas.DataFrame.resample(freq).sum()`.
+
+    If *freq* is a fixed frequency which divides a day (e.g. 'H' or
+    '15min') and the index is in UTC (or naive), both sums are
+    calculated in a single pass with `numpy.bincount` over the integer
+    timestamps; otherwise, pandas' `resample` is used.
+
+    """
+    offset = pd.tseries.frequencies.to_offset(freq)
+    index = df.index
+    if (not len(df) or not isinstance(offset, pd.tseries.offsets.Tick)
+            or (86400 * 10 ** 9) % offset.nanos
+            or not (index.tz is None or
+                    index.tz.utcoffset(None) == timedelta(0))):
+        return pd.DataFrame(
+            {'data_times_weight': df[data_col] * df[weight_col],
+             'weight': df[weight_col]},
+            columns=['data_times_weight', 'weight']).resample(freq).sum()
+    step = offset.nanos
+    times = index.asi8
+    first = times.min() // step
+    # (in-place operations on the new array save memory and time:)
+    bins = times - first * step
+    bins //= step
+    weights = np.asarray(df[weight_col].values, dtype=float)
+    data_times_weight = df[data_col].values * weights
+    # Ignore NaNs, like pandas' sum (without modifying df):
+    if np.isnan(weights).any():
+        weights = np.where(np.isnan(weights), 0, weights)
+    nans = np.isnan(data_times_weight)
+    if nans.any():
+        data_times_weight[nans] = 0
+    nbins = bins.max() + 1
+    result_index = pd.DatetimeIndex(
+        (first + np.arange(nbins)) * step, name=index.name)
+    if index.tz is not None:
+        result_index = result_index.tz_localize('UTC').tz_convert(index.tz)
+    result_index.freq = offset
+    return pd.DataFrame(
+        {'data_times_weight': np.bincount(
+            bins, weights=data_times_weight, minlength=nbins),
+         'weight': np.bincount(bins, weights=weights, minlength=nbins)},
+        index=result_index, columns=['data_times_weight', 'weight'])
+
 def resample_weighted_average(
         df, freq, data_col, weight_col, include_weights=False):
     """Resample a DataFrame with a DatetimeIndex. Return weighted
     averages of groups.
 
     :param df:
-        The pandas.DataFrame to be resampled
+        The pandas.DataFrame to be resampled; it won't be modified
     :param freq:
         The new frequency of the resampled time series
     :param data_col:
@@ -60,22 +121,195 @@ def resample_weighted_average(
 
           pandas.Series with weighted averages
 
-    Source: ErnestScribbler, https://stackoverflow.com/a/44683506
+    For fixed frequencies dividing a day, the sums are calculated in a
+    single pass over the data with `numpy.bincount`, see
+    `_resample_sums`.
+
+    Inspired by: ErnestScribbler, https://stackoverflow.com/a/44683506
 
     """
-    # Create a new column with data * weight. The trick is that
-    # this column will be grouped along with the other data and
-    # can thus be used in aggregation:
-    df['data_times_weight'] = df[data_col] * df[weight_col]
-    g = df.resample(freq)
-    avgs = g['data_times_weight'].sum() / g[weight_col].sum()
-    del df['data_times_weight']
+    sums = _resample_sums(df, freq, data_col, weight_col)
+    avgs = sums['data_times_weight'] / sums['weight']
     if include_weights:
         return pd.DataFrame(
-                {data_col: avgs, weight_col: g[weight_col].sum()})
+                {data_col: avgs, weight_col: sums['weight']})
+    else:
+        return avgs
+
+def resample_weighted_average_chunked(
+        chunks, freq, data_col, weight_col, include_weights=False):
+    """Resample a time series given in chunks and return the weighted
+    averages of groups, like `resample_weighted_average`.
+
+    :param chunks:
+        An iterable of pandas.DataFrames with DatetimeIndex, e.g. as
+        returned by `pandas.read_csv(..., chunksize=n)`. The chunks
+        don't need to be sorted.
+    :param freq:
+        The new frequency of the resampled time series
+    :param data_col:
+        Column to take the average of
+    :param weight_col:
+        Column with the weights
+    :param include_weights: (default False)
+        If True, include the summed weights in result
+    :return:
+        like `resample_weighted_average`
+
+    Only the running sums of weights and of weighted data per interval
+    are kept in memory while iterating over *chunks*, so the memory
+    needed is proportional to the size of the result, not to the total
+    size of the input.
+
+    """
+    sums = None
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        chunk_sums = _resample_sums(chunk, freq, data_col, weight_col)
+        if sums is None:
+            sums = chunk_sums
+        else:
+            sums = sums.add(chunk_sums, fill_value=0)
+    if sums is None:
+        sums = pd.DataFrame(
+            {'data_times_weight': [], 'weight': []},
+            index=pd.DatetimeIndex([], tz='UTC', freq=freq))
+    # Insert intervals missing between chunks:
+    sums = sums.asfreq(freq, fill_value=0)
+    avgs = sums['data_times_weight'] / sums['weight']
+    if include_weights:
+        return pd.DataFrame({data_col: avgs, weight_col: sums['weight']})
     else:
         return avgs
 
+# Regular expressions extracting the values of the fields of all trades
+# needed by HistoricDataAPI from a response of Poloniex' trade history:
+_TRADE_FIELDS = {
+    'tradeID': re.compile(r'"tradeID"\s*:\s*"?(\d+)'),
+    'date': re.compile(r'"date"\s*:\s*"([^"]*)"'),
+    'rate': re.compile(r'"rate"\s*:\s*"?([-+.\deE]+)'),
+    'amount': re.compile(r'"amount"\s*:\s*"?([-+.\deE]+)')}
+
+def decode_trades(text):
+    """Decode the JSON *text* of a response to Poloniex' command
+    'returnTradeHistory'.
+
+    Only the fields 'tradeID', 'date', 'rate' and 'amount' are
+    extracted, straight from the text into numpy arrays, without
+    creating Python objects for every trade and all its other fields
+    first, which is several times faster and needs much less memory
+    than parsing the response with `json.loads` or `pandas.read_json`.
+
+    :returns: dict with the keys 'tradeID' (int64), 'date'
+        (datetime64[ns], UTC), 'rate' and 'amount' (float64), each
+        holding an array with one item per trade, in the order of the
+        response.
+
+    A ValueError is raised if the response is an error message or
+    cannot be decoded.
+
+    """
+    count = text.count('{')
+    fields = dict((name, regex.findall(text))
+                  for name, regex in _TRADE_FIELDS.items())
+    if any(len(values) != count for values in fields.values()):
+        # Not a plain list of trades (e.g. an error message) or not
+        # formatted as expected; decode it completely:
+        trades = json.loads(text)
+        if isinstance(trades, dict) and 'error' in trades:
+            raise ValueError(
+                'Poloniex API returned error: {0!s}'.format(trades['error']))
+        try:
+            fields = dict((name, [trade[name] for trade in trades])
+                          for name in _TRADE_FIELDS)
+        except (KeyError, TypeError):
+            raise ValueError('Unexpected response: {0:.200s}'.format(text))
+    return {'tradeID': np.array(fields['tradeID'], dtype=np.int64),
+            'date': np.array(fields['date'], dtype='M8[ns]'),
+            'rate': np.array(fields['rate'], dtype=np.float64),
+            'amount': np.array(fields['amount'], dtype=np.float64)}
+
+# File extensions of compressed csv files, which are decompressed
+# on-the-fly by pandas.read_csv; they can't be read incrementally:
+_COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.zip', '.xz')
+
+# Keys of the dicts returned by _csv_position:
+_POSITION_KEYS = ('csv_offset', 'csv_last_line', 'last_time')
+
+def _csv_position(file_name, offset=None):
+    """Return a dict describing how far the csv file *file_name* has
+    been read, if it has been read up to byte *offset* (default: up
+    to the end), for incremental updates.
+
+    The dict has the keys 'csv_offset', 'csv_last_line' (the last line
+    read) and 'last_time' (its timestamp in nanoseconds, UTC). It is
+    empty if no complete line ends at *offset*.
+
+    """
+    with io.open(file_name, 'rb') as f:
+        if offset is None:
+            offset = f.seek(0, io.SEEK_END)
+        start = max(0, offset - 4096)
+        f.seek(start)
+        block = f.read(offset - start)
+    if len(block) < offset - start or not block.endswith(b'\n'):
+        return {}
+    line = block[:-1].rsplit(b'\n', 1)[-1].decode('ascii').strip()
+    try:
+        last_time = int(float(line.split(',')[0]) * 10**9)
+    except ValueError:
+        return {}
+    return {'csv_offset': offset, 'csv_last_line': line,
+            'last_time': last_time}
+
+def _level_key(freq):
+    """Return a key identifying the length of intervals *freq*, which
+    is the same for equivalent offsets, e.g. 'H' and '60min': the
+    length in nanoseconds for fixed frequencies, otherwise the name
+    of the frequency.
+
+    """
+    offset = pd.tseries.frequencies.to_offset(freq)
+    try:
+        return offset.nanos
+    except ValueError:
+        # not a fixed frequency, e.g. 'M':
+        return offset.freqstr
+
+def _to_epoch_ns(dtimes):
+    """Convert *dtimes* to a numpy int64 array of nanoseconds since
+    the epoch (UTC).
+
+    :param dtimes: array-like of datetimes (anything understood by
+        `pandas.to_datetime`) or of unix timestamps (seconds, as
+        integers or floats). Datetimes without timezone information
+        are interpreted as UTC.
+
+    """
+    if (isinstance(dtimes, (pd.DatetimeIndex, pd.Series))
+            and pd.api.types.is_datetime64_any_dtype(dtimes)):
+        # (Converted directly, since np.asarray would convert
+        # tz-aware datetimes to an object array of Timestamps:)
+        return pd.DatetimeIndex(dtimes).asi8
+    arr = np.ravel(np.asarray(dtimes))
+    if arr.dtype.kind in 'iu':
+        # unix timestamps, given in seconds:
+        return arr.astype(np.int64) * 10 ** 9
+    if arr.dtype.kind == 'f':
+        # unix timestamps in seconds, maybe with fractions (e.g. from
+        # `time.time()`), which must not be read as nanoseconds:
+        if np.isnan(arr).any():
+            raise ValueError('Timestamps must not be NaN.')
+        # (The whole seconds are converted separately, since float64
+        # is not precise enough for nanoseconds since the epoch:)
+        seconds = np.floor(arr)
+        return (seconds.astype(np.int64) * 10 ** 9
+                + np.round((arr - seconds) * 10 ** 9).astype(np.int64))
+    if arr.dtype.kind == 'M':
+        return arr.astype('M8[ns]').view(np.int64)
+    return pd.to_datetime(arr, utc=True).asi8
+
 class HistoricData(object):
     def __init__(self, unit):
         """Create a HistoricData object with no data.
@@ -87,7 +321,16 @@ class HistoricData(object):
         `HistoricDataCSV` or `HistoricDataAPI`.
 
         To manually set data, self.data must be a pandas time series
-        with a fixed frequency.
+        with a fixed frequency, i.e. a dense series with a price for
+        every interval. Alternatively, self.data can be a sparse
+        series, containing only the intervals with trades, in which
+        case self.interval must be set to the length of the intervals
+        (see `get_price`).
+
+        If *self.max_staleness* is set to a pandas.Timedelta (default
+        None), looking up prices in sparse data raises a ValueError
+        if the last trade before the requested time is older than
+        this.
 
         """
         try:
@@ -98,24 +341,177 @@ class HistoricData(object):
                     'in the correct form, e.g. "EUR/USD"')
         self.unit = self.cto + '/' + self.cfrom
         self.interval = None
+        self.max_staleness = None
         self.data = None
 
-    def prepare_request(self, dtime):
+    def prepare_request(self, dtime, resolution=None):
         """Return a Pandas DataFrame which contains the data at the
-        requested datetime *dtime*.
+        requested datetime *dtime*, with intervals of length
+        *resolution* (default: `self.interval`).
 
         """
+        self._check_resolution(resolution)
         return self.data
 
-    def get_price(self, dtime):
-        """Return the price at datetime *dtime*"""
-        df = self.prepare_request(dtime)
-        return df.at[pd.Timestamp(dtime).floor(df.index.freq)]
+    def data_source(self, dtime):
+        """Return where the price at datetime *dtime* would be looked
+        up, without looking it up:
+
+        - 'memory': in data already loaded,
+        - 'disk': in a file (e.g. a cache) that must be loaded first,
+        - 'network': from an API,
+        - None: the price is known not to be available.
+
+        """
+        if self.data is None or not self._covers(
+                self.data, pd.Timestamp(dtime)):
+            return None
+        return 'memory'
+
+    def _check_resolution(self, resolution):
+        """Raise a ValueError unless *resolution* is None or equal to
+        `self.interval`.
+
+        """
+        if resolution is not None and (
+                self.interval is None
+                or _level_key(resolution) != _level_key(self.interval)):
+            raise ValueError(
+                'Prices of {0:s} are not available with a resolution '
+                'of {1!s}'.format(self.unit, resolution))
+
+    def _interval(self, df, resolution=None):
+        """Return the length of the intervals of the data *df*, which
+        has been requested with *resolution*.
+
+        """
+        if df.index.freq is not None:
+            return df.index.freq
+        return pd.tseries.frequencies.to_offset(resolution or self.interval)
+
+    def _covers(self, df, dtime):
+        """Return whether the data *df* covers the datetime *dtime*,
+        i.e. whether *dtime* lies between the start of the first and
+        the end of the last interval of *df*.
+
+        """
+        return (len(df) > 0 and df.index[0] <= dtime
+                and dtime < df.index[-1] + self._interval(df))
+
+    def _lookup(self, df, times, resolution=None):
+        """Return the prices in the data *df* at *times*.
+
+        :param times: sorted numpy array of nanoseconds since the epoch
+        :param resolution: the resolution *df* has been requested with
+        :returns: numpy.ndarray with the price of the last interval
+            in *df* beginning before or at each time (which is the same
+            for dense or sparse data).
+
+        A KeyError is raised if *df* does not cover all *times*, a
+        ValueError if `self.max_staleness` is set and a price is more
+        stale than that.
+
+        """
+        index = df.index.asi8
+        end = (df.index[-1] + self._interval(df, resolution)).value
+        if not index[0] <= times[0] or not times[-1] < end:
+            raise KeyError(pd.Timestamp(
+                times[0] if times[0] < index[0] else times[-1], tz='UTC'))
+        pos = np.searchsorted(index, times, side='right') - 1
+        if self.max_staleness is not None:
+            # The age of the prices is measured from the last interval
+            # with trades, not from intervals filled up without trades:
+            traded = self._traded_intervals(df, resolution)
+            last = traded[np.maximum(
+                np.searchsorted(traded, times, side='right') - 1, 0)]
+            stale = np.flatnonzero(
+                times - last > pd.Timedelta(self.max_staleness).value)
+            if len(stale):
+                raise ValueError(
+                    'The last price of {0:s} known at {1!s} is from '
+                    '{2!s}, older than the maximum staleness {3!s}'.format(
+                        self.unit, pd.Timestamp(times[stale[0]], tz='UTC'),
+                        pd.Timestamp(last[stale[0]], tz='UTC'),
+                        pd.Timedelta(self.max_staleness)))
+        return df.values[pos]
+
+    def _traded_intervals(self, df, resolution=None):
+        """Return the starts of the intervals with trades in the data
+        *df*, requested with *resolution*, as sorted numpy array of
+        nanoseconds since the epoch. Since it is unknown which
+        intervals of dense data were filled up, these are all
+        intervals of *df*.
+
+        """
+        return df.index.asi8
+
+    def get_price(self, dtime, resolution=None):
+        """Return the price at datetime *dtime*.
+
+        If the data is sparse, i.e. only contains the intervals with
+        trades, the price of the last interval with trades before
+        *dtime* is returned, which is the same price a dense series,
+        forward-filled in all intervals without trades, would contain.
+
+        :param resolution: The length of the intervals the prices are
+            averaged over, e.g. 'H' or '1min'. The default (None) is
+            `self.interval`. Other resolutions are only available from
+            `HistoricDataCSV`, see its parameter *resolutions*.
+
+        """
+        df = self.prepare_request(dtime, resolution)
+        if df.index.freq is not None and self.max_staleness is None:
+            return df.at[pd.Timestamp(dtime).floor(df.index.freq)]
+        return self._lookup(
+            df, np.array([pd.Timestamp(dtime).value]), resolution)[0]
+
+    def get_prices(self, dtimes, resolution=None):
+        """Return the prices at all datetimes in *dtimes* at once.
+
+        :param dtimes: array-like of datetimes or of unix timestamps
+            (seconds since the epoch, UTC). Datetimes
+            without timezone information are interpreted as UTC.
+        :param resolution: see `get_price`
+        :returns: numpy.ndarray with the prices, in the same order
+            as *dtimes*.
+
+        This gives the same results as calling `get_price` for each
+        item in *dtimes*, but the data is only requested once for each
+        chunk of data returned by `prepare_request` (i.e. once in total
+        for data loaded from csv, once per day for data fetched from an
+        API), and all prices in a chunk are looked up with a single
+        `numpy.searchsorted` call. Like `get_price`, a KeyError is
+        raised if a datetime is not covered by the available data.
+
+        """
+        times = _to_epoch_ns(dtimes)
+        order = np.argsort(times, kind='mergesort')
+        stimes = times[order]
+        result = None
+        i = 0
+        while i < len(stimes):
+            dtime = pd.Timestamp(stimes[i], tz='UTC')
+            df = self.prepare_request(dtime, resolution)
+            # The data covers the range up to the end of its last interval:
+            end = (df.index[-1] + self._interval(df, resolution)).value
+            j = max(i + 1, np.searchsorted(stimes, end, side='left'))
+            values = self._lookup(df, stimes[i:j], resolution)
+            if result is None:
+                result = np.empty(len(times), dtype=values.dtype)
+            result[order[i:j]] = values
+            i = j
+        if result is None:
+            return np.empty(0)
+        return result
 
 
 class HistoricDataCSV(HistoricData):
+    # Is loading the data still pending (see `_load`)?
+    _pending = False
 
-    def __init__(self, file_name, unit, interval='H'):
+    def __init__(self, file_name, unit, interval='H', chunksize=None,
+                 backend='hdf5', sparse=True, max_staleness=None,
+                 resolutions=(), lazy=False, window=None):
         """Initialize a HistoricData object with data loaded from a csv
         file. The unit must be a string given in the form
         'currency_one/currency_two', e.g. 'EUR/BTC'.
@@ -135,72 +531,594 @@ class HistoricDataCSV(HistoricData):
         the first time it is loaded and used transparently the next
         time an HistoricData object is created with the same csv. If
         the csv file is newer than the HDF5 file, the latter will be
-        updated.
+        updated. Besides the trading data, the HDF5 file also holds
+        the resampled data for each *interval* used.
+
+        Instead of HDF5, another storage *backend* can be chosen, see
+        `storage.backends`, e.g. 'npy', which saves the data as raw
+        numpy arrays in a folder ending in '.npyd' and loads them
+        memory-mapped, i.e. almost instantaneously.
+
+        If *chunksize* is given, the csv file (or HDF5 file) is read
+        in chunks of *chunksize* lines and resampled on-the-fly (see
+        `resample_weighted_average_chunked`), so that the full trading
+        data never needs to be loaded into memory at once. This is
+        recommended for huge csv files. The HDF5 file will then be
+        created in 'table' format, which can also be read in chunks.
+
+        Csv files from bitcoincharts.com are only ever appended to.
+        Therefore, the cache also records how far an uncompressed csv
+        file has been read (byte offset, last line and last timestamp).
+        If the csv file has been modified since, but only by appending
+        lines, only these new lines are parsed and merged into the
+        cached resampled data, which is much faster than parsing the
+        whole file again. (The cached trading data is then discarded,
+        since it is only needed to resample the data with another
+        *interval*.)
+
+        Only the intervals containing trades are kept (in memory and in
+        the cache), i.e. the data is *sparse*, which saves a lot of
+        memory for currency pairs that are traded rarely. The price at
+        a time without trades is the price of the last interval with
+        trades before. If *max_staleness* (a pandas.Timedelta or a
+        string like '3 days') is given, requesting a price at a time
+        more than *max_staleness* after the last trade raises a
+        ValueError, instead of returning an outdated price. If *sparse*
+        is False, the data is filled up with all intervals without
+        trades, forward-filled with the last price before (this was
+        the only option in previous versions of ccGains); the time
+        since the last trade is still checked against *max_staleness*.
+
+        The prices are kept in a pyramid of *levels*, one for each
+        resolution (length of intervals) in *resolutions*, e.g.
+        `resolutions=('min', 'D')`, besides *interval*, which is the
+        default resolution of `get_price`. Only the finest level is
+        resampled from the trading data (and cached); the others are
+        aggregated from the finer levels, which takes no time in
+        comparison. Prices with another resolution can then be
+        requested with `get_price(dtime, resolution)`. Levels missing
+        in the pyramid are added on first request, as long as their
+        resolution is a multiple of the finest resolution (see
+        `level`).
+
+        If *lazy* is True, nothing is loaded until the data is needed,
+        i.e. on the first call of `get_price` (or access of `data`),
+        so creating HistoricDataCSV objects for currency pairs that
+        might never be requested costs no time. A *window*, i.e. a
+        tuple `(start, end)` of datetimes (None for no limit), restricts
+        the prices kept in memory to the intervals from *start* to *end*
+        (both inclusive), e.g. to the tax year under analysis. If the
+        resampled data is cached already, only these rows are read from
+        the cache (see `storage.HDF5Store.get_range`). Prices before the
+        first interval with trades in the window are not available;
+        the window should also be aligned to the coarsest resolution,
+        since its first and last intervals are aggregated only from
+        the trades inside the window.
 
         """
         super(HistoricDataCSV, self).__init__(unit)
         self.interval = interval
+        self.max_staleness = max_staleness
+        self.sparse = sparse
+        # The finest resolution, which will be resampled from the
+        # trading data:
+        fixed = [r for r in (interval,) + tuple(resolutions)
+                 if isinstance(_level_key(r), int)]
+        self.base_interval = min(fixed, key=_level_key) if fixed else interval
         self.dataset = '{0:s}_{1:s}'.format(self.cto, self.cfrom)
 
-        fbase, fext = path.splitext(file_name)
-        if fext != '.h5':
-            # For faster loading, convert 'csv' file to HDF5 and load the
-            # latter, unless the 'csv' file is newer:
+        self.backend = get_backend(backend)
+        self.csv_file = file_name
+        self.file_name = path.splitext(file_name)[0] + self.backend.extension
+        self.resampled_key = self.dataset + '_' + ''.join(
+                c if c.isalnum() else '_' for c in str(self.base_interval))
+        if self._mtimes() == (0, 0):
+            raise IOError('File does not exist: %s' % file_name)
+        self.chunksize = chunksize
+        self.resolutions = tuple(resolutions)
+        self.window = tuple(
+            None if t is None else pd.Timestamp(_to_epoch_ns(t)[0], tz='UTC')
+            for t in (window or (None, None)))
+
+        # The pyramid of weighted prices and total volumes for each
+        # resolution (see `level`), and the prices of each level (see
+        # `level_prices`), filled by `_load`:
+        self.levels = {}
+        self._level_prices = {}
+        self._pending = True
+        if not lazy:
+            self._load()
+
+        # Don't change self.data's DateTimeIndex into PeriodIndex since
+        # periods don't support timezones, which we want to keep.
+        # (https://github.com/pandas-dev/pandas/issues/2106)
+
+    @property
+    def data(self):
+        """The prices with resolution `interval` (see `level_prices`).
+        Accessing them loads the data, if not done yet."""
+        if self._pending:
+            self._load()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def data_source(self, dtime):
+        """Return where the price at datetime *dtime* would be looked
+        up (see `HistoricData.data_source`). This does not load the
+        data, so 'disk' is returned if loading it is still pending.
+
+        """
+        if self._pending:
+            return 'disk'
+        return super(HistoricDataCSV, self).data_source(dtime)
+
+    def _mtimes(self):
+        """Return the modification times of the csv file and of the
+        cache file (0 for files that do not exist). If the csv file is
+        the cache file, its modification time is returned as 0.
+
+        """
+        if path.splitext(self.csv_file)[1] == self.backend.extension:
+            # Use the cache file only:
+            csvtime = 0
+        else:
             try:
-                csvtime = path.getmtime(file_name)
+                csvtime = path.getmtime(self.csv_file)
             except OSError:
                 csvtime = 0
+        return csvtime, self.backend.getmtime(self.file_name)
+
+    def _load(self):
+        """Load the resampled data from the cache or the csv file,
+        updating the cache if needed, and build the price pyramid
+        (see `__init__`). If this fails, it is tried again (raising the
+        error again) when the data is accessed next time.
+
+        """
+        # (Not pending anymore while loading, since the data is
+        # accessed to build the pyramid:)
+        self._pending = False
+        try:
+            self._load_levels()
+        except BaseException:
+            self._pending = True
+            raise
+
+    def _load_levels(self):
+        """Do the actual work of `_load`."""
+        file_name = self.csv_file
+        chunksize = self.chunksize
+        # The data resampled with interval, including the summed
+        # volumes (pandas.DataFrame), once it is available:
+        resampled = None
+        # Must the resampled data be saved to the cache?
+        save_resampled = True
+        # Has it been loaded from the cache as it is?
+        cached = False
+        # For faster loading, convert 'csv' file to HDF5 and load the
+        # latter, unless the 'csv' file is newer:
+        csvtime, h5time = self._mtimes()
+        if (csvtime, h5time) == (0, 0):
+            # (deleted after a lazy initialization)
+            raise IOError('File does not exist: %s' % file_name)
+        # How far the csv will have been read, to allow incremental
+        # updates later on:
+        incremental = (csvtime and not path.splitext(
+            file_name)[1].lower() in _COMPRESSED_EXTENSIONS)
+        position = _csv_position(file_name) if incremental else {}
+
+        if csvtime <= h5time:
+            # Quick load from h5 file, but only if data matches:
             try:
-                h5time = path.getmtime(fbase + '.h5')
-            except OSError:
+                with self.backend(self.file_name, mode='r') as store:
+                    resampled = self._load_resampled(store, csvtime)
+                    if resampled is not None:
+                        save_resampled = False
+                        cached = True
+                        log.debug('Loaded resampled data for %s from %s',
+                                  self.unit, self.file_name)
+                    elif chunksize and store.is_appendable(self.dataset):
+                        resampled = resample_weighted_average_chunked(
+                            store.select(self.dataset, chunksize=chunksize),
+                            self.base_interval, self.unit, 'volume',
+                            include_weights=True)
+                    else:
+                        trades = store.get(self.dataset)
+            except (KeyError, AttributeError, IOError):
+                # Will force csv to be reloaded:
                 h5time = 0
-            if csvtime == 0 and h5time == 0:
-                raise IOError('File does not exist: %s' % file_name)
 
-            if csvtime <= h5time:
-                # Quick load from h5 file, but only if data matches:
-                self.file_name = fbase + '.h5'
-                try:
-                    with pd.HDFStore(self.file_name, mode='r') as store:
-                        self.data = store[self.dataset]
-                except (KeyError, AttributeError, IOError):
-                    # Will force csv to be reloaded:
-                    h5time = 0
-
-            if csvtime > h5time:
-                self.data = pd.read_csv(
-                        file_name,
-                        header=None, index_col='time',
-                        names=['time', self.unit, 'volume'])
-                # parse timestamps:
-                # (quicker than doing it directly in pd.read_csv)
-                self.data.index = pd.to_datetime(
-                        self.data.index, unit='s', utc=True)
-                # sort the data by time:
-                self.data.sort_index(inplace=True)
-                # create new HDF5 file:
-                self.file_name = fbase + '.h5'
-                with pd.HDFStore(self.file_name) as store:
-                    store[self.dataset] = self.data
-
-        # Get weighted prices, resampled with interval:
-        # (this will only return one column, the weighted prices; the
-        # total volume won't be needed anymore)
-        self.data = resample_weighted_average(
-                self.data, interval, self.unit, 'volume')
-
-        # In case the data has been upsampled (Some events beeing more
-        # separated than interval), the resulting Series will have some
-        # NaNs. Forward-fill them with the last prices before:
-        self.data.ffill(inplace=True)
+        if csvtime > h5time and incremental:
+            # Try to parse only the lines appended to the csv:
+            resampled = self._update_resampled(file_name, csvtime)
+            if resampled is not None:
+                save_resampled = False
+                h5time = csvtime
 
-        # Don't change self.data's DateTimeIndex into PeriodIndex since
-        # periods don't support timezones, which we want to keep.
-        # (https://github.com/pandas-dev/pandas/issues/2106)
+        if csvtime > h5time and chunksize:
+            with self.backend(self.file_name) as store:
+                if self.dataset in store:
+                    store.remove(self.dataset)
+                resampled = resample_weighted_average_chunked(
+                    self._iter_csv_chunks(file_name, chunksize, store),
+                    self.base_interval, self.unit, 'volume',
+                    include_weights=True)
+        elif csvtime > h5time:
+            trades = pd.read_csv(
+                    file_name,
+                    header=None, index_col='time',
+                    names=['time', self.unit, 'volume'])
+            # parse timestamps:
+            # (quicker than doing it directly in pd.read_csv)
+            trades.index = pd.to_datetime(
+                    trades.index, unit='s', utc=True)
+            # sort the data by time:
+            trades.sort_index(inplace=True)
+            # create new cache file:
+            with self.backend(self.file_name) as store:
+                store.put(self.dataset, trades)
+
+        if resampled is None:
+            # Get weighted prices, resampled with interval:
+            resampled = resample_weighted_average(
+                    trades, self.base_interval, self.unit, 'volume',
+                    include_weights=True)
+        if not cached:
+            # Don't keep intervals without trades (the cached data
+            # doesn't contain any and is not filtered again, so it is
+            # not copied if memory-mapped):
+            resampled = resampled[resampled[self.unit].notnull()]
+        if position and path.getsize(file_name) != position['csv_offset']:
+            # The csv grew while it was parsed, so lines after the
+            # position might have been parsed already; don't allow to
+            # parse them again in an incremental update:
+            position = {}
+        if save_resampled:
+            attrs = {'csv_mtime': csvtime}
+            attrs.update(position)
+            with self.backend(self.file_name) as store:
+                store.put(self.resampled_key, resampled, attrs=attrs,
+                          indexed=True)
+        if not cached:
+            # (Already done when loading from the cache)
+            resampled = _slice(resampled, *self.window)
+
+        self.levels = {_level_key(self.base_interval): resampled}
+        self._level_prices = {}
+        for resolution in self.resolutions:
+            self.level(resolution)
+        self.data = self.level_prices(self.interval)
+
+    def level(self, resolution):
+        """Return the level of the price pyramid with *resolution*.
+
+        :param resolution: The length of the intervals, e.g. 'H'
+        :returns: pandas.DataFrame with the weighted average prices
+            (column `self.unit`) and the total volumes traded (column
+            'volume') in all intervals containing trades.
+
+        If the level is not in the pyramid yet, it is aggregated from
+        the coarsest level whose resolution divides *resolution* and
+        added to the pyramid. A ValueError is raised if there is no
+        such level, e.g. if *resolution* is finer than the finest
+        resolution of the pyramid.
+
+        """
+        if self._pending:
+            self._load()
+        key = _level_key(resolution)
+        if key not in self.levels:
+            # Finer levels whose intervals nest in the new ones:
+            candidates = [
+                k for k in self.levels if isinstance(k, int) and (
+                    key % k == 0 if isinstance(key, int)
+                    else (86400 * 10 ** 9) % k == 0)]
+            if not candidates:
+                raise ValueError(
+                    'Prices of {0:s} with a resolution of {1!s} cannot '
+                    'be calculated from the available resolutions; '
+                    'please include it in the parameter *resolutions* '
+                    'of HistoricDataCSV.'.format(self.unit, resolution))
+            level = resample_weighted_average(
+                self.levels[max(candidates)], resolution, self.unit,
+                'volume', include_weights=True)
+            self.levels[key] = level[level[self.unit].notnull()]
+        return self.levels[key]
+
+    def level_prices(self, resolution):
+        """Return the prices of the level of the price pyramid with
+        *resolution* (see `level`), as pandas.Series; if `self.sparse`
+        is False, forward-filled in all intervals without trades.
+
+        """
+        key = _level_key(resolution)
+        if key not in self._level_prices:
+            prices = self.level(resolution)[self.unit]
+            if not self.sparse:
+                # Insert the intervals without trades and forward-fill
+                # them with the last prices before:
+                prices = prices.asfreq(resolution).ffill()
+            self._level_prices[key] = prices
+        return self._level_prices[key]
+
+    def prepare_request(self, dtime, resolution=None):
+        """Return a Pandas Series which contains the prices at the
+        requested datetime *dtime* with *resolution* (default:
+        `self.interval`).
+
+        """
+        if resolution is None:
+            return self.data
+        return self.level_prices(resolution)
+
+    def _traded_intervals(self, df, resolution=None):
+        """Return the starts of the intervals with trades in the data
+        *df*, requested with *resolution*, as sorted numpy array of
+        nanoseconds since the epoch. For dense data, these are the
+        intervals of the (sparse) level of the price pyramid.
+
+        """
+        if self.sparse:
+            return df.index.asi8
+        return self.level(resolution or self.interval).index.asi8
+
+    def _load_resampled(self, store, csvtime):
+        """Return the resampled data cached in *store* or None, if it
+        is not available or was created from a csv file with another
+        modification time than *csvtime* (0 if unknown).
+
+        """
+        if self.resampled_key not in store:
+            return None
+        attrs = store.get_attrs(self.resampled_key)
+        if csvtime and attrs.get('csv_mtime') != csvtime:
+            return None
+        return store.get_range(self.resampled_key, *self.window)
+
+    def _update_resampled(self, file_name, csvtime):
+        """Parse the lines appended to the csv *file_name* since the
+        resampled data in the cache was created, merge them into the
+        latter and save the result to the cache.
+
+        :returns: the updated resampled data, or None if the cache
+            holds no resampled data that can be updated, e.g. because
+            the csv file has been modified other than by appending.
+
+        """
+        try:
+            with self.backend(self.file_name) as store:
+                if self.resampled_key not in store:
+                    return None
+                attrs = store.get_attrs(self.resampled_key)
+                offset = attrs.get('csv_offset')
+                if offset is None or _csv_position(
+                        file_name, offset) != dict(
+                            (k, attrs.get(k)) for k in _POSITION_KEYS):
+                    return None
+                tail, position = self._read_csv_tail(file_name, offset)
+                resampled = store.get(self.resampled_key)
+                if len(tail):
+                    if not len(resampled) or tail.index.min() < max(
+                            pd.Timestamp(attrs['last_time'], tz='UTC'),
+                            resampled.index[-1]):
+                        # Not appended in chronological order:
+                        return None
+                    resampled = self._merge_tail(resampled, tail)
+                attrs.update(position)
+                attrs['csv_mtime'] = csvtime
+                store.put(self.resampled_key, resampled, attrs=attrs,
+                          indexed=True)
+                # The trading data is outdated now:
+                if self.dataset in store:
+                    store.remove(self.dataset)
+        except (KeyError, AttributeError, IOError, ValueError):
+            return None
+        log.debug('Appended %i trades from %s to cached data for %s',
+                  len(tail), file_name, self.unit)
+        return resampled
+
+    def _read_csv_tail(self, file_name, offset):
+        """Parse the complete lines of the csv *file_name* starting
+        at byte *offset*.
+
+        :returns: tuple `(data, position)`, where `data` is a
+            pandas.DataFrame like the one parsed from the whole file
+            and `position` is a dict like the one returned by
+            `_csv_position` for the end of the parsed lines.
+
+        """
+        with io.open(file_name, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        # Skip an incomplete line that is still being written:
+        tail = tail[:tail.rfind(b'\n') + 1]
+        if not tail:
+            return pd.DataFrame(), {}
+        data = pd.read_csv(
+                io.BytesIO(tail),
+                header=None, index_col='time',
+                names=['time', self.unit, 'volume'])
+        data.index = pd.to_datetime(data.index, unit='s', utc=True)
+        return data, _csv_position(file_name, offset + len(tail))
+
+    def _merge_tail(self, resampled, tail):
+        """Return the resampled data *resampled* (see
+        `resample_weighted_average` with `include_weights=True`) with
+        the new trades *tail* merged into it. Only trailing intervals
+        need to be recalculated, since no trade in *tail* is older than
+        the last interval in *resampled*.
+
+        """
+        tail_sums = _resample_sums(
+                tail, self.base_interval, self.unit, 'volume')
+        # Recalculate the intervals from the first one that gets new
+        # trades:
+        i = resampled.index.searchsorted(tail_sums.index[0])
+        trailing = resampled.iloc[i:]
+        sums = pd.DataFrame(
+            {'data_times_weight':
+                (trailing[self.unit] * trailing['volume']).fillna(0),
+             'weight': trailing['volume']}).add(tail_sums, fill_value=0)
+        merged = pd.concat([
+            resampled.iloc[:i],
+            pd.DataFrame(
+                {self.unit: sums['data_times_weight'] / sums['weight'],
+                 'volume': sums['weight']},
+                columns=resampled.columns)])
+        return merged[merged[self.unit].notnull()]
+
+    def _iter_csv_chunks(self, file_name, chunksize, store):
+        """Read the csv *file_name* in chunks of *chunksize* lines,
+        append each chunk to *store* and yield it.
+
+        """
+        for chunk in pd.read_csv(
+                file_name, header=None, index_col='time',
+                names=['time', self.unit, 'volume'], chunksize=chunksize):
+            chunk.index = pd.DatetimeIndex(
+                    pd.to_datetime(chunk.index, unit='s', utc=True),
+                    name='time')
+            store.append(self.dataset, chunk)
+            yield chunk
+
+
+def write_month_index(file_name, days):
+    """Write the index file of the HistoricDataAPI cache *file_name*,
+    the manifest of all cached days.
+
+    :param days: dict with the keys (`dYYYYMMDD`) of all cached days
+        as keys and dicts describing the cached data as values, with
+        the (optional) items 'fetched' (UNIX time the day was fetched
+        from the API), 'rows' (number of saved prices; 0 for days
+        known to have no trades) and 'checksum' (see `day_checksum`).
+        An iterable of keys is accepted as well.
+
+    The file is replaced atomically, so it is never read half-written.
+    To keep days recorded by other processes sharing the cache, use
+    `update_month_index` instead.
+
+    """
+    if not isinstance(days, dict):
+        days = dict((key, {}) for key in days)
+    index_file = file_name + '.index.json'
+    # (A temporary file of its own for each process writing it:)
+    tmp = '%s.%i.tmp' % (index_file, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'layout': 'monthly', 'days': days}, f, sort_keys=True)
+    _replace(tmp, index_file)
+
+def update_month_index(file_name, days, removed=()):
+    """Update the index file of the HistoricDataAPI cache *file_name*
+    (see `write_month_index`) with the entries of the dict *days* and
+    without the days with keys in *removed*. The index file is read
+    again right before, so days recorded in it by other processes in
+    the meantime are kept.
+
+    :returns: the updated manifest
+
+    """
+    manifest = read_month_index(file_name)
+    for key in removed:
+        manifest.pop(key, None)
+    manifest.update(days)
+    write_month_index(file_name, manifest)
+    return manifest
+
+def read_month_index(file_name):
+    """Return the manifest of the HistoricDataAPI cache *file_name*
+    (see `write_month_index`), or an empty dict if there is none.
+
+    """
+    index_file = file_name + '.index.json'
+    if not path.exists(index_file):
+        return {}
+    with open(index_file) as f:
+        days = json.load(f)['days']
+    if not isinstance(days, dict):
+        # index file written by an earlier version, listing only keys:
+        days = dict((key, {}) for key in days)
+    return days
+
+def day_checksum(data):
+    """Return a checksum of the prices *data* of a day, as saved in the
+    manifest of the HistoricDataAPI cache (see `write_month_index`).
+
+    """
+    checksum = hashlib.sha1(np.ascontiguousarray(data.index.asi8))
+    checksum.update(np.ascontiguousarray(data.values, dtype=np.float64))
+    return checksum.hexdigest()
+
+def migrate_day_cache(file_name, backend='hdf5'):
+    """Migrate the HistoricDataAPI cache *file_name* from the old
+    layout, with one key `dYYYYMMDD` per day, to the current layout,
+    with one key `mYYYYMM` per month and an index file listing all
+    cached days (see `write_month_index`).
+
+    HistoricDataAPI calls this automatically when it opens a cache
+    without index file. The migration can be repeated safely if it
+    was interrupted.
+
+    :param file_name: The cache file (or folder, depending on the
+        storage *backend*), e.g. 'Poloniex_BTC_XMR_H.h5'
+    :param backend: The storage backend used for the cache, see
+        `storage.backends`
+    :returns: the number of migrated days
+
+    """
+    backend = get_backend(backend)
+    day_key = re.compile(r'^d(\d{6})\d{2}$')
+    days = set()
+    with backend(file_name, mode='a') as store:
+        keys = store.keys()
+        months = {}
+        for key in keys:
+            match = day_key.match(key)
+            if match:
+                months.setdefault(match.group(1), []).append(key)
+        for month, month_days in sorted(months.items()):
+            # Include the days of a previous, interrupted migration:
+            parts = [store.get('m' + month)] if 'm' + month in store else []
+            parts.extend(store.get(key) for key in sorted(month_days))
+            data = pd.concat(parts)
+            data = data[~data.index.duplicated(keep='last')].sort_index()
+            store.put('m' + month, data)
+            for key in month_days:
+                store.remove(key)
+        day_ns = 86400 * 10 ** 9
+        for key in store.keys():
+            if key.startswith('m'):
+                days.update(
+                    pd.Timestamp(d * day_ns).strftime('d%Y%m%d') for d in
+                    np.unique(store.get(key).index.asi8 // day_ns))
+    write_month_index(file_name, days)
+    migrated = sum(len(d) for d in months.values())
+    if migrated:
+        log.info('Migrated %i days of cached data in %s to monthly keys',
+                 migrated, file_name)
+    return migrated
 
 
 class HistoricDataAPI(HistoricData):
-    def __init__(self, cache_folder, unit, interval='H'):
+    # In-memory cache of day frames loaded from disk or fetched from
+    # the API, shared by all instances (see `__init__`):
+    day_cache = LRUCache(max_entries=1000)
+    # The manifests of all cache files, shared by all instances (see
+    # `_manifest`), and a lock guarding them and all writes to the
+    # cache files:
+    _indexes = {}
+    _index_lock = threading.RLock()
+    # The API's ticker, shared by all instances (see `_get_ticker`):
+    _tickers = {}
+    _ticker_lock = threading.Lock()
+
+    def __init__(self, cache_folder, unit, interval='H', day_cache=None,
+                 rate_limiter=None, backend='hdf5', session=None,
+                 retries=3, backoff_factor=1.0, ticker_ttl=86400,
+                 sparse=True, max_staleness=None, transport=None,
+                 url='https://poloniex.com/public'):
         """Initialize a HistoricData object which tranparently fetch data
         on request (`get_price`) from the public Poloniex API:
         https://poloniex.com/public?command=returnTradeHistory
@@ -208,7 +1126,17 @@ class HistoricDataAPI(HistoricData):
         For faster loading times on future calls, a HDF5 file is created
         from the requested data and used transparently the next time a
         request for the same day and pair is made. These HDF5 files are
-        saved in *cache_folder*.
+        saved in *cache_folder*. The data is saved with one key per
+        month, plus an index file (with the same name as the HDF5 file,
+        ending in '.index.json'), the manifest of all days saved, so
+        that the time needed to look up data does not grow with the
+        number of days cached. The manifest also records days without
+        any trades, which are not requested again, and the time each
+        day was fetched and a checksum of its data, so incomplete or
+        corrupted days are fetched again (see `cache_status`). Caches
+        created by earlier versions of ccGains, with one key per day,
+        are migrated automatically when opened (see
+        `migrate_day_cache`).
 
         The *unit* must be a string given in the form
         'currency_one/currency_two', e.g. 'EUR/BTC'.
@@ -218,30 +1146,105 @@ class HistoricDataAPI(HistoricData):
         http://pandas.pydata.org/pandas-docs/stable/timeseries.html#offset-aliases
         for possible values.
 
+        Each day of data loaded from the HDF5 file or fetched from the
+        API is also kept in memory in *day_cache*, so repeated requests
+        for the same day don't need to access the disk. If *day_cache*
+        is None (default), the class attribute
+        `HistoricDataAPI.day_cache` is used, an `LRUCache` shared by
+        all HistoricDataAPI objects and holding up to 1000 days. Supply
+        your own `LRUCache` to change the bounds or eviction policy
+        for this object. The cache's `hits`, `misses` and `evictions`
+        attributes count its usage.
+
+        All requests to the API are rate limited by *rate_limiter*, a
+        `network.TokenBucket`. If None (default), the TokenBucket
+        registered for the API's URL is used, which is shared by all
+        HistoricDataAPI objects (and threads) in this process and
+        allows 6 requests per second.
+
+        The requests are made with *session*, a `requests.Session`. If
+        None (default), the session registered for the API's URL is
+        used (see `network.get_session`), which is shared by all
+        HistoricDataAPI objects, so open connections are reused.
+        Requests failing because of a connection error, a timeout or
+        an overloaded server are repeated up to *retries* times,
+        waiting `backoff_factor * 2 ** (n - 1)` seconds before the n-th
+        retry (see `network.api_get`).
+
+        Instead, a *transport* can be supplied, which makes all
+        requests (see `network.HTTPTransport`), e.g. a
+        `network.RecordingTransport` to save all responses to fixture
+        files, or a `network.ReplayTransport` to answer requests with
+        recorded responses, without network access. *url* is the URL of
+        the Poloniex API; another server providing the same API (like
+        the local stand-in used for ccGains' tests) can be used.
 
+        If the currency pair is not cached yet, the API's ticker is
+        needed to find out whether the pair (or the flipped pair) is
+        available. The ticker is saved in *cache_folder* too, in
+        'Poloniex_ticker.json', and kept in memory for all
+        HistoricDataAPI objects. It is only requested again from the
+        API if it is older than *ticker_ttl* seconds (default: one
+        day). If the API can't be reached, an outdated ticker is used,
+        so working offline is possible as long as the needed currency
+        pairs are known.
+
+        Instead of HDF5, another storage *backend* can be chosen for
+        the cached data, see `storage.backends` and `HistoricDataCSV`.
+
+        Like in `HistoricDataCSV`, only the intervals containing trades
+        are kept, unless *sparse* is False, and *max_staleness* limits
+        the time allowed between the last trade and the requested time.
+        (Data from different days is never combined, though, so prices
+        before the first trade of a day can't be looked up.) A
+        ValueError is raised if *max_staleness* is given with *sparse*
+        False, since the cached dense data doesn't tell which intervals
+        had trades.
 
         """
         super(HistoricDataAPI, self).__init__(unit)
+        if max_staleness is not None and not sparse:
+            # (The dense data doesn't tell which intervals had trades)
+            raise ValueError(
+                'max_staleness is only supported with sparse data')
+        self.sparse = sparse
+        self.max_staleness = max_staleness
         self.interval = interval
-        self.url = 'https://poloniex.com/public'
-        # Poloniex does not allow more than 6 queries per second;
-        # Wait at least this number of seconds between queries:
-        self.query_wait_time = 0.17
+        if day_cache is not None:
+            self.day_cache = day_cache
+        self.url = url
+        # Poloniex does not allow more than 6 queries per second:
+        if rate_limiter is None:
+            rate_limiter = get_rate_limiter(self.url, rate=6)
+        self.rate_limiter = rate_limiter
+        if transport is None:
+            if session is None:
+                session = get_session(self.url)
+            transport = HTTPTransport(session, retries, backoff_factor)
+        self.transport = transport
         # Poloniex limits the amount of trades returned per query:
         self.max_trades_per_query = 50000
+        # Maximum number of days fetched with a single query when
+        # prefetching whole ranges of days (see `fetch_range`):
+        self.max_days_per_query = 30
+        # Maximum number of requests made at once when a range must be
+        # split (see `_fetch_trades_adaptive`):
+        self.max_concurrent_requests = 6
         self.command = 'returnTradeHistory'
         self.currency_pair = '{0.cto:s}_{0.cfrom:s}'.format(self)
-        self.last_query_time = pd.Timestamp.now()
         self.connection_error = requests.ConnectionError(
             'Price data for %s could not be loaded from %s '
             '- are you online?' % (self.currency_pair, self.url))
+        self.backend = get_backend(backend)
         file_name = path.join(
             cache_folder,
-            'Poloniex_{0.cto:s}_{0.cfrom:s}_{0.interval:s}.h5'.format(self))
+            'Poloniex_{0.cto:s}_{0.cfrom:s}_{0.interval:s}'.format(self)
+            + self.backend.extension)
         # flipped currency pair:
         file_name_f = path.join(
             cache_folder,
-            'Poloniex_{0.cfrom:s}_{0.cto:s}_{0.interval:s}.h5'.format(self))
+            'Poloniex_{0.cfrom:s}_{0.cto:s}_{0.interval:s}'.format(self)
+            + self.backend.extension)
         # See if the currency pair is already cached:
         if path.exists(file_name):
             self.file_name = file_name
@@ -252,19 +1255,14 @@ class HistoricDataAPI(HistoricData):
             self.file_name = file_name_f
             self.currency_pair = '{0.cto:s}_{0.cfrom:s}'.format(self)
         else:
-            # Query the api to see if the pair is available:
-            try:
-                req = requests.get(
-                    self.url,
-                    params={'command' : 'returnTicker'})
-            except requests.ConnectionError:
-                raise self.connection_error
-            if self.currency_pair in req.json():
+            # Check the ticker to see if the pair is available:
+            ticker = self._get_ticker(cache_folder, ticker_ttl)
+            if self.currency_pair in ticker:
                 self.file_name = file_name
             else:
                 # try if flipped currency pair is available:
                 currency_pair_f = '{0.cfrom:s}_{0.cto:s}'.format(self)
-                if not currency_pair_f in req.json():
+                if not currency_pair_f in ticker:
                     raise ValueError(
                         'Neither currency pair "{0:s}" nor pair "{1:s}" is '
                         'available on "{2:s}".'.format(
@@ -275,143 +1273,452 @@ class HistoricDataAPI(HistoricData):
                 self.currency_pair = currency_pair_f
                 self.file_name = file_name_f
 
-    def _fetch_from_api(self, start, end=None):
-        """Fetch historical trading data from API.
-
-        :param start: UNIX Timestamp (seconds); Start of range to fetch.
-        :param end: UNIX timestamp (seconds); End of range to fetch.
-            If None (default), will fetch a range of one day, i.e.
-            end will be `start + 86400`.
-        :returns: tuple (number of fetched trades, resampled data)
-
-        The returned data will be resampled to `self.interval`. The
-        data will consist of weighted historical prices, averaged over
-        each interval using the traded amounts as weights.
-
-        In case there is a limit on the number of trades returned by
-        the API, not the full requested range from `start` to `end`
-        can be returned by this function. Check the returned
-        data and the number of fetched trades to determine if data
-        is missing. In such a case, the weighted averages of prices
-        at the missing ends of the range cannot be trusted.
-
-        """
-        if end is None:
-            # fetch a time span of one day:
-            end = start + 86400
-        # Wait for the min call time to pass:
-        now = pd.Timestamp.now()
-        delta = (now - self.last_query_time).total_seconds()
-        self.last_query_time = now
-        if delta <= self.query_wait_time:
-            log.info('waiting %f s', self.query_wait_time - delta)
-            sleep(self.query_wait_time - delta)
-            log.info('continuing')
-        # Make request:
+    def _get_ticker(self, cache_folder, ttl):
+        """Return the API's ticker, a dict with the available currency
+        pairs as keys.
+
+        The ticker is loaded from memory or from the file
+        'Poloniex_ticker.json' in *cache_folder*, unless it is older
+        than *ttl* seconds, in which case it is requested from the API
+        and saved. If the request fails, an outdated ticker is used
+        if available.
+
+        """
+        ticker_file = path.join(cache_folder, 'Poloniex_ticker.json')
+        with self._ticker_lock:
+            cached = self._tickers.get(self.url)
+            if cached is None and path.exists(ticker_file):
+                try:
+                    with open(ticker_file) as f:
+                        cached = json.load(f)
+                    if not (isinstance(cached, dict)
+                            and isinstance(cached.get('time'), (int, float))
+                            and 'ticker' in cached):
+                        raise ValueError('Not a cached ticker')
+                except ValueError:
+                    log.warning('Ignoring corrupted file %s', ticker_file)
+                    cached = None
+                else:
+                    self._tickers[self.url] = cached
+            if cached is not None and time.time() - cached['time'] < ttl:
+                if not path.exists(ticker_file):
+                    self._write_ticker(ticker_file, cached)
+                return cached['ticker']
+            try:
+                ticker = self._api_get({'command' : 'returnTicker'}).json()
+            except requests.ConnectionError:
+                if cached is None:
+                    raise
+                log.warning(
+                    'Could not update the ticker from %s, using the '
+                    'ticker from %s instead', self.url,
+                    pd.Timestamp(cached['time'], unit='s'))
+                return cached['ticker']
+            cached = {'time': time.time(), 'ticker': ticker}
+            self._tickers[self.url] = cached
+            self._write_ticker(ticker_file, cached)
+            return ticker
+
+    def _write_ticker(self, ticker_file, cached):
+        """Save the ticker *cached* (see `_get_ticker`) to the file
+        *ticker_file*."""
+        with open(ticker_file + '.tmp', 'w') as f:
+            json.dump(cached, f)
+        _replace(ticker_file + '.tmp', ticker_file)
+
+    def _api_get(self, params):
+        """Make a request with query *params* to the API, respecting
+        its rate limit and retrying on transient errors.
+
+        :raises: `self.connection_error` (a `requests.ConnectionError`)
+            if the API could not be reached, also if it still answered
+            with a server error after all retries.
+
+        """
         try:
-            req = requests.get(
-                self.url,
-                params={'command': self.command,
-                        'currencyPair': self.currency_pair,
-                        'start': int(start),
-                        'end': int(end)})
-        except requests.ConnectionError:
+            return self.transport.get(
+                self.url, params, rate_limiter=self.rate_limiter)
+        except (requests.ConnectionError, requests.Timeout,
+                requests.HTTPError):
             raise self.connection_error
+
+    def _fetch_trades(self, start, end):
+        """Fetch the trades from *start* to *end* (UNIX timestamps in
+        seconds, both inclusive) from the API with a single request.
+
+        :returns: pandas.DataFrame with one row per trade, indexed by
+            the (naive UTC) dates of the trades, with (at least) the
+            columns 'tradeID', 'rate' and 'amount'.
+
+        Since the API limits the number of trades returned per request
+        (see `max_trades_per_query`), only the most recent trades of
+        the range might be returned. Use `_fetch_trades_adaptive` to
+        get all of them.
+
+        """
+        req = self._api_get({'command': self.command,
+                             'currencyPair': self.currency_pair,
+                             'start': int(start),
+                             'end': int(end)})
         log.info('Fetched historical price data with request: %s', req.url)
         try:
-            df = pd.read_json(
-                req.text, orient='records', precise_float=True,
-                convert_axes=False, convert_dates=['date'],
-                keep_default_dates=False, dtype={
-                        'tradeID': False, 'globalTradeID': False,
-                        'total': False, 'type': False, 'date': False,
-                        'rate': float, 'amount': float})
-            log.info('Successfully fetched %i trades', len(df))
-        except ValueError:
-            # There might have been an error returned from Poloniex,
-            # which cannot be parsed the same way than regular data.
-            j = pd.io.json.loads(req.text)
-            if 'error' in j:
-                raise ValueError(
-                    "Poloniex API returned error: {0:s}\n"
-                    "Requested URL was: {1:s}".format(
-                            j['error'],
-                            req.url))
-            else:
-                raise
-        df.set_index('date', inplace=True)
+            trades = decode_trades(req.text)
+        except ValueError as e:
+            raise ValueError('{0!s}\nRequested URL was: {1:s}'.format(
+                e, req.url))
+        log.info('Successfully fetched %i trades', len(trades['date']))
+        return pd.DataFrame(
+            {'tradeID': trades['tradeID'], 'rate': trades['rate'],
+             'amount': trades['amount']},
+            index=pd.DatetimeIndex(trades['date'], name='date'),
+            columns=['tradeID', 'rate', 'amount'])
+
+    def _fetch_trades_adaptive(self, start, end):
+        """Fetch all trades from *start* to *end* (UNIX timestamps in
+        seconds, both inclusive) from the API.
+
+        If a request reaches the API's limit of trades per query, the
+        API might only have returned the most recent trades of the
+        requested range. The rest of the range (up to and including the
+        second of the oldest trade returned, which might not be
+        complete) is then split in halves, which are requested
+        concurrently (using up to `max_concurrent_requests` threads,
+        still respecting the rate limit). This is repeated for every
+        part reaching the limit, so even very busy ranges are fetched
+        in a number of rounds growing only logarithmically with the
+        number of trades. If the oldest trade returned is from the
+        first second of the range, only this second is requested
+        again; an exception is raised if even a single second has too
+        many trades to be fetched.
+
+        :returns: pandas.DataFrame with the trades as returned by
+            `_fetch_trades`, sorted by date and without duplicates
+            (judging by 'tradeID').
+
+        """
+        ranges = [(start, end)]
+        frames = []
+        pool = None
+        try:
+            while ranges:
+                if len(ranges) == 1:
+                    results = [self._fetch_trades(*ranges[0])]
+                else:
+                    if pool is None:
+                        pool = ThreadPool(self.max_concurrent_requests)
+                    results = pool.map(
+                        lambda r: self._fetch_trades(*r), ranges)
+                next_ranges = []
+                for (rstart, rend), trades in zip(ranges, results):
+                    frames.append(trades)
+                    if len(trades) < self.max_trades_per_query:
+                        continue
+                    oldest = trades.index.asi8.min() // 10 ** 9
+                    if rstart == rend:
+                        raise Exception(
+                            "There are at least %i trades in the "
+                            "second %s, which cannot all be fetched "
+                            "from the API." % (
+                                self.max_trades_per_query,
+                                pd.Timestamp(rstart, unit='s', tz='UTC')))
+                    if oldest <= rstart:
+                        # Only older trades of the first second might
+                        # be missing:
+                        next_ranges.append((rstart, rstart))
+                        continue
+                    middle = (rstart + oldest) // 2
+                    next_ranges.extend(
+                        [(rstart, middle), (middle + 1, oldest)])
+                ranges = next_ranges
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        trades = pd.concat(frames) if len(frames) > 1 else frames[0]
+        trades = trades[~trades['tradeID'].duplicated()]
+        return trades.sort_index(kind='mergesort')
+
+    def _resample_trades(self, trades):
+        """Return the weighted prices of *trades* (as returned by
+        `_fetch_trades`), averaged over each interval of
+        `self.interval` using the traded amounts as weights.
 
-        # Get weighted prices, resampled with interval:
-        # (this will only return one column, the weighted prices;
-        # the total volume won't be needed anymore)
+        """
+        if not len(trades):
+            return pd.Series(
+                [], index=pd.DatetimeIndex([], tz='UTC'), dtype=float)
         data = resample_weighted_average(
-                df, self.interval, 'rate', 'amount')
+                trades, self.interval, 'rate', 'amount')
 
         # In case the data has been upsampled (Some events
         # beeing more separated than interval), the resulting
-        # Series will have some NaNs. Forward-fill them with
-        # the last prices before:
-        data.ffill(inplace=True)
+        # Series will have some NaNs. Either remove them, or
+        # forward-fill them with the last prices before:
+        if self.sparse:
+            data = data[data.notnull()]
+        else:
+            data.ffill(inplace=True)
 
         if data.index.tzinfo is None:
             data.index = data.index.tz_localize('UTC')
 
-        return len(df), data
+        return data
 
-    def prepare_request(self, dtime):
+    def prepare_request(self, dtime, resolution=None):
         """Return a Pandas DataFrame which contains the data for the
-        requested datetime *dtime*.
+        requested datetime *dtime*. Only *resolution* None or equal to
+        `self.interval` is supported.
 
         """
+        self._check_resolution(resolution)
         dtime = pd.Timestamp(dtime).tz_convert(tz.tzutc())
-        key = "d{a:04d}{m:02d}{d:02d}".format(
-                a=dtime.year, m=dtime.month, d=dtime.day)
-        with pd.HDFStore(self.file_name, mode='a') as store:
-            if key in store:
-                try:
-                    self.data = store.get(key)
-                    # Check whether the data can be accessed:
-                    self.data.at[
-                            pd.Timestamp(dtime).floor(self.data.index.freq)]
-                    return self.data
-                except (KeyError, AttributeError):
-                    # In case the hdf5 file got corrupted somehow,
-                    # with the requested date missing from the data,
-                    # reload the data from the API:
-                    log.warning(
-                        'Date %s missing in cached data. '
-                        'Repeating request to API', dtime)
-
-            # We need to fetch the data from the poloniex api:
-            start = dtime.floor('D').value // 10 ** 9
-            count, self.data = self._fetch_from_api(start)
-
-            # Did we reach the limit?
-            while count == self.max_trades_per_query:
-                # The API might not have returned all requested trades.
-                # If Poloniex omits data, the end of the requested range
-                # is returned.
-                # Remove first faulty interval:
-                # (faulty because data might be missing)
-                del self.data[self.data.index[0]]
-                # end time of next request:
-                end = self.data.index[0].value // 10 ** 9 - 1
-                # new request:
-                count, data = self._fetch_from_api(start, end)
-                if len(data) <= 1 and count == self.max_trades_per_query:
-                    # It seems our interval is too big or there are just
-                    # too many trades in the interval, so that we cannot
-                    # fetch one interval with a single request.
-                    raise Exception(
-                        "There are too many trades in the chosen "
-                        "interval of %s ending on %s. Please try again "
-                        "with an HistoricDataAPI object with smaller "
-                        "interval size." % (
-                            self.data.index.freq,
-                            self.data.index[0]))
-                self.data = self.data.combine_first(data)
-
-
-
-            store.put(key, self.data, format="fixed")
+        key = self._day_key(dtime)
+        cache_key = (self.file_name, key)
+        data = self.day_cache.get(cache_key)
+        if data is not None and self._covers(data, dtime):
+            self.data = data
             return self.data
+        status = self.cache_status(dtime)
+        if status == 'empty':
+            raise KeyError(
+                'There were no trades of {0:s} on {1:s}'.format(
+                    self.currency_pair, dtime.strftime('%Y-%m-%d')))
+        if status == 'cached':
+            data = self._load_month(dtime).pop(key, None)
+            if data is not None:
+                self.data = data
+                self.day_cache.put(cache_key, self.data)
+                return self.data
+            # In case the cache got corrupted somehow, with the data
+            # of the requested day missing or altered, reload the data
+            # from the API:
+            log.warning(
+                'Data of %s in %s is corrupted. Repeating request to API',
+                key, self.file_name)
+
+        # We need to fetch the data from the poloniex api:
+        # (The HDF5 file is not kept open meanwhile, so other threads
+        # can access it while we wait for the response)
+        start = dtime.floor('D').value // 10 ** 9
+        data = self._fetch_day(start)
+        self._store_day(start, data)
+        if not len(data):
+            raise KeyError(
+                'There were no trades of {0:s} on {1:s}'.format(
+                    self.currency_pair, dtime.strftime('%Y-%m-%d')))
+        self.data = data
+        self.day_cache.put(cache_key, self.data)
+        return self.data
+
+    def cache_status(self, dtime):
+        """Return the status of the data of the UTC day of *dtime* in
+        the cache, judging only by the cache's manifest (see
+        `write_month_index`), without opening the cache:
+
+        - 'cached': the data is saved in the cache,
+        - 'empty': there were no trades on this day,
+        - 'missing': the data is not cached, or was fetched before the
+          end of the day, so it might be incomplete.
+
+        """
+        day = pd.Timestamp(dtime).tz_convert(tz.tzutc()).floor('D')
+        entry = self._manifest().get(self._day_key(day))
+        day_end = day.value // 10 ** 9 + 86400
+        if entry is None or entry.get('fetched', day_end) < day_end:
+            return 'missing'
+        if entry.get('rows') == 0:
+            return 'empty'
+        return 'cached'
+
+    def data_source(self, dtime):
+        """Return where the price at datetime *dtime* would be looked
+        up (see `HistoricData.data_source`), judging by `day_cache`
+        and `cache_status`.
+
+        """
+        dtime = pd.Timestamp(dtime).tz_convert(tz.tzutc())
+        if (self.file_name, self._day_key(dtime)) in self.day_cache:
+            return 'memory'
+        return {'cached': 'disk', 'empty': None,
+                'missing': 'network'}[self.cache_status(dtime)]
+
+    def _load_month(self, dtime):
+        """Load the cached data of the month of *dtime* and return it
+        split into days (see `_split_month`). Days whose data does not
+        match the checksum in the manifest are left out, all others are
+        put into `day_cache` as well.
+
+        """
+        manifest = self._manifest()
+        month_key = self._month_key(dtime)
+        try:
+            with self.backend(self.file_name, mode='r') as store:
+                month = store.get(month_key)
+        except (KeyError, IOError, OSError):
+            # The month (or the whole cache) is gone, so the days of
+            # the month with trades must be fetched again:
+            log.warning('Data of %s is missing in %s',
+                        month_key, self.file_name)
+            self._update_manifest({}, [
+                day_key for day_key, entry in list(manifest.items())
+                if day_key[1:7] == month_key[1:] and entry.get('rows') != 0])
+            return {}
+        days = self._split_month(month)
+        for day_key, data in list(days.items()):
+            checksum = manifest.get(day_key, {}).get('checksum')
+            if checksum is not None and checksum != day_checksum(data):
+                del days[day_key]
+            elif (self.file_name, day_key) not in self.day_cache:
+                # Keep the other days of the month in memory as well,
+                # since they will probably be needed soon:
+                self.day_cache.put((self.file_name, day_key), data)
+        return days
+
+    def _fetch_day(self, start):
+        """Fetch data of the day beginning at *start* (UNIX timestamp)
+        from the API and return it.
+
+        """
+        return self._resample_trades(
+            self._fetch_trades_adaptive(start, start + 86399))
+
+    def _day_key(self, day):
+        """Return the key of the cached data of *day* in the index."""
+        return "d{a:04d}{m:02d}{d:02d}".format(
+                a=day.year, m=day.month, d=day.day)
+
+    def _month_key(self, day):
+        """Return the key of the cached data of the month of *day*."""
+        return "m{a:04d}{m:02d}".format(a=day.year, m=day.month)
+
+    def _split_month(self, month):
+        """Split the data of a *month* into days.
+
+        :returns: dict with day keys (see `_day_key`) as keys and the
+            data of each day as values. The frequency of days with
+            data for all intervals is set to `self.interval`.
+
+        """
+        if not len(month):
+            return {}
+        day_ns = 86400 * 10 ** 9
+        step = pd.tseries.frequencies.to_offset(self.interval).nanos
+        index = month.index.asi8
+        bounds = np.flatnonzero(np.diff(index // day_ns)) + 1
+        days = {}
+        for i, j in zip(np.r_[0, bounds], np.r_[bounds, len(index)]):
+            data = month.iloc[i:j]
+            if index[j - 1] - index[i] == (j - i - 1) * step:
+                data.index.freq = self.interval
+            days[self._day_key(data.index[0])] = data
+        return days
+
+    def _manifest(self):
+        """Return the manifest of the cache: a dict with the keys (see
+        `_day_key`) of all days saved in the cache as keys and dicts
+        describing the saved data as values (see `write_month_index`).
+
+        The manifest is loaded from the index file of the cache only
+        once and then shared by all HistoricDataAPI objects using the
+        same cache. If the cache still uses the old layout of one key
+        per day, it is migrated first (see `migrate_day_cache`).
+
+        """
+        with self._index_lock:
+            if self.file_name not in self._indexes:
+                index_file = self.file_name + '.index.json'
+                if (not path.exists(index_file)
+                        and path.exists(self.file_name)):
+                    migrate_day_cache(self.file_name, self.backend)
+                self._indexes[self.file_name] = read_month_index(
+                    self.file_name)
+            return self._indexes[self.file_name]
+
+    def _update_manifest(self, days, removed=()):
+        """Update the manifest (see `_manifest`) and its index file
+        with the entries of the dict *days* and without the days with
+        keys in *removed*. Since the index file is read again before it
+        is written (see `update_month_index`), changes made by other
+        processes sharing the cache are taken over, too.
+
+        """
+        with self._index_lock:
+            manifest = self._manifest()
+            updated = update_month_index(self.file_name, days, removed)
+            for key in set(manifest) - set(updated):
+                del manifest[key]
+            manifest.update(updated)
+
+    def missing_days(self, dtimes):
+        """Return a sorted list of all UTC days (as pandas.Timestamps)
+        including a datetime in *dtimes* whose data is not cached yet
+        (see `cache_status`).
+
+        :param dtimes: array-like of datetimes or of unix timestamps
+            (seconds since the epoch, UTC).
+
+        """
+        times = _to_epoch_ns(dtimes)
+        day_ns = 86400 * 10 ** 9
+        days = [pd.Timestamp(d, tz='UTC')
+                for d in np.unique(times - times % day_ns)]
+        return [day for day in days if self.cache_status(day) == 'missing'
+                and (self.file_name, self._day_key(day))
+                    not in self.day_cache]
+
+    def fetch_range(self, first_day, last_day):
+        """Fetch the data for all days from *first_day* to *last_day*
+        (both inclusive) from the API and save it to the cache, using
+        as few requests as possible. Data already cached for these days
+        will be replaced.
+
+        :param first_day, last_day: datetimes; only the UTC date is
+            taken into account.
+
+        The range should not span more than `self.max_days_per_query`
+        days. If the API's limit of trades per query is reached, the
+        range is split adaptively (see `_fetch_trades_adaptive`).
+
+        This method may be called from multiple threads at once.
+
+        """
+        day = 86400
+        start = pd.Timestamp(first_day).tz_convert(
+                tz.tzutc()).floor('D').value // 10 ** 9
+        end = pd.Timestamp(last_day).tz_convert(
+                tz.tzutc()).floor('D').value // 10 ** 9 + day
+        trades = self._fetch_trades_adaptive(start, end - 1)
+        # Resample the trades of each day on its own, like `_fetch_day`
+        # does, so no prices are carried over into the following days:
+        bounds = trades.index.asi8.searchsorted(
+            np.arange(start, end + 1, day) * 10 ** 9)
+        for dstart, i, j in zip(range(start, end, day), bounds, bounds[1:]):
+            self._store_day(dstart, self._resample_trades(trades.iloc[i:j]))
+
+    def _store_day(self, start, data):
+        """Save *data* of the day beginning at *start* (UNIX timestamp)
+        to the cache and record it in the manifest. If *data* is empty,
+        the day is recorded as having no trades, so it won't be fetched
+        again.
+
+        """
+        day = pd.Timestamp(start, unit='s', tz='UTC')
+        key = self._day_key(day)
+        month_key = self._month_key(day)
+        entry = {'fetched': time.time(), 'rows': len(data)}
+        if len(data):
+            entry['checksum'] = day_checksum(data)
+        with self._index_lock:
+            with self.backend(self.file_name, mode='a') as store:
+                if month_key in store:
+                    month = store.get(month_key)
+                    # Replace the data of the day, if already cached:
+                    i, j = month.index.asi8.searchsorted(
+                        [day.value, day.value + 86400 * 10 ** 9])
+                    store.put(month_key, pd.concat(
+                        [month.iloc[:i], data, month.iloc[j:]]))
+                elif len(data):
+                    store.put(month_key, data)
+            self._update_manifest({key: entry})
+        # Don't keep stale data in memory:
+        self.day_cache.pop((self.file_name, key))
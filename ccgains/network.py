@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+import hashlib
+import json
+import os
+import threading
+import time
+from os import path
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    # Python 2:
+    from urllib import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+log = logging.getLogger(__name__)
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    # Python 2:
+    _clock = time.time
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=1):
+        """Create a token bucket rate limiter, which allows on average
+        *rate* calls to `acquire` per second, with bursts of at most
+        *capacity* calls.
+
+        The bucket is thread-safe, so one TokenBucket can be shared by
+        all objects and threads using the same API. Waiting callers
+        are served in the order they called `acquire`.
+
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = _clock()
+        self._lock = threading.Lock()
+        # Statistics:
+        self.calls = 0
+        self.total_wait = 0.0
+
+    def acquire(self):
+        """Take a token out of the bucket, waiting until one is
+        available if necessary.
+
+        :returns: the time waited, in seconds
+
+        """
+        with self._lock:
+            now = _clock()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Reserve a token, even if it is not available yet; the
+            # deficit is seen by subsequent callers, who will then have
+            # to wait longer:
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.calls += 1
+            self.total_wait += wait
+        if wait > 0:
+            log.debug('rate limit: waiting %f s', wait)
+            time.sleep(wait)
+        return wait
+
+
+# Process-wide registry of rate limiters, one per API:
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name, rate, capacity=1):
+    """Return the TokenBucket registered under *name* (e.g. the URL of
+    an API), creating it with *rate* and *capacity* if it does not
+    exist yet. All HistoricData objects using the same API should
+    share the same TokenBucket, so that the API's limits are respected
+    across all objects and threads.
+
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = TokenBucket(rate, capacity)
+        return _rate_limiters[name]
+
+
+# Process-wide registry of HTTP sessions, one per API:
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(name, pool_size=10):
+    """Return the `requests.Session` registered under *name* (e.g. the
+    URL of an API), creating it if it does not exist yet.
+
+    The session keeps up to *pool_size* connections to each host open
+    (keep-alive), so that subsequent requests, also from different
+    threads, don't need to establish a new TCP and TLS connection.
+
+    """
+    with _sessions_lock:
+        if name not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[name] = session
+        return _sessions[name]
+
+# HTTP status codes of responses which are worth retrying:
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def api_get(url, params=None, session=None, rate_limiter=None,
+            retries=3, backoff_factor=1.0, timeout=60):
+    """Make a GET request to *url* with query parameters *params*,
+    retrying on transient errors.
+
+    :param session: The `requests.Session` to use; if None, the session
+        registered for *url* is used (see `get_session`).
+    :param rate_limiter: If not None, a `TokenBucket` from which a
+        token is taken before every attempt, so retries also respect
+        the API's rate limit.
+    :param retries: The number of times a request is repeated after
+        a connection error, timeout or a response with a status code
+        in `RETRY_STATUS_CODES`.
+    :param backoff_factor: Before the n-th retry, wait
+        `backoff_factor * 2 ** (n - 1)` seconds (in addition to any
+        time waited for the rate limiter).
+    :param timeout: Seconds to wait for the server to respond.
+    :returns: the `requests.Response`
+    :raises: the last `requests.ConnectionError` or `requests.Timeout`
+        if all attempts failed, or `requests.HTTPError` if the last
+        response had a status code in `RETRY_STATUS_CODES`.
+
+    """
+    if session is None:
+        session = get_session(url)
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= retries:
+                raise
+            log.warning('Request to %s failed (%s), retrying', url, e)
+        else:
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            if attempt >= retries:
+                response.raise_for_status()
+            log.warning('Request to %s returned status %i, retrying',
+                        url, response.status_code)
+        wait = backoff_factor * 2 ** attempt
+        attempt += 1
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HTTPTransport(object):
+    def __init__(self, session=None, retries=3, backoff_factor=1.0,
+                 timeout=60):
+        """Create a transport making real HTTP requests with
+        `api_get`, see there for the parameters. If *session* is None,
+        the session registered for the requested URL is used (see
+        `get_session`).
+
+        A transport is an object with a method
+        `get(url, params, rate_limiter=None)`, which returns a response
+        with the attributes `url` and `text` and a method `json()`,
+        like `requests.Response`. HistoricDataAPI makes all requests
+        through a transport, which can be replaced, e.g. to record
+        responses (`RecordingTransport`) or to replay them later
+        without network access (`ReplayTransport`).
+
+        """
+        self.session = session
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+    def get(self, url, params, rate_limiter=None):
+        """Make a GET request to *url* with query parameters *params*,
+        taking a token from *rate_limiter* (a `TokenBucket`, if not
+        None) before every attempt.
+
+        """
+        return api_get(
+            url, params, session=self.session, rate_limiter=rate_limiter,
+            retries=self.retries, backoff_factor=self.backoff_factor,
+            timeout=self.timeout)
+
+
+class RecordedResponse(object):
+    """A response replayed by `ReplayTransport`."""
+
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _fixture_name(url, params):
+    """Return the file name of the fixture of the request of *url*
+    with query parameters *params*.
+
+    """
+    query = urlencode(sorted((k, str(v)) for k, v in params.items()))
+    return hashlib.sha1(
+        (url + '?' + query).encode('utf-8')).hexdigest() + '.json'
+
+
+class RecordingTransport(object):
+    def __init__(self, folder, transport=None):
+        """Create a transport which makes requests with *transport*
+        (default: a new `HTTPTransport`) and saves every response
+        in a fixture file in *folder*, to be replayed with
+        `ReplayTransport`.
+
+        """
+        if transport is None:
+            transport = HTTPTransport()
+        self.folder = folder
+        self.transport = transport
+        if not path.isdir(folder):
+            os.makedirs(folder)
+
+    def get(self, url, params, rate_limiter=None):
+        response = self.transport.get(url, params, rate_limiter)
+        file_name = path.join(self.folder, _fixture_name(url, params))
+        with open(file_name, 'w') as f:
+            json.dump({'url': url, 'params': dict(params),
+                       'response_url': response.url,
+                       'text': response.text}, f)
+        return response
+
+
+class ReplayTransport(object):
+    def __init__(self, folder):
+        """Create a transport which answers requests with the
+        responses recorded by a `RecordingTransport` in *folder*,
+        without any network access and without waiting for rate
+        limits. A request which has not been recorded raises a
+        `requests.ConnectionError`, like a request without network
+        connection would.
+
+        """
+        self.folder = folder
+        # Statistics:
+        self.calls = 0
+
+    def get(self, url, params, rate_limiter=None):
+        self.calls += 1
+        file_name = path.join(self.folder, _fixture_name(url, params))
+        if not path.exists(file_name):
+            raise requests.ConnectionError(
+                'No recorded response for request of %s with %s' % (
+                    url, params))
+        with open(file_name) as f:
+            recorded = json.load(f)
+        return RecordedResponse(recorded['response_url'], recorded['text'])
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+
+from .historic_data import HistoricDataAPI
+from .trades import TradeHistory
+
+import logging
+log = logging.getLogger(__name__)
+
+def trade_needs(trades, base_currency):
+    """Return a list of `(dtime, (from_currency, to_currency))`-tuples
+    with all exchange rates that `BagFIFO.process_trade` will need to
+    process *trades*.
+
+    :param trades: TradeHistory object or list of Trade objects
+    :param base_currency: The base currency used by BagFIFO
+
+    """
+    if isinstance(trades, TradeHistory):
+        trades = trades.tlist
+    base_currency = base_currency.upper()
+    needs = []
+    for trade in trades:
+        if trade.buycur and trade.buyval > 0 and trade.sellval > 0:
+            # A sale (or a purchase with base currency):
+            currency = trade.sellcur
+        elif trade.feeval > 0 and trade.feecur:
+            # Fees must be paid on withdrawal, deposit or on their own:
+            currency = trade.feecur
+        else:
+            continue
+        if currency and currency.upper() != base_currency:
+            needs.append((trade.dtime, (currency.upper(), base_currency)))
+    return needs
+
+def merge_days(days, max_days):
+    """Merge consecutive days into ranges.
+
+    :param days: sorted list of days (pandas.Timestamps at midnight)
+    :param max_days: maximum number of days in a single range
+    :returns: list of tuples `(first_day, last_day)`
+
+    """
+    ranges = []
+    for day in days:
+        if (ranges
+                and day - ranges[-1][1] == pd.Timedelta(days=1)
+                and (day - ranges[-1][0]).days < max_days):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+def _fetch_task(task):
+    hdata, first, last = task
+    log.info('Prefetching data for %s from %s to %s',
+             hdata.currency_pair, first.date(), last.date())
+    hdata.fetch_range(first, last)
+
+
+class PrefetchPlanner(object):
+    def __init__(self, relation, max_workers=6):
+        """Create a PrefetchPlanner, which works out which days of
+        historical data are missing in the caches of the HistoricDataAPI
+        objects of a CurrencyRelation object and fills these caches
+        with as few requests to the APIs as possible.
+
+        Normally, HistoricDataAPI fetches missing data lazily, one day
+        per request, whenever a price is requested. If all needed data
+        is known in advance (e.g. from a TradeHistory), it is much
+        faster to fetch it in bulk before starting calculations:
+
+            planner = PrefetchPlanner(relation)
+            planner.prefetch(trade_history, 'EUR')
+            for trade in trade_history.tlist:
+                bag_fifo.process_trade(trade)
+
+        :param relation: The CurrencyRelation object that will be used
+            to calculate exchange rates.
+        :param max_workers: The maximum number of threads fetching
+            data at the same time. All requests still respect the
+            rate limits of the APIs (see `network.TokenBucket`), but
+            with enough concurrent requests, the time needed to fetch
+            all data is limited by the rate limit instead of by the
+            latency of each request. Use 1 to fetch everything in
+            the calling thread, one range after another.
+
+        """
+        self.relation = relation
+        self.max_workers = max_workers
+
+    def plan(self, needs, base_currency=None):
+        """Work out the missing days of data.
+
+        :param needs: Either a TradeHistory object or a list of Trade
+            objects, in which case *base_currency* must be given (see
+            `trade_needs`); or a list of
+            `(dtime, (from_currency, to_currency))`-tuples.
+        :param base_currency: The base currency used by BagFIFO; only
+            used if *needs* contains trades.
+        :returns: OrderedDict with file names of HistoricDataAPI caches
+            as keys and tuples `(historic_data, ranges)` as values,
+            where `historic_data` is the HistoricDataAPI object and
+            `ranges` is a list of `(first_day, last_day)`-tuples with
+            ranges of consecutive days missing in the cache, each at
+            most `historic_data.max_days_per_query` days long.
+
+        """
+        if isinstance(needs, TradeHistory) or (
+                len(needs) and not isinstance(needs[0], tuple)):
+            if base_currency is None:
+                raise ValueError(
+                    'Please supply the base currency to work out the '
+                    'exchange rates needed for trades.')
+            needs = trade_needs(needs, base_currency)
+        # Collect the needed times for every HistoricDataAPI object:
+        dtimes = OrderedDict()
+        for dtime, (fcur, tcur) in needs:
+            try:
+                # (the route `get_rate` will use on this day:)
+                recipe = self.relation._choose_route(
+                    (fcur.upper(), tcur.upper()), pd.Timestamp(dtime).value)
+            except KeyError:
+                log.warning(
+                    'No historical data available for %s/%s, '
+                    'skipping it in prefetch plan', tcur, fcur)
+                continue
+            for hfrom, hto, _ in recipe:
+                hdata = self.relation.hdict[(hfrom, hto)]
+                if isinstance(hdata, HistoricDataAPI):
+                    dtimes.setdefault(
+                        hdata.file_name, (hdata, []))[1].append(dtime)
+        plan = OrderedDict()
+        for file_name, (hdata, times) in dtimes.items():
+            ranges = merge_days(
+                    hdata.missing_days(times), hdata.max_days_per_query)
+            if ranges:
+                plan[file_name] = (hdata, ranges)
+        return plan
+
+    def execute(self, plan):
+        """Fetch all data in *plan* (as returned by `plan`) and save
+        it to the HistoricDataAPI caches.
+
+        The ranges of all currency pairs are fetched concurrently by up
+        to `self.max_workers` threads. If fetching any range fails, the
+        first exception raised is raised again here.
+
+        """
+        tasks = [(hdata, first, last)
+                 for hdata, ranges in plan.values()
+                 for first, last in ranges]
+        workers = min(self.max_workers, len(tasks))
+        if workers <= 1:
+            for task in tasks:
+                _fetch_task(task)
+            return
+        pool = ThreadPool(workers)
+        try:
+            pool.map(_fetch_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def prefetch(self, needs, base_currency=None):
+        """Work out the missing days of data needed for *needs* and
+        fetch them. See `plan` for the parameters.
+
+        :returns: the plan that was executed
+
+        """
+        plan = self.plan(needs, base_currency)
+        self.execute(plan)
+        return plan
+
+
+class BackgroundPrefetcher(object):
+    def __init__(self, relation, trades, base_currency, lookahead=100,
+                 max_workers=6):
+        """Create a BackgroundPrefetcher, which fetches the historical
+        data needed for the next *lookahead* trades of *trades* on a
+        background thread, while the trades are processed one after
+        another in the calling thread:
+
+            with BackgroundPrefetcher(relation, trade_history, 'EUR') as p:
+                for trade in p:
+                    bag_fifo.process_trade(trade)
+
+        Unlike `PrefetchPlanner.prefetch`, processing can start right
+        away, and the requests to the APIs (and the waiting for their
+        rate limits) overlap with the processing of the trades before.
+
+        :param relation: The CurrencyRelation object that will be used
+            to calculate exchange rates.
+        :param trades: TradeHistory object or list of Trade objects,
+            in the order they will be processed
+        :param base_currency: The base currency used by BagFIFO
+        :param lookahead: The number of trades (from the one being
+            processed) whose data is fetched in advance.
+        :param max_workers: see `PrefetchPlanner`
+
+        Iterating yields the trades, each one as soon as the data it
+        needs has been fetched. The time the iterating thread had to
+        wait for the background thread is summed up in `stall_time`
+        (seconds), the number of times it had to wait in `stalls`.
+
+        If fetching fails, the background thread stops and the
+        exception is kept in `error`; the remaining data will then be
+        fetched when it is requested.
+
+        """
+        if isinstance(trades, TradeHistory):
+            trades = trades.tlist
+        self.trades = list(trades)
+        self.base_currency = base_currency
+        self.lookahead = max(1, lookahead)
+        self.planner = PrefetchPlanner(relation, max_workers)
+        self.stall_time = 0.0
+        self.stalls = 0
+        self.error = None
+        # The index of the trade being processed, the number of trades
+        # whose data has been fetched, and a condition guarding both:
+        self._position = 0
+        self._ready = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Start the background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='ccgains-prefetch')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background thread and wait for it to finish the
+        range of trades it is fetching."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __iter__(self):
+        self.start()
+        for i, trade in enumerate(self.trades):
+            with self._condition:
+                self._position = i
+                self._condition.notify_all()
+                if self._ready <= i and not self._stopped:
+                    t0 = time.time()
+                    while self._ready <= i and not self._stopped:
+                        self._condition.wait()
+                    self.stall_time += time.time() - t0
+                    self.stalls += 1
+            yield trade
+
+    def _run(self):
+        """Fetch the data of the trades ahead of the one being processed
+        until all trades are done (run by the background thread)."""
+        count = len(self.trades)
+        try:
+            while True:
+                with self._condition:
+                    while (not self._stopped and self._ready < count and
+                           self._ready >= self._position + self.lookahead):
+                        self._condition.wait()
+                    if self._stopped or self._ready >= count:
+                        return
+                    first = self._ready
+                    last = min(count, self._position + self.lookahead)
+                self.planner.prefetch(trade_needs(
+                    self.trades[first:last], self.base_currency))
+                with self._condition:
+                    self._ready = last
+                    self._condition.notify_all()
+        except Exception as e:
+            log.warning('Prefetching stopped: %s', e)
+            with self._condition:
+                self.error = e
+                self._ready = count
+                self._condition.notify_all()
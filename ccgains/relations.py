@@ -26,6 +26,67 @@
 
 from __future__ import division
 
+import numpy as np
+import pandas as pd
+
+from .cache import LRUCache
+from .historic_data import _to_epoch_ns
+
+import logging
+log = logging.getLogger(__name__)
+
+# nanoseconds per day:
+_DAY = 86400 * 10 ** 9
+
+# The maximum number of routes compared by `CurrencyRelation.explain_route`:
+_MAX_ROUTES = 100
+
+def _reverse(recipe):
+    """Return the recipe (see `CurrencyRelation.pairs`) for the
+    opposite direction of *recipe*."""
+    return [(fcur, tcur, not inverse)
+            for fcur, tcur, inverse in reversed(recipe)]
+
+
+def _bucket_size(hdata):
+    """Return the length (in nanoseconds) of the intervals in which the
+    prices of the HistoricData object *hdata* are constant, or None if
+    it is unknown, if it does not divide a day (so the intervals might
+    not be aligned with the epoch) or if prices might become too stale
+    within an interval (see `HistoricData.max_staleness`).
+
+    """
+    if getattr(hdata, 'max_staleness', None) is not None:
+        return None
+    interval = getattr(hdata, 'interval', None)
+    if interval is None:
+        interval = getattr(
+            getattr(getattr(hdata, 'data', None), 'index', None),
+            'freq', None)
+    if interval is None:
+        return None
+    try:
+        step = pd.tseries.frequencies.to_offset(interval).nanos
+    except ValueError:
+        return None
+    if (86400 * 10 ** 9) % step:
+        return None
+    return step
+
+
+class _Routes(dict):
+    """The dict `CurrencyRelation.pairs`, holding all routes found so
+    far and finding missing routes on demand (see
+    `CurrencyRelation._find_route`)."""
+
+    def __init__(self, relation):
+        dict.__init__(self)
+        self.relation = relation
+
+    def __missing__(self, key):
+        return self.relation._find_route(*key)
+
+
 class CurrencyRelation(object):
     def __init__(self, *args):
         """Create a CurrencyRelation object. This object contains
@@ -44,17 +105,68 @@ class CurrencyRelation(object):
         for hist_data in args:
             self.hdict[(hist_data.cfrom, hist_data.cto)] = hist_data
 
+        # self.graph is the graph of currencies: a dictionary with
+        # all currencies as keys and dictionaries as values, which map
+        # all currencies directly exchangeable with the key (i.e. with
+        # historical data in self.hdict) to the
+        # `(from_cur, to_cur, reciprocal?)`-tuple (see below) needed
+        # for the exchange:
+        self.graph = {}
+        for fcur, tcur in self.hdict:
+            self._add_edge(fcur, tcur)
+
         # self.pairs is a dictionary with keys
         # `(from_currency, to_currency)` and values
-        # `(num_tsteps, tsteps)` for all pairs of currencies whose
+        # `(num_tsteps, tsteps)` for pairs of currencies whose
         # exchange rates can be calculated with the provided historical
         # data sets. `tsteps` in turn is a list (with length `num_tsteps`)
         # of `(from_cur, to_cur, reciprocal?)`-tuples with exchanges
         # directly available in self.hdict that must be applied in
         # turn (maybe reciprocal) to achieve the desired translation
         # from `from_currency` to `to_currency`.
-        self.pairs = {}
-        self.update_available_pairs()
+        # The routes are only searched (in self.graph) when a pair is
+        # looked up (`self.pairs[(from_currency, to_currency)]`), unless
+        # `update_available_pairs` is called to find all of them.
+        self.pairs = _Routes(self)
+        # Does self.pairs hold the routes of all pairs?
+        self._complete = False
+
+        # The rates calculated by `get_rate`, keyed by the pair and the
+        # intervals of all prices used. Replace it with another
+        # LRUCache to change its bounds; its `stats` show how often
+        # rates could be reused:
+        self.rate_memo = LRUCache(max_entries=10000)
+        # The interval lengths of the keys of self.hdict (see
+        # `_bucket_size`), once needed:
+        self._bucket_sizes = {}
+
+        # The rates of indirect pairs materialized for whole days (see
+        # `materialize`), keyed by `(from_currency, to_currency, day)`:
+        self.cross_rates = LRUCache(max_entries=1000)
+        # Indirect pairs are materialized automatically for each day
+        # they are looked up on by `get_rate`, once they have been
+        # looked up this many times (None to disable):
+        self.materialize_after = 100
+        # How often each indirect pair has been looked up:
+        self._usage = {}
+
+        # The routes in self.pairs are only the first shortest ones
+        # found. If self.source_costs is set (e.g. to
+        # `{'memory': 0, 'disk': 1, 'network': 50}`), the route used
+        # for a pair on a UTC day is chosen by the cost of looking up
+        # the prices on that day instead (see `explain_route`): the sum
+        # of `self.hop_cost` and the cost in self.source_costs of the
+        # source of the price (see `HistoricData.data_source`) for
+        # every exchange on the route. Routes with up to
+        # self.max_extra_hops exchanges more than the shortest one are
+        # considered. Since the rates of different routes differ
+        # slightly, and the sources depend on what has been cached
+        # before, this is off by default.
+        self.source_costs = None
+        self.hop_cost = 1
+        self.max_extra_hops = 0
+        # The routes chosen, keyed by `(from_currency, to_currency, day)`:
+        self.route_choices = {}
 
     def add_historic_data(self, hist_data):
         """Add an HistoricData object. If a HistoricData object with
@@ -64,6 +176,72 @@ class CurrencyRelation(object):
         self.hdict[(hist_data.cfrom, hist_data.cto)] = hist_data
         self.update_available_pairs((hist_data.cfrom, hist_data.cto))
 
+    def _add_edge(self, fcur, tcur):
+        """Add the exchange between *fcur* and *tcur* (a key of
+        self.hdict) to self.graph, in both directions. Return False if
+        the currencies were already connected directly.
+
+        """
+        if tcur in self.graph.get(fcur, ()):
+            return False
+        self.graph.setdefault(fcur, {})[tcur] = (fcur, tcur, False)
+        self.graph.setdefault(tcur, {})[fcur] = (fcur, tcur, True)
+        return True
+
+    def _search(self, source, target=None):
+        """Search self.graph breadth-first, starting at currency
+        *source*, until *target* is found (or until all currencies
+        connected to *source* are found, if *target* is None).
+
+        :returns: dict with the currencies found as keys and tuples
+            `(distance, previous_currency, tstep)` as values, where
+            `tstep` is the exchange from `previous_currency` to the
+            key on a shortest route from *source*.
+
+        """
+        found = {source: (0, None, None)}
+        queue = [source]
+        for cur in queue:
+            distance = found[cur][0] + 1
+            for ncur, tstep in self.graph[cur].items():
+                if ncur not in found:
+                    found[ncur] = (distance, cur, tstep)
+                    if ncur == target:
+                        return found
+                    queue.append(ncur)
+        return found
+
+    @staticmethod
+    def _route(found, cur):
+        """Return the recipe from the source of the search result
+        *found* (see `_search`) to currency *cur*."""
+        recipe = []
+        while found[cur][1] is not None:
+            recipe.append(found[cur][2])
+            cur = found[cur][1]
+        recipe.reverse()
+        return recipe
+
+    def _find_route(self, from_currency, to_currency):
+        """Find a shortest route from *from_currency* to *to_currency*
+        in self.graph, save it (and the reverse route) in self.pairs
+        and return it. Raise a KeyError if there is none.
+
+        """
+        if (from_currency == to_currency
+                or from_currency not in self.graph
+                or to_currency not in self.graph):
+            raise KeyError((from_currency, to_currency))
+        found = self._search(from_currency, to_currency)
+        if to_currency not in found:
+            raise KeyError((from_currency, to_currency))
+        recipe = self._route(found, to_currency)
+        self.pairs[(from_currency, to_currency)] = (len(recipe), recipe)
+        if (to_currency, from_currency) not in self.pairs:
+            self.pairs[(to_currency, from_currency)] = (
+                len(recipe), _reverse(recipe))
+        return self.pairs[(from_currency, to_currency)]
+
     def update_available_pairs(self, newtuple=None):
         """Update internal list of pairs with available historical rate.
 
@@ -73,100 +251,89 @@ class CurrencyRelation(object):
             rebuild of pairs list from scratch based on supplied
             historical data sets.
 
+        Normally, routes are only searched for pairs that are looked
+        up, so this is only needed (without *newtuple*) to fill
+        `self.pairs` with the routes of all pairs at once, or after
+        modifying `self.hdict` directly.
+
+        When a new pair is supplied, only the routes already found
+        that become shorter with the new pair are replaced (and, if
+        the routes of all pairs had been found, the routes between
+        currencies that were not connected before are added).
+
         """
+        # The rates calculated before might change:
+        self.rate_memo.clear()
+        self._bucket_sizes.clear()
+        self.cross_rates.clear()
+        self._usage.clear()
+        self.route_choices.clear()
         if not newtuple:
-            # clear pairs list:
-            self.pairs = {}
-            to_add = self.hdict.keys()
+            self.graph = {}
+            for fcur, tcur in self.hdict:
+                self._add_edge(fcur, tcur)
+            self.pairs.clear()
+            for source in self.graph:
+                found = self._search(source)
+                for cur in found:
+                    if cur != source and (source, cur) not in self.pairs:
+                        recipe = self._route(found, cur)
+                        self.pairs[(source, cur)] = (len(recipe), recipe)
+                        self.pairs[(cur, source)] = (
+                            len(recipe), _reverse(recipe))
+            self._complete = True
+            return self.pairs
+
+        fcur, tcur = (c.upper() for c in newtuple)
+        # check if newtuple provided is really available:
+        if (fcur, tcur) not in self.hdict:
+            if (tcur, fcur) not in self.hdict:
+                raise ValueError(
+                    "Supplied new pair {} has no historical data. "
+                    "Please provide it with `add_historic_data` first."
+                    "".format(str((fcur, tcur))))
+            fcur, tcur = tcur, fcur
+        if self._add_edge(fcur, tcur) and (self._complete or self.pairs):
+            self._update_routes(fcur, tcur)
+        return self.pairs
+
+    def _update_routes(self, cur_a, cur_b):
+        """Update the routes in self.pairs after the currencies *cur_a*
+        and *cur_b* have been connected directly in self.graph.
+
+        """
+        found_a = self._search(cur_a)
+        found_b = self._search(cur_b)
+        if self._complete:
+            # All pairs of the (joined) component might be new:
+            candidates = [(x, y) for x in found_a for y in found_a if x != y]
         else:
-            fcur, tcur = (c.upper() for c in newtuple)
-            # check if newtuple provided is really available:
-            if (fcur, tcur) not in self.hdict:
-                if (tcur, fcur) not in self.hdict:
-                    raise ValueError(
-                        "Supplied new pair {} has no historical data. "
-                        "Please provide it with `add_historic_data` first."
-                        "".format(str((fcur, tcur))))
-                else:
-                    to_add = [(tcur, fcur)]
+            candidates = [(x, y) for x, y in self.pairs if x in found_a]
+        for x, y in candidates:
+            # The shortest route via the new exchange:
+            via_ab = found_a[x][0] + 1 + found_b[y][0]
+            via_ba = found_b[x][0] + 1 + found_a[y][0]
+            count = min(via_ab, via_ba)
+            if (x, y) in self.pairs and self.pairs[(x, y)][0] <= count:
+                continue
+            if via_ab <= via_ba:
+                recipe = (_reverse(self._route(found_a, x))
+                          + [self.graph[cur_a][cur_b]]
+                          + self._route(found_b, y))
             else:
-                to_add = [(fcur, tcur)]
-
-        for new1, new2 in to_add:
-            foundA = []
-            foundB = []
-            # first compare new pair with available pairs and try to add
-            # new combined relations:
-            for (cfrom, cto), (count, recipe) in tuple(self.pairs.items()):
-                if new2 == cfrom and new1 != cto:
-                    # new pair can be added before other recipe
-                    newp = [(new1, cto),
-                            (count + 1, [(new1, new2, False)] + recipe)]
-                    # reverse direction:
-                    newr = [(cto, new1),
-                            (count + 1, self.pairs[(cto, cfrom)][1]
-                                        + [(new1, new2, True)]      )]
-                    # in case it's already available, only add if
-                    # new recipe is shorter:
-                    if (newp[0] not in self.pairs
-                        or self.pairs[newp[0]][0] > count + 1):
-                            self.pairs[newp[0]] = newp[1]
-                            # also add the reverse direction:
-                            self.pairs[newr[0]] = newr[1]
-                            # keep track of addition, will be needed later:
-                            foundB.append((cfrom, cto, count, recipe))
-                elif new1 == cto and new2 != cfrom:
-                    # new pair can be added after other recipe:
-                    newp = [(cfrom, new2),
-                            (count + 1, recipe + [(new1, new2, False)])]
-                    # reverse direction:
-                    newr = [(new2, cfrom),
-                            (count + 1, [(new1, new2, True)]
-                                        + self.pairs[(cto, cfrom)][1])]
-                    # in case it's already available, only add if
-                    # new recipe is shorter:
-                    if (newp[0] not in self.pairs
-                        or self.pairs[newp[0]][0] > count + 1):
-                            self.pairs[newp[0]] = newp[1]
-                            # also add the reverse direction:
-                            self.pairs[newr[0]] = newr[1]
-                            # keep track of addition, will be needed later:
-                            foundA.append((cfrom, cto, count, recipe))
-            # If the new pair could be added to the beginning aswell as
-            # to the end of existing recipes, there are also new recipes
-            # where the new pair joins two old recipes together:
-            for fa in foundA:
-                for fb in foundB:
-                    newp = [(fa[0], fb[1]),
-                            (fa[2] + fb[2] + 1, fa[3]
-                                                + [(new1, new2, False)]
-                                                + fb[3])]
-                    # reverse direction:
-                    newr = [(fb[1], fa[0]),
-                            (fa[2] + fb[2] + 1,
-                                 self.pairs[(fb[1], fb[0])][1]
-                                 + [(new1, new2, True)]
-                                 + self.pairs[(fa[1], fa[0])][1])]
-                    # in case it's already available, only add if
-                    # new recipe is shorter:
-                    if (newp[0] not in self.pairs
-                        or self.pairs[newp[0]][0] > fa[2] + fb[2] + 1):
-                            self.pairs[newp[0]] = newp[1]
-                            # also add the reverse direction:
-                            self.pairs[newr[0]] = newr[1]
-            # And finally, don't forget to add the new pair by itself:
-            newp = [(new1, new2), (1, [(new1, new2, False)])]
-            # reverse direction:
-            newr = [(new2, new1), (1, [(new1, new2, True)])]
-            # in case it's already available, only add if
-            # new recipe is shorter:
-            if (newp[0] not in self.pairs
-                or self.pairs[newp[0]][0] > 1):
-                    self.pairs[newp[0]] = newp[1]
-                    # also add the reverse direction:
-                    self.pairs[newr[0]] = newr[1]
+                recipe = (_reverse(self._route(found_b, x))
+                          + [self.graph[cur_b][cur_a]]
+                          + self._route(found_a, y))
+            self.pairs[(x, y)] = (count, recipe)
+            self.pairs[(y, x)] = (count, _reverse(recipe))
 
-        return self.pairs
+    def _bucket(self, fcur, tcur):
+        """Return the interval length of the HistoricData object of
+        (*fcur*, *tcur*) in self.hdict (see `_bucket_size`)."""
+        if (fcur, tcur) not in self._bucket_sizes:
+            self._bucket_sizes[(fcur, tcur)] = _bucket_size(
+                self.hdict[(fcur, tcur)])
+        return self._bucket_sizes[(fcur, tcur)]
 
     def get_rate(self, dtime, from_currency, to_currency):
         """Return the rate for conversion of *from_currency* to
@@ -177,13 +344,356 @@ class CurrencyRelation(object):
         using multiple added pairs is tried. If this also fails, a
         KeyError is raised.
 
+        The prices of each HistoricData object are constant within its
+        intervals, so the rate is memoized in `self.rate_memo`, keyed
+        by the pair and the intervals containing *dtime* of all
+        HistoricData objects used, and only calculated again for a
+        datetime in other intervals. (Rates using HistoricData objects
+        whose intervals are unknown, don't divide a day or that have a
+        `max_staleness` are always calculated.)
+
+        Rates of indirect pairs looked up often are materialized for
+        whole days (see `materialize` and `self.materialize_after`).
+
+        If `self.source_costs` is set and there are several routes, the
+        one whose prices are the cheapest to look up on the UTC day of
+        *dtime* is used for the whole day (see `explain_route`), unless
+        a price on it is not available, in which case the route in
+        self.pairs is used for the rest of the day.
+
         """
-        recipe = self.pairs[
-                (from_currency.upper(), to_currency.upper())][1]
+        pair = (from_currency.upper(), to_currency.upper())
+        time = pd.Timestamp(dtime).value
+        recipe = self._choose_route(pair, time)
+        try:
+            return self._get_rate(pair, recipe, dtime, time)
+        except KeyError:
+            if recipe == self.pairs[pair][1]:
+                raise
+        self._reject_route(pair, time // _DAY)
+        return self._get_rate(pair, self.pairs[pair][1], dtime, time)
+
+    def _get_rate(self, pair, recipe, dtime, time):
+        """Return the rate of *pair* at *dtime* (*time* in nanoseconds
+        since the epoch) along the route *recipe*, see `get_rate`."""
+        if len(recipe) > 1:
+            result = self._cross_rate(pair, recipe, time)
+            if result is not None:
+                return result
+        memo_key = pair
+        for fcur, tcur, inverse in recipe:
+            step = self._bucket(fcur, tcur)
+            if step is None:
+                memo_key = None
+                break
+            memo_key += (fcur, tcur, time // step)
+        if memo_key is not None:
+            result = self.rate_memo.get(memo_key)
+            if result is not None:
+                return result
         result = 1
         for fcur, tcur, inverse in recipe:
             if not inverse:
                 result *= self.hdict[(fcur, tcur)].get_price(dtime)
             else:
                 result /= self.hdict[(fcur, tcur)].get_price(dtime)
+        if memo_key is not None:
+            self.rate_memo.put(memo_key, result)
+        return result
+
+    def get_rates(self, dtimes, from_currency, to_currency):
+        """Return the rates for conversion of *from_currency* to
+        *to_currency* at all datetimes in *dtimes* at once.
+
+        :param dtimes: array-like of datetimes or of unix timestamps
+            (see `HistoricData.get_prices`)
+        :returns: numpy.ndarray with the rates, in the same order as
+            *dtimes*.
+
+        This gives the same results as calling `get_rate` for each
+        item in *dtimes*, but the prices of each HistoricData object
+        on the route are looked up for all datetimes with a single
+        call of its `get_prices` method (with whatever interval it
+        has), and the rates are calculated by multiplying (or dividing)
+        the whole arrays of prices. Rates materialized before (see
+        `materialize`) are looked up instead. The routes are chosen
+        for each UTC day like in `get_rate`.
+
+        """
+        pair = (from_currency.upper(), to_currency.upper())
+        times = _to_epoch_ns(dtimes)
+        default = self.pairs[pair][1]
+        if self.source_costs is None and (
+                len(default) == 1 or not len(self.cross_rates)):
+            # The route is the same on all days:
+            return self._calc_rates(times, default)
+        days = times // _DAY
+        # Group the positions of *times* by day in a single pass:
+        order = np.argsort(days, kind='stable')
+        udays, starts = np.unique(days[order], return_index=True)
+        result = np.full(len(times), np.nan)
+        # The days each route is used on, with the positions on them:
+        route_days = {}
+        for day, todo in zip(udays, np.split(order, starts[1:])):
+            recipe = self._choose_route(pair, times[todo].min())
+            route_days.setdefault(tuple(recipe), []).append((day, todo))
+            if len(recipe) > 1 and len(self.cross_rates):
+                segment = self.cross_rates.get(pair + (day,))
+                if segment is not None:
+                    seg_times, seg_rates = segment
+                    result[todo] = seg_rates[np.searchsorted(
+                        seg_times, times[todo], side='right') - 1]
+        for recipe, rdays in route_days.items():
+            todo = np.concatenate([positions for day, positions in rdays])
+            missing = todo[np.isnan(result[todo])]
+            if not len(missing):
+                continue
+            try:
+                result[missing] = self._calc_rates(times[missing], recipe)
+            except KeyError:
+                if list(recipe) == default:
+                    raise
+                # Use the route in self.pairs on these days instead:
+                for day, positions in rdays:
+                    self._reject_route(pair, day)
+                result[todo] = self._calc_rates(times[todo], default)
         return result
+
+    def _calc_rates(self, times, recipe):
+        """Return the rates along *recipe* at *times* (numpy array of
+        nanoseconds since the epoch)."""
+        # (Convert the datetimes only once for all HistoricData objects:)
+        times = times.view('M8[ns]')
+        result = np.ones(len(times))
+        for fcur, tcur, inverse in recipe:
+            prices = self.hdict[(fcur, tcur)].get_prices(times)
+            if not inverse:
+                result *= prices
+            else:
+                result /= prices
+        return result
+
+    def _cross_rate(self, pair, recipe, time):
+        """Return the materialized rate of the indirect *pair* at *time*
+        (nanoseconds since the epoch), materializing its day if the pair
+        is used often enough, or None if it is not available.
+
+        """
+        day = time // _DAY
+        key = pair + (day,)
+        if key in self.cross_rates:
+            segment = self.cross_rates.get(key)
+        else:
+            self._usage[pair] = self._usage.get(pair, 0) + 1
+            if (self.materialize_after is None
+                    or self._usage[pair] < self.materialize_after):
+                return None
+            segment = self._materialize_day(pair, recipe, day)
+        if segment is None:
+            return None
+        times, rates = segment
+        result = rates[np.searchsorted(times, time, side='right') - 1]
+        return None if np.isnan(result) else result
+
+    def _materialize_day(self, pair, recipe, day):
+        """Calculate the rates of *pair* along *recipe* for the UTC day
+        number *day* (since the epoch), save them in self.cross_rates
+        and return them as tuple `(times, rates)` of numpy arrays, where
+        `rates[i]` is the rate from `times[i]` (nanoseconds since the
+        epoch) up to the next time.
+
+        Return None if the pair can't be materialized because the
+        intervals of one of its HistoricData objects are unknown (see
+        `_bucket_size`); the pair won't be materialized automatically
+        anymore then.
+
+        """
+        steps = [self._bucket(fcur, tcur) for fcur, tcur, _ in recipe]
+        if None in steps:
+            self._usage[pair] = float('-inf')
+            return None
+        # The rate can only change at the start of an interval of one
+        # of the HistoricData objects:
+        times = np.unique(np.concatenate(
+            [np.arange(day * _DAY, (day + 1) * _DAY, step)
+             for step in set(steps)]))
+        rates = np.ones(len(times))
+        for fcur, tcur, inverse in recipe:
+            hdata = self.hdict[(fcur, tcur)]
+            # Request the data of the day only once, and only look up
+            # the prices it covers (NaN elsewhere), so prices that are
+            # not available are not requested again for every interval:
+            prices = np.full(len(times), np.nan)
+            try:
+                df = hdata.prepare_request(pd.Timestamp(day * _DAY, tz='UTC'))
+            except KeyError:
+                df = None
+            if df is not None and len(df):
+                i, j = np.searchsorted(times, [
+                    df.index[0].value,
+                    (df.index[-1] + hdata._interval(df)).value])
+                if i < j:
+                    prices[i:j] = hdata._lookup(df, times[i:j])
+            if not inverse:
+                rates *= prices
+            else:
+                rates /= prices
+        self.cross_rates.put(pair + (day,), (times, rates))
+        return times, rates
+
+    def materialize(self, pairs, first_day, last_day):
+        """Materialize the rates of the indirect currency *pairs* for
+        all days from *first_day* to *last_day* (both inclusive; only
+        the UTC date is taken into account), i.e. calculate the rates
+        at the start of every interval of any of the HistoricData
+        objects on their routes, so `get_rate` and `get_rates` can
+        look them up in a single array, instead of looking up the
+        prices of all HistoricData objects on the route.
+
+        :param pairs: list of `(from_currency, to_currency)`-tuples
+        :returns: the number of days materialized
+
+        The rates are kept in `self.cross_rates` (an LRUCache, which
+        can be replaced to change its bounds) until historic data is
+        added. Direct pairs are left out, as well as pairs using
+        HistoricData objects whose intervals are unknown (see
+        `_bucket_size`).
+
+        """
+        first = _to_epoch_ns(first_day)[0] // _DAY
+        last = _to_epoch_ns(last_day)[0] // _DAY
+        count = 0
+        for from_currency, to_currency in pairs:
+            pair = (from_currency.upper(), to_currency.upper())
+            for day in range(first, last + 1):
+                recipe = self._choose_route(pair, day * _DAY)
+                if len(recipe) < 2:
+                    continue
+                if self._materialize_day(pair, recipe, day) is None:
+                    log.warning('Rates of %s/%s cannot be materialized',
+                                pair[1], pair[0])
+                    break
+                count += 1
+        return count
+
+    def _candidate_routes(self, from_currency, to_currency):
+        """Return the recipes of the routes from *from_currency* to
+        *to_currency* with at most self.max_extra_hops exchanges more
+        than the shortest route (but not more than _MAX_ROUTES routes),
+        beginning with the route in self.pairs.
+
+        """
+        default = self.pairs[(from_currency, to_currency)][1]
+        # The distances of all currencies to *to_currency*:
+        distances = self._search(to_currency)
+        limit = len(default) + self.max_extra_hops
+        routes = [default]
+        # Depth-first search of all routes without loops, leaving out
+        # currencies that are too far from *to_currency*:
+        stack = [(from_currency, (from_currency,), ())]
+        while stack and len(routes) < _MAX_ROUTES:
+            cur, visited, recipe = stack.pop()
+            if cur == to_currency:
+                if list(recipe) != default:
+                    routes.append(list(recipe))
+                continue
+            for ncur, tstep in self.graph[cur].items():
+                if (ncur in distances and ncur not in visited
+                        and len(recipe) + 1 + distances[ncur][0] <= limit):
+                    stack.append(
+                        (ncur, visited + (ncur,), recipe + (tstep,)))
+        return routes
+
+    def _route_cost(self, recipe, dtime):
+        """Return the sources of the prices of all exchanges in
+        *recipe* at *dtime* (see `HistoricData.data_source`) and the
+        cost of the route (infinite if a price is not available).
+
+        """
+        sources = [self.hdict[(fcur, tcur)].data_source(dtime)
+                   for fcur, tcur, inverse in recipe]
+        if None in sources:
+            return sources, float('inf')
+        costs = self.source_costs or {}
+        return sources, sum(self.hop_cost + costs.get(source, 0)
+                            for source in sources)
+
+    def explain_route(self, dtime, from_currency, to_currency):
+        """Return how the route for the conversion of *from_currency*
+        to *to_currency* at *dtime* is chosen by `get_rate` (which
+        uses the chosen route for the whole UTC day): a list of dicts,
+        one for each route considered, sorted by preference (the first
+        route is chosen, unless self.source_costs is None), with keys
+
+        - 'recipe': the exchanges on the route (see `self.pairs`),
+        - 'sources': where the price of each exchange would be looked
+          up (see `HistoricData.data_source`),
+        - 'cost': the cost of the route (see `self.source_costs`),
+        - 'chosen': whether the route is the one used.
+
+        Routes of equal cost are preferred by fewer exchanges, then
+        the route in self.pairs. If the routes have been chosen
+        before (see `self.route_choices`), the route chosen then is
+        still used, even if the sources changed meanwhile.
+
+        """
+        pair = (from_currency.upper(), to_currency.upper())
+        dtime = pd.Timestamp(pd.Timestamp(dtime).value, tz='UTC')
+        routes = []
+        for recipe in self._candidate_routes(*pair):
+            sources, cost = self._route_cost(recipe, dtime)
+            routes.append({'recipe': recipe, 'sources': sources,
+                           'cost': cost, 'chosen': False})
+        routes.sort(key=lambda route: (route['cost'], len(route['recipe'])))
+        if self.source_costs is None:
+            chosen = self.pairs[pair][1]
+        else:
+            chosen = self.route_choices.get(
+                pair + (dtime.value // _DAY,), routes[0]['recipe'])
+        for route in routes:
+            route['chosen'] = route['recipe'] == chosen
+        return routes
+
+    def _reject_route(self, pair, day):
+        """Use the route in self.pairs for *pair* on the UTC day number
+        *day* (since the epoch), after a price on the route chosen
+        before was not available.
+
+        """
+        log.debug('Route %s for %s/%s is not available on %s, using %s',
+                  self.route_choices.get(pair + (day,)), pair[1], pair[0],
+                  pd.Timestamp(day * _DAY, tz='UTC').date(),
+                  self.pairs[pair][1])
+        self.route_choices[pair + (day,)] = self.pairs[pair][1]
+        # Rates materialized along the rejected route:
+        self.cross_rates.pop(pair + (day,))
+
+    def _choose_route(self, pair, time):
+        """Return the recipe of the route to use for *pair* at *time*
+        (nanoseconds since the epoch), see `explain_route`. The route
+        is chosen at the first time looked up on each UTC day.
+
+        """
+        default = self.pairs[pair][1]
+        if self.source_costs is None:
+            return default
+        key = pair + (time // _DAY,)
+        recipe = self.route_choices.get(key)
+        if recipe is not None:
+            return recipe
+        dtime = pd.Timestamp(time, tz='UTC')
+        sources, cost = self._route_cost(default, dtime)
+        if cost > len(default) * (
+                self.hop_cost + self.source_costs.get('memory', 0)):
+            # There might be a cheaper route:
+            routes = self.explain_route(dtime, *pair)
+            recipe = routes[0]['recipe']
+            if recipe != default:
+                log.debug(
+                    'Using route %s (sources: %s) instead of %s (sources: '
+                    '%s) for %s/%s on %s', recipe, routes[0]['sources'],
+                    default, sources, pair[1], pair[0], dtime.date())
+        else:
+            recipe = default
+        self.route_choices[key] = recipe
+        return recipe
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+"""Storage backends for cached price data.
+
+A backend is opened like a file, as context manager, and provides a
+dict-like interface mapping string keys to pandas Series or DataFrames
+with a DatetimeIndex:
+
+    with HDF5Store('prices.h5') as store:
+        store.put('EUR_BTC', data, attrs={'source': 'csv'})
+        data = store.get('EUR_BTC')
+
+Available backends are registered in `backends`; `get_backend`
+returns a backend class from its name.
+
+"""
+
+import json
+import os
+import threading
+from os import path
+
+import numpy as np
+import pandas as pd
+
+import logging
+log = logging.getLogger(__name__)
+
+# The HDF5 library is not thread-safe, so all access to HDF5 files
+# must be serialized:
+_hdf5_lock = threading.RLock()
+
+def _tz_name(tzinfo):
+    """Return the name of timezone *tzinfo* (None stays None)."""
+    if tzinfo is None:
+        return None
+    # pytz timezones have a name, dateutil's tzutc has not:
+    return getattr(tzinfo, 'zone', 'UTC')
+
+def _replace(src, dst):
+    """Rename file *src* to *dst*, replacing *dst* atomically if it
+    exists. (Memory maps of the old *dst* stay valid.)"""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2:
+        if os.name == 'nt' and path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def _slice(data, start=None, end=None):
+    """Return the rows of *data* (sorted by its DatetimeIndex) with an
+    index between the pandas.Timestamps *start* and *end* (both
+    inclusive; None for no limit).
+
+    """
+    index = data.index.asi8
+    i = 0 if start is None else index.searchsorted(start.value, 'left')
+    j = len(index) if end is None else index.searchsorted(
+        end.value, 'right')
+    return data.iloc[i:j]
+
+
+class HDF5Store(object):
+    """Price store backed by a single HDF5 file (using PyTables
+    through `pandas.HDFStore`).
+
+    The HDF5 library is not thread-safe; therefore, only one HDF5Store
+    can be open at a time in a process; other threads opening one
+    will block until it is closed again.
+
+    """
+    extension = '.h5'
+
+    def __init__(self, file_name, mode='a'):
+        """Prepare to open the HDF5 file *file_name* with *mode* ('r'
+        for reading only, 'a' for reading and writing). The file will
+        be opened when entering the context (`with` statement).
+
+        """
+        self.file_name = file_name
+        self.mode = mode
+        self._store = None
+
+    @staticmethod
+    def getmtime(file_name):
+        """Return the modification time of the store *file_name*,
+        or 0 if it does not exist."""
+        try:
+            return path.getmtime(file_name)
+        except OSError:
+            return 0
+
+    def __enter__(self):
+        _hdf5_lock.acquire()
+        try:
+            self._store = pd.HDFStore(self.file_name, mode=self.mode)
+        except:
+            _hdf5_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self._store.close()
+        finally:
+            self._store = None
+            _hdf5_lock.release()
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def keys(self):
+        """Return a list of all keys in the store."""
+        return [k.lstrip('/') for k in self._store.keys()]
+
+    def get(self, key):
+        """Return the data saved under *key*. Raise KeyError if *key*
+        is not in the store."""
+        return self._store.get(key)
+
+    def get_range(self, key, start=None, end=None):
+        """Return the rows of the data saved under *key* with an index
+        between the pandas.Timestamps *start* and *end* (both
+        inclusive; None for no limit). Raise KeyError if *key* is not
+        in the store.
+
+        Only data saved with `put(..., indexed=True)` (or `append`) is
+        read partially, using a query on the HDF5 table's index;
+        other data is read completely and sliced.
+
+        """
+        if not self._store.get_storer(key).is_table:
+            return _slice(self._store.get(key), start, end)
+        where = []
+        if start is not None:
+            where.append('index >= start')
+        if end is not None:
+            where.append('index <= end')
+        return self._store.select(key, where=' & '.join(where) or None)
+
+    def put(self, key, data, attrs=None, indexed=False):
+        """Save *data* (a pandas Series or DataFrame with DatetimeIndex)
+        under *key*, replacing data saved before under the same key.
+        Attach the dict *attrs* to it (see `get_attrs`). If *indexed*
+        is True, the data is saved in 'table' format, so `get_range`
+        can read parts of it without loading all of it.
+
+        """
+        self._store.put(key, data, format='table' if indexed else 'fixed')
+        if attrs:
+            self._store.get_storer(key).attrs.ccgains_attrs = attrs
+
+    def get_attrs(self, key):
+        """Return the dict of attributes saved with *key* (empty if
+        there are none). Raise KeyError if *key* is not in the store.
+
+        """
+        if key not in self._store:
+            raise KeyError(key)
+        return getattr(
+            self._store.get_storer(key).attrs, 'ccgains_attrs', {})
+
+    def remove(self, key):
+        """Remove *key* from the store."""
+        self._store.remove(key)
+
+    def append(self, key, data):
+        """Append the DataFrame *data* to the data under *key*, which
+        will be created if it does not exist. Data created with `put`
+        cannot be appended to.
+
+        """
+        self._store.append(key, data)
+
+    def is_appendable(self, key):
+        """Return True if the data under *key* has been created with
+        `append`; `select` will then be able to return it in chunks.
+
+        """
+        if key not in self._store:
+            raise KeyError(key)
+        return self._store.get_storer(key).is_table
+
+    def select(self, key, chunksize):
+        """Return an iterator yielding the data saved under *key* in
+        chunks of approximately *chunksize* rows. The data must have
+        been created with `append`. The chunks are only available as
+        long as the store is open.
+
+        """
+        return self._store.select(key, chunksize=chunksize)
+
+
+class NpyStore(object):
+    """Price store backed by a folder of raw numpy arrays in '.npy'
+    files.
+
+    For every key, the index (as int64 nanoseconds since the epoch,
+    UTC) and every column of the data are saved in separate '.npy'
+    files, along with a small json file describing the data. When
+    loaded with `get`, the arrays are memory-mapped
+    (`numpy.load(mmap_mode='r')`) and wrapped in pandas objects without
+    copying, so loading is almost instantaneous, only the pages
+    accessed by price lookups are read from disk, and multiple
+    processes using the same files share the operating system's page
+    cache.
+
+    The data must consist of numerical (not object) columns.
+
+    """
+    extension = '.npyd'
+    _write_lock = threading.RLock()
+
+    def __init__(self, file_name, mode='a'):
+        """Prepare to open the store folder *file_name* with *mode*
+        ('r' for reading only, 'a' for reading and writing). The folder
+        will be created on entering the context (`with` statement) if
+        it does not exist and *mode* is not 'r'.
+
+        """
+        self.file_name = file_name
+        self.mode = mode
+
+    @staticmethod
+    def getmtime(file_name):
+        """Return the modification time of the store *file_name*,
+        i.e. of its newest file, or 0 if it does not exist."""
+        try:
+            return max(
+                [path.getmtime(file_name)]
+                + [path.getmtime(path.join(file_name, f))
+                   for f in os.listdir(file_name)])
+        except OSError:
+            return 0
+
+    def __enter__(self):
+        if not path.isdir(self.file_name):
+            if self.mode == 'r':
+                raise IOError('File %s does not exist' % self.file_name)
+            os.makedirs(self.file_name)
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def _path(self, key, *parts):
+        return path.join(self.file_name, '.'.join((key,) + parts))
+
+    def _meta(self, key):
+        try:
+            with open(self._path(key, 'json')) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            raise KeyError(key)
+
+    def _write_meta(self, key, meta):
+        tmp = self._path(key, 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        _replace(tmp, self._path(key, 'json'))
+
+    def _save_array(self, key, part, name, arr):
+        tmp = self._path(key, str(part), name, 'tmp.npy')
+        np.save(tmp, arr, allow_pickle=False)
+        _replace(tmp, self._path(key, str(part), name, 'npy'))
+
+    def _write_part(self, key, part, data):
+        """Save arrays of *data* as part number *part* of *key*."""
+        if isinstance(data, pd.Series):
+            columns = [data.values]
+        else:
+            columns = [data[c].values for c in data.columns]
+        index = data.index
+        if index.tz is not None:
+            index = index.tz_convert('UTC')
+        self._save_array(key, part, 'index', index.asi8)
+        for i, values in enumerate(columns):
+            self._save_array(key, part, 'c%i' % i, np.asarray(values))
+
+    def _read_part(self, key, part, meta, mmap_mode='r', start=None,
+                   end=None):
+        """Load part number *part* of *key*, only the rows with an index
+        between the pandas.Timestamps *start* and *end* (both inclusive;
+        None for no limit).
+
+        """
+        arr = np.load(
+            self._path(key, str(part), 'index', 'npy'), mmap_mode=mmap_mode)
+        # Find the rows in the (memory-mapped) index first, so only
+        # the rows needed are wrapped and later read:
+        i = 0 if start is None else arr.searchsorted(start.value, 'left')
+        j = len(arr) if end is None else arr.searchsorted(end.value, 'right')
+        arr = arr[i:j]
+        index = pd.DatetimeIndex(
+            arr.view('M8[ns]'), copy=False, name=meta['index_name'])
+        if meta['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(meta['tz'])
+        if meta['freq'] is not None and meta['parts'] == 1:
+            freq = pd.tseries.frequencies.to_offset(meta['freq'])
+            try:
+                # (avoids validating the frequency against all values)
+                index.freq = freq
+            except (AttributeError, ValueError):
+                index = pd.DatetimeIndex(index, freq=freq)
+        columns = [
+            np.load(self._path(key, str(part), 'c%i' % c, 'npy'),
+                    mmap_mode=mmap_mode)[i:j]
+            for c in range(len(meta['columns']))]
+        if meta['kind'] == 'series':
+            return pd.Series(
+                columns[0], index=index, name=meta['columns'][0],
+                copy=False)
+        # Add the columns one by one, since the DataFrame constructor
+        # would copy them into a single new block:
+        frame = pd.DataFrame(index=index)
+        for name, values in zip(meta['columns'], columns):
+            frame[name] = pd.Series(values, index=index, copy=False)
+        return frame
+
+    def __contains__(self, key):
+        return path.exists(self._path(key, 'json'))
+
+    def keys(self):
+        """Return a list of all keys in the store."""
+        return sorted(
+            f[:-5] for f in os.listdir(self.file_name)
+            if f.endswith('.json'))
+
+    def get(self, key):
+        """Return the data saved under *key*. Raise KeyError if *key*
+        is not in the store."""
+        meta = self._meta(key)
+        if meta['parts'] == 1:
+            return self._read_part(key, 0, meta)
+        if meta['parts'] == 0:
+            raise KeyError(key)
+        return pd.concat(
+            [self._read_part(key, p, meta, None)
+             for p in range(meta['parts'])])
+
+    def get_range(self, key, start=None, end=None):
+        """Return the rows of the data saved under *key* with an index
+        between the pandas.Timestamps *start* and *end* (both
+        inclusive; None for no limit). Raise KeyError if *key* is not
+        in the store.
+
+        Since the data is memory-mapped, only the part of the index
+        needed to find the rows is read from disk, and the rows are
+        not copied (unless the data has been appended in parts).
+
+        """
+        meta = self._meta(key)
+        if meta['parts'] == 1:
+            return self._read_part(key, 0, meta, start=start, end=end)
+        if meta['parts'] == 0:
+            raise KeyError(key)
+        return pd.concat(
+            [self._read_part(key, p, meta, None, start, end)
+             for p in range(meta['parts'])])
+
+    def put(self, key, data, attrs=None, indexed=False):
+        """Save *data* (a pandas Series or DataFrame with DatetimeIndex)
+        under *key*, replacing data saved before under the same key.
+        Attach the dict *attrs* to it (see `get_attrs`). (*indexed* is
+        only there for compatibility with HDF5Store and will be
+        ignored; `get_range` can always read parts of the data.)
+
+        """
+        if self.mode == 'r':
+            raise IOError('Store %s is opened read-only' % self.file_name)
+        if isinstance(data, pd.Series):
+            kind, columns = 'series', [data.name]
+        else:
+            kind, columns = 'frame', list(data.columns)
+        freq = data.index.freq
+        with self._write_lock:
+            if key in self:
+                self.remove(key)
+            self._write_part(key, 0, data)
+            self._write_meta(key, {
+                'kind': kind, 'columns': columns, 'parts': 1,
+                'appendable': False,
+                'index_name': data.index.name,
+                'tz': _tz_name(data.index.tz),
+                'freq': None if freq is None else freq.freqstr,
+                'attrs': attrs or {}})
+
+    def get_attrs(self, key):
+        """Return the dict of attributes saved with *key* (empty if
+        there are none). Raise KeyError if *key* is not in the store.
+
+        """
+        return self._meta(key)['attrs']
+
+    def remove(self, key):
+        """Remove *key* from the store."""
+        with self._write_lock:
+            os.remove(self._path(key, 'json'))
+            for f in os.listdir(self.file_name):
+                if f.startswith(key + '.') and f.endswith('.npy'):
+                    os.remove(path.join(self.file_name, f))
+
+    def append(self, key, data):
+        """Append the DataFrame *data* to the data under *key*, which
+        will be created if it does not exist. Data created with `put`
+        cannot be appended to.
+
+        """
+        with self._write_lock:
+            if key in self:
+                meta = self._meta(key)
+                if not meta['appendable']:
+                    raise ValueError(
+                        'Cannot append to data of %s in %s' % (
+                            key, self.file_name))
+            else:
+                meta = {
+                    'kind': 'frame', 'columns': list(data.columns),
+                    'parts': 0, 'appendable': True,
+                    'index_name': data.index.name,
+                    'tz': _tz_name(data.index.tz),
+                    'freq': None, 'attrs': {}}
+            self._write_part(key, meta['parts'], data)
+            meta['parts'] += 1
+            self._write_meta(key, meta)
+
+    def is_appendable(self, key):
+        """Return True if the data under *key* has been created with
+        `append`; `select` will then be able to return it in chunks.
+
+        """
+        return self._meta(key)['appendable']
+
+    def select(self, key, chunksize):
+        """Return an iterator yielding the data saved under *key* in
+        chunks, one for each call to `append`. (*chunksize* is only
+        there for compatibility with HDF5Store and will be ignored.)
+
+        """
+        meta = self._meta(key)
+        return (self._read_part(key, p, meta)
+                for p in range(meta['parts']))
+
+
+backends = {'hdf5': HDF5Store, 'npy': NpyStore}
+
+def get_backend(backend):
+    """Return the storage backend class registered in `backends` with
+    the name *backend*. If *backend* is not a string, it will be
+    returned unchanged, so custom backend classes can be used.
+
+    """
+    if not isinstance(backend, str):
+        return backend
+    try:
+        return backends[backend]
+    except KeyError:
+        raise ValueError(
+            'Unknown storage backend "%s"; available are: %s' % (
+                backend, ', '.join(sorted(backends))))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+
+"""A local stand-in for the public Poloniex API, serving made-up trades.
+
+Use it to test or benchmark HistoricDataAPI without network access:
+
+    with PoloniexStandIn({'BTC_XMR': 60}) as server:
+        hd = HistoricDataAPI(folder, 'BTC/XMR', url=server.url)
+
+"""
+
+from __future__ import division
+
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    # Python 2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+import numpy as np
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        params = dict((k, v[0]) for k, v in
+                      parse_qs(urlparse(self.path).query).items())
+        self.server.standin.requests.append(params)
+        body = json.dumps(self.server.standin.respond(params))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('ascii'))
+
+    def log_message(self, *args):
+        pass
+
+
+class PoloniexStandIn(object):
+    def __init__(self, pairs, first=1483228800, max_trades=50000,
+                 delay=0):
+        """Create a local HTTP server serving the commands
+        'returnTicker' and 'returnTradeHistory' of the public Poloniex
+        API. Start it with `start` or use it as context manager.
+
+        :param pairs: dict with currency pairs (like 'BTC_XMR') as
+            keys and the number of seconds between two trades as values
+        :param first: UNIX timestamp of the first trade of all pairs
+        :param max_trades: maximum number of trades returned by a
+            single request; like Poloniex, only the most recent trades
+            of the requested range are returned.
+        :param delay: seconds to wait before answering a request, to
+            imitate the latency of a real server
+
+        The trade at time t of every pair has the rate `rate(t)` and
+        an amount of 1, and trade IDs are counted from 1.
+
+        """
+        self.pairs = pairs
+        self.first = first
+        self.max_trades = max_trades
+        self.delay = delay
+        # The parameters of all requests received:
+        self.requests = []
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%i/public' % self._server.server_address[1]
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.standin = self
+        thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rate(self, t):
+        """Return the rate of a trade at UNIX timestamp(s) *t*."""
+        return 0.01 + 1e-9 * (np.asarray(t) - self.first)
+
+    def trade_times(self, pair, start, end):
+        """Return the UNIX timestamps of all trades of *pair* from
+        *start* to *end* (both inclusive).
+
+        """
+        spacing = self.pairs[pair]
+        kmin = max(0, -(-(start - self.first) // spacing))
+        kmax = (end - self.first) // spacing
+        return self.first + spacing * np.arange(kmin, kmax + 1)
+
+    def respond(self, params):
+        """Return the (JSON-serializable) answer to a request with
+        query *params*.
+
+        """
+        if self.delay:
+            time.sleep(self.delay)
+        command = params.get('command')
+        if command == 'returnTicker':
+            return dict((pair, {'last': '%.10f' % self.rate(time.time())})
+                        for pair in self.pairs)
+        if command != 'returnTradeHistory':
+            return {'error': 'Invalid command.'}
+        pair = params.get('currencyPair')
+        if pair not in self.pairs:
+            return {'error': 'Invalid currency pair.'}
+        times = self.trade_times(
+            pair, int(params['start']), int(params['end']))
+        # Only the most recent trades, newest first:
+        times = times[::-1][:self.max_trades]
+        ids = (times - self.first) // self.pairs[pair] + 1
+        return [{'globalTradeID': int(i) + 1000000,
+                 'tradeID': int(i),
+                 'date': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)),
+                 'type': 'buy',
+                 'rate': '%.10f' % self.rate(t),
+                 'amount': '1.00000000',
+                 'total': '%.10f' % self.rate(t)}
+                for i, t in zip(ids, times)]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+import unittest
+
+from ccgains import cache
+import numpy as np
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        c = cache.LRUCache(max_entries=2)
+        c.put('a', 1)
+        c.put('b', 2)
+        # use 'a', so 'b' becomes the least recently used entry:
+        self.assertEqual(c.get('a'), 1)
+        c.put('c', 3)
+        self.assertNotIn('b', c)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.get('c'), 3)
+        self.assertDictEqual(
+                {k: v for k, v in c.stats.items() if k != 'nbytes'},
+                {'entries': 2, 'hits': 2, 'misses': 1, 'evictions': 1})
+
+    def test_fifo_eviction(self):
+        c = cache.LRUCache(max_entries=2, policy='fifo')
+        c.put('a', 1)
+        c.put('b', 2)
+        c.get('a')
+        c.put('c', 3)
+        self.assertNotIn('a', c)
+        self.assertIn('b', c)
+
+    def test_max_bytes(self):
+        c = cache.LRUCache(max_bytes=2000)
+        for i in range(5):
+            c.put(i, np.zeros(100))
+        # each array takes 800 bytes:
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.nbytes, 1600)
+        self.assertEqual(c.evictions, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,745 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+from __future__ import division
+
+import unittest
+import os
+import shutil
+import json
+import tempfile
+import time
+
+import requests
+
+from ccgains import historic_data, cache, network
+import pandas as pd
+import numpy as np
+
+from .poloniex_standin import PoloniexStandIn
+from .test_storage import memory_mapped
+
+
+def reference_resample(df, freq, data_col, weight_col):
+    """Resample with pandas alone (the original implementation of
+    `resample_weighted_average`)."""
+    df = df.copy()
+    df['data_times_weight'] = df[data_col] * df[weight_col]
+    g = df.resample(freq)
+    return pd.DataFrame(
+        {data_col: g['data_times_weight'].sum() / g[weight_col].sum(),
+         weight_col: g[weight_col].sum()})
+
+
+class TestResampleWeightedAverage(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(42)
+        times = rand.randint(1483228800, 1483228800 + 5 * 86400, 2000)
+        self.df = pd.DataFrame(
+            {'rate': rand.uniform(100, 200, 2000),
+             'amount': rand.exponential(1, 2000)},
+            index=pd.to_datetime(times, unit='s', utc=True),
+            columns=['rate', 'amount'])
+        self.df.index.name = 'date'
+        self.df.iloc[5, 0] = np.nan
+        # leave a gap of several hours:
+        self.df = self.df[(self.df.index.hour < 3) | (self.df.index.hour > 8)]
+
+    def check(self, df, freq):
+        before = df.copy()
+        result = historic_data.resample_weighted_average(
+            df, freq, 'rate', 'amount', include_weights=True)
+        expected = reference_resample(df, freq, 'rate', 'amount')
+        # The input is not modified:
+        self.assertTrue(df.equals(before))
+        self.assertTrue(result.index.equals(expected.index))
+        self.assertEqual(result.index.freq, expected.index.freq)
+        self.assertEqual(result.index.name, expected.index.name)
+        self.assertTrue(np.allclose(
+            result.values, expected[result.columns].values, equal_nan=True))
+
+    def test_fixed_frequencies(self):
+        for freq in ('H', '15min', 'D', '7H', 'W'):
+            self.check(self.df, freq)
+
+    def test_timezones(self):
+        self.check(self.df.tz_convert(None), 'H')
+        self.check(self.df.tz_convert('Europe/Berlin'), 'D')
+
+    def test_series(self):
+        avgs = historic_data.resample_weighted_average(
+            self.df, 'H', 'rate', 'amount')
+        self.assertIsInstance(avgs, pd.Series)
+        self.assertEqual(len(avgs), 5 * 24)
+
+
+class TestHistoricData(unittest.TestCase):
+
+    def setUp(self):
+        # Make up some historic data:
+        self.rng = pd.date_range(
+                '2017-01-01', periods=48, freq='H', tz='UTC')
+        self.hd = historic_data.HistoricData('EUR/BTC')
+        self.hd.data = pd.Series(
+                data=np.linspace(1000, 2000, num=48), index=self.rng)
+        # some times in random order, not aligned to the intervals:
+        self.dtimes = [
+                pd.Timestamp('2017-01-02 13:45', tz='UTC'),
+                pd.Timestamp('2017-01-01 00:00', tz='UTC'),
+                pd.Timestamp('2017-01-01 05:59:59', tz='UTC'),
+                pd.Timestamp('2017-01-02 23:59', tz='UTC'),
+                pd.Timestamp('2017-01-01 14:30', tz='Europe/Berlin')]
+
+    def test_get_prices_equals_get_price(self):
+        expected = [self.hd.get_price(t) for t in self.dtimes]
+        prices = self.hd.get_prices(self.dtimes)
+        self.assertIsInstance(prices, np.ndarray)
+        self.assertListEqual(list(prices), expected)
+
+    def test_get_prices_unix_timestamps(self):
+        epochs = np.array(
+                [t.value // 10 ** 9 for t in self.dtimes], dtype=np.int64)
+        self.assertListEqual(
+                list(self.hd.get_prices(epochs)),
+                list(self.hd.get_prices(self.dtimes)))
+
+    def test_to_epoch_ns(self):
+        index = pd.to_datetime(self.dtimes, utc=True)
+        expected = [t.value for t in self.dtimes]
+        for dtimes in (index, index.tz_convert('Europe/Berlin'),
+                       index.tz_localize(None), pd.Series(index),
+                       self.dtimes, [str(t) for t in self.dtimes]):
+            self.assertListEqual(
+                list(historic_data._to_epoch_ns(dtimes)), expected)
+        # Float unix timestamps are seconds, too:
+        self.assertListEqual(
+            list(historic_data._to_epoch_ns(
+                np.array([1483228800.0, 1483228800.25, 1483228801.5]))),
+            [1483228800 * 10 ** 9, 1483228800250000000,
+             1483228801500000000])
+        self.assertListEqual(
+            list(self.hd.get_prices(np.array(expected) / 10 ** 9)),
+            list(self.hd.get_prices(self.dtimes)))
+        with self.assertRaises(ValueError):
+            historic_data._to_epoch_ns(np.array([1483228800.0, np.nan]))
+
+    def test_sparse_data(self):
+        dense = self.hd.data.copy()
+        # Leave out a few hours, which will take the last price before:
+        dense[6:20] = np.nan
+        dense = dense.ffill()
+        self.hd.data = self.hd.data.drop(self.hd.data.index[6:20])
+        self.hd.interval = 'H'
+        dtimes = self.dtimes + [pd.Timestamp('2017-01-01 19:59', tz='UTC')]
+        expected = [dense.at[t.floor('H')] for t in dtimes]
+        self.assertListEqual(
+            [self.hd.get_price(t) for t in dtimes], expected)
+        self.assertListEqual(list(self.hd.get_prices(dtimes)), expected)
+        with self.assertRaises(KeyError):
+            self.hd.get_price(pd.Timestamp('2017-01-03', tz='UTC'))
+        # Limit the staleness of prices:
+        self.hd.max_staleness = pd.Timedelta(hours=16)
+        self.hd.get_prices(dtimes)
+        self.hd.max_staleness = '3 hours'
+        self.assertEqual(self.hd.get_price(dtimes[0]), expected[0])
+        with self.assertRaises(ValueError):
+            self.hd.get_price(dtimes[-1])
+        with self.assertRaises(ValueError):
+            self.hd.get_prices(dtimes)
+
+    def test_get_prices_out_of_range(self):
+        with self.assertRaises(KeyError):
+            self.hd.get_prices(
+                    self.dtimes + [pd.Timestamp('2017-01-03', tz='UTC')])
+        with self.assertRaises(KeyError):
+            self.hd.get_prices([pd.Timestamp('2016-12-31', tz='UTC')])
+
+
+class TestHistoricDataCSV(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.csv = os.path.join(self.folder, 'trades.csv')
+        # trades every 20 minutes with a gap of several hours:
+        times = np.r_[
+                np.arange(1483228800, 1483228800 + 6 * 3600, 1200),
+                np.arange(1483228800 + 12 * 3600,
+                          1483228800 + 24 * 3600, 1200)]
+        rates = 1000 + np.arange(len(times), dtype=float)
+        amounts = 0.5 + (np.arange(len(times)) % 3)
+        pd.DataFrame({'t': times, 'r': rates, 'a': amounts}).to_csv(
+                self.csv, header=False, index=False,
+                columns=['t', 'r', 'a'])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_prices_equals_get_price(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        dtimes = pd.date_range(
+                '2017-01-01', '2017-01-01 23:59', freq='17min', tz='UTC')
+        expected = [hd.get_price(t) for t in dtimes]
+        self.assertListEqual(list(hd.get_prices(dtimes)), expected)
+
+    def test_sparse(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        dense = historic_data.HistoricDataCSV(
+                self.csv, 'EUR/BTC', sparse=False)
+        # Six hours without trades are left out:
+        self.assertEqual(len(hd.data), 18)
+        self.assertEqual(len(dense.data), 24)
+        dtimes = pd.date_range(
+                '2017-01-01', '2017-01-01 23:59', freq='7min', tz='UTC')
+        self.assertListEqual(
+            list(hd.get_prices(dtimes)), list(dense.get_prices(dtimes)))
+        self.assertEqual(hd.get_price(dtimes[60]), dense.get_price(dtimes[60]))
+        stale = historic_data.HistoricDataCSV(
+                self.csv, 'EUR/BTC', max_staleness='2H')
+        with self.assertRaises(ValueError):
+            stale.get_price(pd.Timestamp('2017-01-01 09:00', tz='UTC'))
+        # Also in dense data, filled up without trades:
+        stale = historic_data.HistoricDataCSV(
+                self.csv, 'EUR/BTC', sparse=False, max_staleness='2H')
+        with self.assertRaises(ValueError):
+            stale.get_price(pd.Timestamp('2017-01-01 09:00', tz='UTC'))
+        with self.assertRaises(ValueError):
+            stale.get_prices(dtimes)
+        self.assertEqual(stale.get_price(dtimes[60]), hd.get_price(dtimes[60]))
+
+    def test_lazy_window(self):
+        for backend in ('hdf5', 'npy'):
+            hd = historic_data.HistoricDataCSV(
+                    self.csv, 'EUR/BTC', backend=backend, lazy=True)
+            # Nothing has been loaded yet:
+            self.assertEqual(hd.backend.getmtime(hd.file_name), 0)
+            dtime = pd.Timestamp('2017-01-01 14:30', tz='UTC')
+            price = hd.get_price(dtime)
+            self.assertEqual(len(hd.data), 18)
+            # Only a part of the cached data is loaded:
+            window = historic_data.HistoricDataCSV(
+                    self.csv, 'EUR/BTC', backend=backend,
+                    window=('2017-01-01 12:00', '2017-01-01 17:00'))
+            self.assertEqual(len(window.data), 6)
+            self.assertEqual(window.get_price(dtime), price)
+            with self.assertRaises(KeyError):
+                window.get_price(pd.Timestamp('2017-01-01 05:30', tz='UTC'))
+
+    def test_lazy_load_fails(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC', lazy=True)
+        os.remove(self.csv)
+        dtime = pd.Timestamp('2017-01-01 14:30', tz='UTC')
+        # The error is raised on every access, not only the first:
+        for i in range(2):
+            with self.assertRaises(IOError):
+                hd.get_price(dtime)
+        self.assertEqual(hd.data_source(dtime), 'disk')
+
+    def test_resolutions(self):
+        hd = historic_data.HistoricDataCSV(
+                self.csv, 'EUR/BTC', resolutions=('20min', 'D'))
+        self.assertEqual(hd.base_interval, '20min')
+        dtimes = pd.date_range(
+                '2017-01-01', '2017-01-01 23:59', freq='7min', tz='UTC')
+        for resolution in ('20min', 'H', '2H', 'D'):
+            expected = historic_data.HistoricDataCSV(
+                self.csv, 'EUR/BTC', interval=resolution)
+            self.assertTrue(np.allclose(
+                hd.get_prices(dtimes, resolution),
+                expected.get_prices(dtimes)))
+            self.assertAlmostEqual(
+                hd.get_price(dtimes[50], resolution),
+                expected.get_price(dtimes[50]))
+        # The default is interval:
+        self.assertAlmostEqual(
+            hd.get_price(dtimes[50]), hd.get_price(dtimes[50], 'H'))
+        self.assertAlmostEqual(
+            hd.get_price(dtimes[50]), hd.get_price(dtimes[50], '60min'))
+        with self.assertRaises(ValueError):
+            hd.get_price(dtimes[50], '15min')
+
+    def test_chunked_loading(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        # compressed copy of the same csv:
+        csv_gz = os.path.join(self.folder, 'trades_copy.csv.gz')
+        pd.read_csv(self.csv, header=None).to_csv(
+                csv_gz, header=False, index=False, compression='gzip')
+        # first from csv, then from the created HDF5 file:
+        for i in range(2):
+            hdc = historic_data.HistoricDataCSV(
+                    csv_gz, 'EUR/BTC', chunksize=7)
+            self.assertTrue(hdc.data.index.equals(hd.data.index))
+            self.assertEqual(hdc.data.index.freq, hd.data.index.freq)
+            self.assertTrue(np.allclose(hdc.data.values, hd.data.values))
+
+    def test_resampled_cache(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        h5 = os.path.join(self.folder, 'trades.h5')
+        # Remove the raw data; it would be recreated if the csv
+        # needed to be parsed again:
+        with pd.HDFStore(h5) as store:
+            self.assertIn(hd.resampled_key, store)
+            store.remove(hd.dataset)
+        hd2 = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        self.assertTrue(hd2.data.equals(hd.data))
+        self.assertEqual(hd2.data.index.freq, hd.data.index.freq)
+        with pd.HDFStore(h5) as store:
+            self.assertNotIn(hd.dataset, store)
+        # A modified csv will invalidate the cached data:
+        mtime = os.path.getmtime(self.csv)
+        pd.read_csv(self.csv, header=None).to_csv(
+                self.csv, header=False, index=False, float_format='%.3f')
+        os.utime(h5, (mtime + 5, mtime + 5))
+        os.utime(self.csv, (mtime + 6, mtime + 6))
+        hd3 = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        self.assertTrue(hd3.data.equals(hd.data))
+        with pd.HDFStore(h5) as store:
+            self.assertIn(hd.dataset, store)
+
+    def _append_to_csv(self, times):
+        with open(self.csv, 'a') as f:
+            for i, t in enumerate(times):
+                f.write('%i,%f,%f\n' % (t, 2000 + i, 1 + i % 2))
+        mtime = os.path.getmtime(self.csv)
+        os.utime(self.csv, (mtime + 10, mtime + 10))
+
+    def test_incremental_update(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        h5 = os.path.join(self.folder, 'trades.h5')
+        # new trades in the last interval and after a gap:
+        self._append_to_csv([1483314500, 1483315000, 1483326000])
+        # The incomplete last line must be ignored for now:
+        with open(self.csv, 'a') as f:
+            f.write('1483326100,3000')
+        hd2 = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        with pd.HDFStore(h5) as store:
+            # Only the tail was parsed, the trading data is outdated:
+            self.assertNotIn(hd.dataset, store)
+        # Compare to parsing the whole csv:
+        full = os.path.join(self.folder, 'full.csv')
+        with open(self.csv) as f:
+            lines = f.readlines()[:-1]
+        with open(full, 'w') as f:
+            f.writelines(lines)
+        expected = historic_data.HistoricDataCSV(full, 'EUR/BTC')
+        # Only the intervals with trades are kept:
+        self.assertEqual(len(hd2.data), len(hd.data) + 1)
+        self.assertTrue(hd2.data.index.equals(expected.data.index))
+        self.assertEqual(hd2.data.index.freq, expected.data.index.freq)
+        self.assertTrue(np.allclose(hd2.data.values, expected.data.values))
+        # Complete the last line:
+        self._append_to_csv([])
+        with open(self.csv, 'a') as f:
+            f.write(',1\n')
+        hd3 = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        self.assertAlmostEqual(hd3.data.iloc[-1], 2501)
+
+    def test_csv_growing_while_parsed(self):
+        class Growing(historic_data.HistoricDataCSV):
+            def _iter_csv_chunks(self, file_name, chunksize, store):
+                # A trade appended after the csv's end was looked up:
+                with open(file_name, 'a') as f:
+                    f.write('1483326000,3000,1\n')
+                return super(Growing, self)._iter_csv_chunks(
+                    file_name, chunksize, store)
+        Growing(self.csv, 'EUR/BTC', chunksize=7)
+        self._append_to_csv([1483327000])
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        # Compare to parsing the whole csv:
+        full = os.path.join(self.folder, 'full.csv')
+        shutil.copy(self.csv, full)
+        expected = historic_data.HistoricDataCSV(full, 'EUR/BTC')
+        self.assertTrue(hd.data.index.equals(expected.data.index))
+        self.assertTrue(np.allclose(hd.data.values, expected.data.values))
+        self.assertAlmostEqual(hd.data.iloc[-1], 2500)
+
+    def test_modified_csv_is_reparsed(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        h5 = os.path.join(self.folder, 'trades.h5')
+        # Replace the last line:
+        with open(self.csv) as f:
+            lines = f.readlines()
+        with open(self.csv, 'w') as f:
+            f.writelines(lines[:-1] + ['1483314000,500,1\n'])
+        self._append_to_csv([1483315500])
+        hd2 = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        with pd.HDFStore(h5) as store:
+            self.assertIn(hd.dataset, store)
+        self.assertEqual(len(hd2.data), len(hd.data) + 1)
+        self.assertLess(hd2.data.iloc[-2], hd.data.iloc[-1])
+        self.assertAlmostEqual(hd2.data.iloc[-1], 2000)
+
+    def test_npy_backend(self):
+        hd = historic_data.HistoricDataCSV(self.csv, 'EUR/BTC')
+        for i in range(2):
+            hdn = historic_data.HistoricDataCSV(
+                    self.csv, 'EUR/BTC', backend='npy')
+            self.assertTrue(hdn.file_name.endswith('.npyd'))
+            self.assertTrue(hdn.data.equals(hd.data))
+            self.assertEqual(hdn.data.index.freq, hd.data.index.freq)
+        # Loaded from the cache without copying:
+        self.assertTrue(memory_mapped(hdn.data.values))
+
+
+class TestHistoricDataAPI(unittest.TestCase):
+
+    def setUp(self):
+        # Create a cache file, so that no connection to the API
+        # is needed (with the old layout of one key per day):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.folder, 'Poloniex_BTC_XMR_H.h5')
+        self.days = pd.DatetimeIndex(
+                ['2017-01-01', '2017-02-05', '2017-02-06'], tz='UTC')
+        with pd.HDFStore(self.file_name) as store:
+            for i, day in enumerate(self.days):
+                rng = pd.date_range(day, periods=24, freq='H')
+                store.put(
+                        day.strftime('d%Y%m%d'),
+                        pd.Series(0.01 * (i + 1) + np.arange(24) * 1e-4,
+                                  index=rng))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_day_cache(self):
+        day_cache = cache.LRUCache(max_entries=2)
+        hd = historic_data.HistoricDataAPI(
+                self.folder, 'btc/xmr', day_cache=day_cache)
+        dtimes = [day + pd.Timedelta(hours=h)
+                  for day in self.days for h in (1, 5, 17)]
+        prices = [hd.get_price(t) for t in dtimes]
+        # Loading a day from disk also puts the other days of its month
+        # into the cache, so there are only misses for 2 months:
+        self.assertEqual(day_cache.misses, 2)
+        self.assertEqual(day_cache.hits, 7)
+        self.assertEqual(day_cache.evictions, 1)
+        self.assertEqual(len(day_cache), 2)
+        self.assertAlmostEqual(prices[4], 0.02 + 5e-4)
+        # get_prices gives the same results:
+        self.assertListEqual(list(hd.get_prices(dtimes)), prices)
+        # Other resolutions are not available:
+        self.assertEqual(hd.get_price(dtimes[0], 'H'), prices[0])
+        with self.assertRaises(ValueError):
+            hd.get_price(dtimes[0], 'D')
+
+    def test_migrate_day_cache(self):
+        hd = historic_data.HistoricDataAPI(
+                self.folder, 'btc/xmr', day_cache=cache.LRUCache())
+        self.assertListEqual(
+            hd.missing_days(pd.date_range('2017-02-04', '2017-02-07')),
+            [pd.Timestamp('2017-02-04', tz='UTC'),
+             pd.Timestamp('2017-02-07', tz='UTC')])
+        with pd.HDFStore(self.file_name) as store:
+            self.assertListEqual(
+                sorted(store.keys()), ['/m201701', '/m201702'])
+            self.assertEqual(len(store['m201702']), 48)
+        self.assertTrue(os.path.exists(self.file_name + '.index.json'))
+        self.assertAlmostEqual(
+            hd.get_price(pd.Timestamp('2017-02-06 03:10', tz='UTC')),
+            0.03 + 3e-4)
+        # Nothing left to migrate:
+        self.assertEqual(
+            historic_data.migrate_day_cache(self.file_name), 0)
+
+    def test_store_day(self):
+        hd = historic_data.HistoricDataAPI(
+                self.folder, 'btc/xmr', day_cache=cache.LRUCache())
+        day = pd.Timestamp('2017-02-07', tz='UTC')
+        rng = pd.date_range(day, periods=24, freq='H')
+        hd._store_day(day.value // 10 ** 9, pd.Series(0.5, index=rng))
+        # Replace a day:
+        hd._store_day(self.days[1].value // 10 ** 9,
+                      pd.Series(0.7, index=rng - pd.Timedelta(days=2)))
+        self.assertListEqual(hd.missing_days(rng), [])
+        self.assertEqual(hd.get_price(day), 0.5)
+        self.assertEqual(hd.get_price(self.days[1]), 0.7)
+        self.assertAlmostEqual(hd.get_price(self.days[2]), 0.03)
+        with pd.HDFStore(self.file_name) as store:
+            self.assertEqual(len(store['m201702']), 72)
+
+    def test_dense_max_staleness(self):
+        with self.assertRaises(ValueError):
+            historic_data.HistoricDataAPI(
+                self.folder, 'btc/xmr', sparse=False, max_staleness='1D')
+
+    def test_manifest(self):
+        # Fail on any request to the API:
+        hd = historic_data.HistoricDataAPI(
+                self.folder, 'btc/xmr', day_cache=cache.LRUCache(),
+                transport=network.ReplayTransport(self.folder))
+        # Days migrated from the old layout are cached:
+        self.assertEqual(hd.cache_status(self.days[1]), 'cached')
+        self.assertEqual(
+            hd.cache_status(pd.Timestamp('2017-02-07', tz='UTC')), 'missing')
+        # A day without trades is not requested again:
+        empty = pd.Timestamp('2017-02-08', tz='UTC')
+        hd._store_day(empty.value // 10 ** 9, pd.Series(
+            [], index=pd.DatetimeIndex([], tz='UTC'), dtype=float))
+        self.assertEqual(hd.cache_status(empty), 'empty')
+        self.assertListEqual(hd.missing_days([empty]), [])
+        with self.assertRaises(KeyError):
+            hd.get_price(empty + pd.Timedelta(hours=3))
+        # Data fetched before the end of the day might be incomplete:
+        today = pd.Timestamp.now(tz='UTC').floor('D')
+        hd._store_day(today.value // 10 ** 9, pd.Series(
+            0.5, index=pd.date_range(today, periods=1, freq='H')))
+        self.assertEqual(hd.cache_status(today), 'missing')
+        # A day not matching its checksum is fetched again:
+        day = pd.Timestamp('2017-02-09', tz='UTC')
+        hd._store_day(day.value // 10 ** 9, pd.Series(
+            0.5, index=pd.date_range(day, periods=24, freq='H')))
+        manifest = historic_data.read_month_index(self.file_name)
+        self.assertEqual(manifest[hd._day_key(day)]['rows'], 24)
+        manifest[hd._day_key(day)]['checksum'] = 'corrupted'
+        historic_data.write_month_index(self.file_name, manifest)
+        historic_data.HistoricDataAPI._indexes.clear()
+        self.assertEqual(hd.data_source(self.days[2]), 'disk')
+        self.assertEqual(hd.get_price(self.days[1]), 0.02)
+        self.assertEqual(hd.data_source(self.days[1]), 'memory')
+        self.assertEqual(hd.data_source(empty), None)
+        self.assertEqual(hd.data_source(
+            pd.Timestamp('2017-02-07', tz='UTC')), 'network')
+        with self.assertRaises(requests.ConnectionError):
+            hd.get_price(day)
+
+    def test_manifest_shared_by_processes(self):
+        hd = historic_data.HistoricDataAPI(
+                self.folder, 'btc/xmr', day_cache=cache.LRUCache(),
+                transport=network.ReplayTransport(self.folder))
+        self.assertEqual(hd.cache_status(self.days[1]), 'cached')
+        # Another process sharing the cache records a day:
+        other = pd.Timestamp('2017-03-01', tz='UTC')
+        historic_data.update_month_index(
+            self.file_name, {hd._day_key(other): {'rows': 0}})
+        day = pd.Timestamp('2017-02-09', tz='UTC')
+        hd._store_day(day.value // 10 ** 9, pd.Series(
+            0.5, index=pd.date_range(day, periods=24, freq='H')))
+        # Its day was not overwritten, and is known now:
+        manifest = historic_data.read_month_index(self.file_name)
+        self.assertIn(hd._day_key(other), manifest)
+        self.assertIn(hd._day_key(day), manifest)
+        self.assertEqual(hd.cache_status(other), 'empty')
+        self.assertListEqual(
+            [f for f in os.listdir(self.folder) if f.endswith('.tmp')], [])
+
+
+class TestDecodeTrades(unittest.TestCase):
+
+    def test_decode(self):
+        standin = PoloniexStandIn({'BTC_XMR': 7})
+        text = json.dumps(standin.respond({
+            'command': 'returnTradeHistory', 'currencyPair': 'BTC_XMR',
+            'start': 1483228800, 'end': 1483315200}))
+        expected = pd.read_json(text, convert_dates=['date'])
+        # With nested objects, the response must be decoded the slow
+        # way:
+        nested = json.dumps([dict(t, fee={'btc': 0}) for t in
+                             json.loads(text)], indent=1)
+        for t in (text, nested):
+            trades = historic_data.decode_trades(t)
+            self.assertTrue(np.array_equal(
+                trades['date'], expected['date'].values))
+            self.assertTrue(np.array_equal(
+                trades['tradeID'], expected['tradeID'].values))
+            self.assertTrue(np.allclose(trades['rate'], expected['rate']))
+            self.assertTrue(np.allclose(trades['amount'], 1))
+        self.assertEqual(len(historic_data.decode_trades('[]')['date']), 0)
+        with self.assertRaises(ValueError):
+            historic_data.decode_trades('{"error": "Invalid command."}')
+
+
+class TickerSession(object):
+    """Stand-in for a requests.Session, serving a Poloniex ticker,
+    or failing if *ticker* is None. Set *status_code* to serve server
+    errors instead."""
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.calls = 0
+        self.status_code = 200
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        if self.ticker is None:
+            raise requests.ConnectionError()
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = json.dumps(self.ticker).encode('utf-8')
+        return response
+
+
+class TestTickerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.ticker_file = os.path.join(self.folder, 'Poloniex_ticker.json')
+        historic_data.HistoricDataAPI._tickers.clear()
+
+    def tearDown(self):
+        historic_data.HistoricDataAPI._tickers.clear()
+        shutil.rmtree(self.folder)
+
+    def make_api(self, unit, session, **kwargs):
+        return historic_data.HistoricDataAPI(
+            self.folder, unit, session=session, retries=0,
+            rate_limiter=network.TokenBucket(1000), **kwargs)
+
+    def test_ticker_is_cached(self):
+        session = TickerSession({'BTC_XMR': {}, 'BTC_ETH': {}})
+        hd = self.make_api('btc/xmr', session)
+        self.assertEqual(hd.currency_pair, 'BTC_XMR')
+        hd = self.make_api('eth/btc', session)
+        self.assertEqual(hd.currency_pair, 'BTC_ETH')
+        self.assertEqual(session.calls, 1)
+        self.assertTrue(os.path.exists(self.ticker_file))
+        # A new process (with empty memory) will load it from disk:
+        historic_data.HistoricDataAPI._tickers.clear()
+        offline = TickerSession(None)
+        hd = self.make_api('btc/eth', offline)
+        self.assertEqual(offline.calls, 0)
+        with self.assertRaises(ValueError):
+            self.make_api('btc/ltc', offline)
+
+    def test_ticker_ttl(self):
+        with open(self.ticker_file, 'w') as f:
+            json.dump({'time': time.time() - 100,
+                       'ticker': {'BTC_XMR': {}}}, f)
+        session = TickerSession({'BTC_XMR': {}, 'BTC_ETH': {}})
+        self.make_api('btc/xmr', session, ticker_ttl=1000)
+        self.assertEqual(session.calls, 0)
+        self.make_api('btc/eth', session, ticker_ttl=10)
+        self.assertEqual(session.calls, 1)
+        with open(self.ticker_file) as f:
+            self.assertIn('BTC_ETH', json.load(f)['ticker'])
+
+    def test_ticker_without_time(self):
+        with open(self.ticker_file, 'w') as f:
+            json.dump({'ticker': {'BTC_XMR': {}}}, f)
+        session = TickerSession({'BTC_XMR': {}})
+        hd = self.make_api('btc/xmr', session)
+        # The file was discarded and the ticker fetched again:
+        self.assertEqual(session.calls, 1)
+        with open(self.ticker_file) as f:
+            self.assertIn('time', json.load(f))
+
+    def test_server_error(self):
+        session = TickerSession({'BTC_XMR': {}})
+        hd = self.make_api('btc/xmr', session)
+        # A server error remaining after all retries is raised like a
+        # failed connection:
+        session.status_code = 503
+        with self.assertRaises(requests.ConnectionError):
+            hd.get_price(pd.Timestamp('2017-01-02 12:00', tz='UTC'))
+        self.assertEqual(session.calls, 2)
+
+    def test_offline_with_outdated_ticker(self):
+        with open(self.ticker_file, 'w') as f:
+            json.dump({'time': 0, 'ticker': {'BTC_XMR': {}}}, f)
+        offline = TickerSession(None)
+        hd = self.make_api('xmr/btc', offline)
+        self.assertEqual(offline.calls, 1)
+        self.assertEqual(hd.currency_pair, 'BTC_XMR')
+        # Without any ticker, we can't go on:
+        historic_data.HistoricDataAPI._tickers.clear()
+        os.remove(self.ticker_file)
+        with self.assertRaises(requests.ConnectionError):
+            self.make_api('xmr/btc', offline)
+
+
+class TestStandIn(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = PoloniexStandIn(
+            {'BTC_XMR': 120, 'BTC_ETH': 10}, max_trades=1000).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def make_api(self, unit, **kwargs):
+        api = historic_data.HistoricDataAPI(
+            self.folder, unit, url=self.server.url,
+            rate_limiter=network.TokenBucket(1000),
+            day_cache=cache.LRUCache(), **kwargs)
+        api.max_trades_per_query = self.server.max_trades
+        return api
+
+    def expected(self, pair, dtimes, spacing):
+        # The hourly averages of the made-up trades (all with the same
+        # amount) are the rates at the middle of each hour:
+        hours = dtimes.floor('H').asi8 // 10 ** 9
+        return self.server.rate(hours + (3600 - spacing) / 2)
+
+    def test_fetch(self):
+        hd = self.make_api('xmr/btc')
+        # The pair was flipped:
+        self.assertEqual(hd.currency_pair, 'BTC_XMR')
+        dtimes = pd.date_range('2017-01-02 00:30', periods=24, freq='H',
+                               tz='UTC')
+        self.assertTrue(np.allclose(
+            hd.get_prices(dtimes), self.expected('BTC_XMR', dtimes, 120)))
+        self.assertEqual(len(self.server.requests), 2)
+        # Now it is cached:
+        hd = self.make_api('btc/xmr')
+        hd.get_price(dtimes[5])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_deleted_cache(self):
+        hd = self.make_api('btc/xmr')
+        dtime = pd.Timestamp('2017-01-02 05:30', tz='UTC')
+        price = hd.get_price(dtime)
+        # Delete the cache, but not its manifest:
+        os.remove(hd.file_name)
+        historic_data.HistoricDataAPI._indexes.clear()
+        hd = self.make_api('btc/xmr')
+        self.assertEqual(hd.cache_status(dtime), 'cached')
+        self.assertEqual(hd.get_price(dtime), price)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertTrue(os.path.exists(hd.file_name))
+
+    def test_trade_limit(self):
+        # 8640 trades per day, 1000 per request:
+        hd = self.make_api('btc/eth')
+        dtimes = pd.date_range('2017-01-02 00:30', periods=24, freq='H',
+                               tz='UTC')
+        self.assertTrue(np.allclose(
+            hd.get_prices(dtimes), self.expected('BTC_ETH', dtimes, 10)))
+        # One request for the ticker, then the day was split in four
+        # rounds of 1, 2, 4 and 8 concurrent requests:
+        self.assertEqual(len(self.server.requests), 16)
+
+    def test_fetch_trades_adaptive(self):
+        hd = self.make_api('btc/eth')
+        start = pd.Timestamp('2017-01-02', tz='UTC').value // 10 ** 9
+        trades = hd._fetch_trades_adaptive(start, start + 86399)
+        self.assertEqual(len(trades), 8640)
+        self.assertTrue(trades['tradeID'].is_unique)
+        self.assertTrue(trades.index.is_monotonic_increasing)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+import unittest
+import threading
+import shutil
+import tempfile
+import time
+
+import requests
+import pandas as pd
+
+from ccgains import network, historic_data, cache
+
+from .poloniex_standin import PoloniexStandIn
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate_shared_by_threads(self):
+        bucket = network.TokenBucket(rate=100, capacity=1)
+        def work():
+            for i in range(5):
+                bucket.acquire()
+        threads = [threading.Thread(target=work) for i in range(4)]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # The first token is available immediately, the other 19
+        # must be spaced by 10 ms:
+        self.assertGreaterEqual(time.time() - t0, 0.18)
+        self.assertEqual(bucket.calls, 20)
+
+    def test_registry(self):
+        b1 = network.get_rate_limiter('http://example.com/api', 5)
+        b2 = network.get_rate_limiter('http://example.com/api', 10)
+        self.assertIs(b1, b2)
+        self.assertEqual(b2.rate, 5)
+
+
+class FlakySession(object):
+    """Stand-in for a requests.Session, failing the first requests."""
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        response = requests.Response()
+        response.url = url
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            response.status_code = failure
+        else:
+            response.status_code = 200
+        return response
+
+
+class TestApiGet(unittest.TestCase):
+
+    def test_retry(self):
+        session = FlakySession([requests.ConnectionError(), 503])
+        bucket = network.TokenBucket(rate=1000)
+        response = network.api_get(
+            'http://example.com/api', session=session,
+            rate_limiter=bucket, backoff_factor=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.calls, 3)
+        # Every attempt was rate limited:
+        self.assertEqual(bucket.calls, 3)
+
+    def test_give_up(self):
+        session = FlakySession([requests.Timeout()] * 3)
+        with self.assertRaises(requests.Timeout):
+            network.api_get('http://example.com/api', session=session,
+                            retries=2, backoff_factor=0)
+        self.assertEqual(session.calls, 3)
+        session = FlakySession([502] * 3)
+        with self.assertRaises(requests.HTTPError):
+            network.api_get('http://example.com/api', session=session,
+                            retries=2, backoff_factor=0)
+
+    def test_backoff(self):
+        session = FlakySession([requests.ConnectionError()] * 2)
+        t0 = time.time()
+        network.api_get('http://example.com/api', session=session,
+                        backoff_factor=0.05)
+        # waited 0.05 s and 0.1 s:
+        self.assertGreaterEqual(time.time() - t0, 0.15)
+
+    def test_session_registry(self):
+        s1 = network.get_session('http://example.com/api')
+        self.assertIs(network.get_session('http://example.com/api'), s1)
+        self.assertIsInstance(s1, requests.Session)
+
+
+class TestRecordReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def make_api(self, url, transport):
+        cache_folder = tempfile.mkdtemp(dir=self.folder)
+        return historic_data.HistoricDataAPI(
+            cache_folder, 'btc/xmr', url=url, transport=transport,
+            rate_limiter=network.TokenBucket(1000),
+            day_cache=cache.LRUCache())
+
+    def test_record_replay(self):
+        fixtures = self.folder + '/fixtures'
+        dtime = pd.Timestamp('2017-01-03 13:10', tz='UTC')
+        with PoloniexStandIn({'BTC_XMR': 300}) as server:
+            url = server.url
+            hd = self.make_api(url, network.RecordingTransport(
+                fixtures, network.HTTPTransport(retries=0)))
+            price = hd.get_price(dtime)
+        replay = network.ReplayTransport(fixtures)
+        historic_data.HistoricDataAPI._tickers.clear()
+        hd = self.make_api(url, replay)
+        self.assertEqual(hd.get_price(dtime), price)
+        self.assertEqual(replay.calls, 2)
+        # This was not recorded:
+        with self.assertRaises(requests.ConnectionError):
+            hd.get_price(pd.Timestamp('2017-01-04 13:10', tz='UTC'))
+
+
+if __name__ == '__main__':
+    unittest.main()
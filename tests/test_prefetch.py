@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+from __future__ import division
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+from ccgains import historic_data, relations, prefetch, trades, cache
+import pandas as pd
+import numpy as np
+
+
+class MadeUpAPI(historic_data.HistoricDataAPI):
+    """HistoricDataAPI serving made-up trades (one every ten minutes)
+    instead of making requests to Poloniex. There are no trades on the
+    UTC days (numbers since the epoch) in `quiet_days`.
+
+    """
+    quiet_days = ()
+
+    def _fetch_trades(self, start, end):
+        self.requests.append((start, end))
+        self.threads.add(threading.current_thread().name)
+        times = np.arange(-(-start // 600) * 600, end + 1, 600)
+        times = times[~np.isin(times // 86400, self.quiet_days)]
+        # Like Poloniex, only return the most recent trades:
+        times = times[-self.max_trades_per_query:]
+        return pd.DataFrame(
+            {'tradeID': times // 600, 'rate': 1e-6 * times,
+             'amount': np.ones(len(times))},
+            index=pd.to_datetime(times, unit='s'))
+
+
+class BusyAPI(MadeUpAPI):
+    """MadeUpAPI with three trades in every second."""
+
+    def _fetch_trades(self, start, end):
+        self.requests.append((start, end))
+        ids = np.arange(start * 3, (end + 1) * 3)[-self.max_trades_per_query:]
+        return pd.DataFrame(
+            {'tradeID': ids, 'rate': 1e-6 * ids,
+             'amount': np.ones(len(ids))},
+            index=pd.to_datetime(ids // 3, unit='s'))
+
+
+class TestPrefetchPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # create an empty cache file, so that no connection to the API
+        # is needed to find out the currency pair:
+        pd.HDFStore(
+            os.path.join(self.folder, 'Poloniex_BTC_XMR_H.h5')).close()
+        self.api = MadeUpAPI(
+                self.folder, 'btc/xmr', day_cache=cache.LRUCache())
+        self.api.requests = []
+        self.api.threads = set()
+        self.api.max_days_per_query = 3
+        h1 = historic_data.HistoricData('EUR/BTC')
+        h1.data = pd.Series(
+            np.linspace(1000, 2000, num=10),
+            index=pd.date_range('2017-01-01', periods=10, freq='D', tz='UTC'))
+        self.rel = relations.CurrencyRelation(h1, self.api)
+        self.th = trades.TradeHistory()
+        for day in (1, 2, 3, 4, 7):
+            self.th.tlist.append(trades.Trade(
+                'trade', '2017-01-%02i 12:00+00:00' % day,
+                'EUR', 100, 'XMR', 5))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_merge_days(self):
+        days = [pd.Timestamp('2017-01-%02i' % d, tz='UTC')
+                for d in (1, 2, 3, 4, 5, 7, 9, 10)]
+        self.assertListEqual(
+            prefetch.merge_days(days, 4),
+            [(days[0], days[3]), (days[4], days[4]),
+             (days[5], days[5]), (days[6], days[7])])
+
+    def test_plan_and_execute(self):
+        planner = prefetch.PrefetchPlanner(self.rel)
+        plan = planner.plan(self.th, 'EUR')
+        self.assertListEqual(list(plan), [self.api.file_name])
+        day = lambda d: pd.Timestamp('2017-01-%02i' % d, tz='UTC')
+        self.assertListEqual(
+            plan[self.api.file_name][1],
+            [(day(1), day(3)), (day(4), day(4)), (day(7), day(7))])
+        planner.execute(plan)
+        self.assertEqual(len(self.api.requests), 3)
+        self.assertDictEqual(planner.plan(self.th, 'EUR'), {})
+        # Everything is cached now:
+        for t in self.th.tlist:
+            self.rel.get_rate(t.dtime, 'XMR', 'EUR')
+        self.assertEqual(len(self.api.requests), 3)
+        self.assertAlmostEqual(
+            self.api.get_price(pd.Timestamp('2017-01-02 05:30', tz='UTC')),
+            1e-6 * (pd.Timestamp('2017-01-02 05:25', tz='UTC').value
+                    // 10 ** 9))
+
+    def test_fetch_range_trade_limit(self):
+        # There are 144 trades per day:
+        self.api.max_trades_per_query = 200
+        self.api.fetch_range(
+            pd.Timestamp('2017-01-01', tz='UTC'),
+            pd.Timestamp('2017-01-03', tz='UTC'))
+        # The first request returned the last 200 trades, the rest of
+        # the range (up to the oldest of them) was split in two:
+        oldest = 3 * 86400 - 200 * 600
+        self.assertListEqual(
+            sorted(s - 1483228800 for s, e in self.api.requests),
+            [0, 0, oldest // 2 + 1])
+        self.assertListEqual(
+            self.api.missing_days(
+                pd.date_range('2017-01-01', periods=4, freq='D')),
+            [pd.Timestamp('2017-01-04', tz='UTC')])
+        dtimes = pd.date_range('2017-01-01', periods=72, freq='H', tz='UTC')
+        self.assertTrue(np.allclose(
+            self.api.get_prices(dtimes),
+            1e-6 * (dtimes.asi8 // 10 ** 9 + 1500)))
+        self.assertEqual(len(self.api.requests), 3)
+
+    def test_trade_limit_reached_exactly(self):
+        # All 144 trades of the day, the oldest at the start of the range:
+        self.api.max_trades_per_query = 144
+        start = pd.Timestamp('2017-01-02', tz='UTC').value // 10 ** 9
+        trades = self.api._fetch_trades_adaptive(start, start + 86399)
+        self.assertEqual(len(trades), 144)
+        # The first second was requested again, to be sure:
+        self.assertListEqual(
+            self.api.requests, [(start, start + 86399), (start, start)])
+
+    def test_first_second_truncated(self):
+        api = BusyAPI(self.folder, 'btc/xmr', day_cache=cache.LRUCache())
+        api.requests = []
+        api.max_trades_per_query = 10
+        start = pd.Timestamp('2017-01-02', tz='UTC').value // 10 ** 9
+        trades = api._fetch_trades_adaptive(start, start + 9)
+        self.assertListEqual(
+            sorted(trades['tradeID']), list(range(start * 3, start * 3 + 30)))
+        # (start, start + 3) still missed the oldest trades of its first
+        # second, which were then requested on their own:
+        self.assertIn((start, start), api.requests)
+        # A single second with too many trades can't be fetched:
+        api.max_trades_per_query = 3
+        with self.assertRaises(Exception):
+            api._fetch_trades_adaptive(start, start + 9)
+
+    def test_fetch_range_like_lazy(self):
+        # A dense source, without trades on 2017-01-02:
+        quiet = pd.Timestamp('2017-01-02', tz='UTC')
+        lazy_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lazy_folder)
+        apis = []
+        for folder in (self.folder, lazy_folder):
+            pd.HDFStore(
+                os.path.join(folder, 'Poloniex_BTC_XMR_H.h5')).close()
+            api = MadeUpAPI(folder, 'btc/xmr', day_cache=cache.LRUCache(),
+                            sparse=False)
+            api.requests = []
+            api.threads = set()
+            api.quiet_days = [quiet.value // (86400 * 10 ** 9)]
+            apis.append(api)
+        prefetched, lazy = apis
+        prefetched.fetch_range(quiet - pd.Timedelta('1D'),
+                               quiet + pd.Timedelta('1D'))
+        self.assertEqual(len(prefetched.requests), 1)
+        for api in apis:
+            # No prices are carried over into the quiet day:
+            with self.assertRaises(KeyError):
+                api.get_price(quiet + pd.Timedelta('12H'))
+            self.assertEqual(api.cache_status(quiet), 'empty')
+        # The prices on the days around it are the same, too:
+        dtimes = pd.date_range(quiet - pd.Timedelta('1D'), periods=12,
+                               freq='2H', tz='UTC')
+        dtimes = dtimes.append(dtimes + pd.Timedelta('2D'))
+        self.assertTrue(np.array_equal(
+            prefetched.get_prices(dtimes), lazy.get_prices(dtimes)))
+
+    def test_background_prefetcher(self):
+        rates = []
+        with prefetch.BackgroundPrefetcher(
+                self.rel, self.th, 'EUR', lookahead=2) as prefetcher:
+            for trade in prefetcher:
+                rates.append(self.rel.get_rate(trade.dtime, 'XMR', 'EUR'))
+        self.assertIsNone(prefetcher.error)
+        # All data was fetched in the background, each day only once:
+        self.assertLessEqual(len(self.api.requests), 5)
+        self.assertNotIn(threading.current_thread().name, self.api.threads)
+        self.assertGreaterEqual(prefetcher.stalls, 1)
+        self.assertGreater(prefetcher.stall_time, 0)
+        self.assertEqual(len(rates), 5)
+        self.assertDictEqual(
+            prefetch.PrefetchPlanner(self.rel).plan(self.th, 'EUR'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,7 +28,10 @@ from __future__ import division
 
 import unittest
 
-from ccgains import relations
+import numpy as np
+import pandas as pd
+
+from ccgains import relations, historic_data
 
 class TestCurrencyRelation(unittest.TestCase):
 
@@ -211,6 +214,218 @@ class TestCurrencyRelation(unittest.TestCase):
                 self.rel.pairs[direct_pair[::-1]],
                 (1, [('A', 'D', True)]))
 
+    def test_routes_on_demand(self):
+        class Dummy(object):
+            def __init__(self, cfrom, cto):
+                self.cfrom, self.cto = cfrom, cto
+        rel = relations.CurrencyRelation(
+            Dummy('A', 'B'), Dummy('C', 'B'), Dummy('C', 'D'),
+            Dummy('X', 'Y'))
+        # No routes are searched before they are needed:
+        self.assertEqual(len(rel.pairs), 0)
+        self.assertTupleEqual(
+            rel.pairs[('A', 'D')],
+            (3, [('A', 'B', False), ('C', 'B', True), ('C', 'D', False)]))
+        self.assertTupleEqual(rel.pairs[('B', 'C')], (1, [('C', 'B', True)]))
+        self.assertEqual(len(rel.pairs), 4)
+        with self.assertRaises(KeyError):
+            rel.pairs[('A', 'X')]
+        # Only routes getting shorter are replaced:
+        rel.add_historic_data(Dummy('D', 'A'))
+        self.assertTupleEqual(rel.pairs[('A', 'D')], (1, [('D', 'A', True)]))
+        self.assertTupleEqual(rel.pairs[('D', 'A')], (1, [('D', 'A', False)]))
+        self.assertTupleEqual(rel.pairs[('B', 'C')], (1, [('C', 'B', True)]))
+        rel.add_historic_data(Dummy('Y', 'D'))
+        self.assertTupleEqual(
+            rel.pairs[('A', 'X')],
+            (3, [('D', 'A', True), ('Y', 'D', True), ('X', 'Y', True)]))
+
+    def test_many_pairs(self):
+        class Dummy(object):
+            def __init__(self, cfrom, cto):
+                self.cfrom, self.cto = cfrom, cto
+        for i in range(5000):
+            self.rel.add_historic_data(Dummy('C%i' % i, 'C%i' % (i + 1)))
+        self.assertEqual(len(self.rel.pairs), 0)
+        self.assertEqual(self.rel.pairs[('C5000', 'C0')][0], 5000)
+
+    def make_relation(self):
+        h1 = historic_data.HistoricData('EUR/BTC')
+        h1.data = pd.Series(
+            np.linspace(1000, 2000, num=48),
+            index=pd.date_range('2017-01-01', periods=48, freq='H', tz='UTC'))
+        h2 = historic_data.HistoricData('BTC/XMR')
+        h2.interval = '15min'
+        h2.data = pd.Series(
+            np.linspace(0.01, 0.02, num=192),
+            index=pd.date_range('2017-01-01', periods=192, freq='15min',
+                                tz='UTC'))
+        dtimes = pd.date_range('2017-01-01 10:00', periods=300, freq='3min',
+                               tz='UTC')
+        return relations.CurrencyRelation(h1, h2), h1, h2, dtimes
+
+    def test_rate_memo(self):
+        rel, h1, h2, dtimes = self.make_relation()
+        rel.materialize_after = None
+        rates = [rel.get_rate(t, 'XMR', 'EUR') for t in dtimes]
+        self.assertListEqual(
+            rates, [h1.get_price(t) * h2.get_price(t) for t in dtimes])
+        # Only calculated once for every 15 minutes:
+        self.assertEqual(rel.rate_memo.misses, 60)
+        self.assertEqual(rel.rate_memo.hits, 240)
+        # New data invalidates the memo:
+        h1.data = h1.data * 2
+        rel.add_historic_data(h1)
+        self.assertEqual(rel.get_rate(dtimes[0], 'XMR', 'EUR'), 2 * rates[0])
+        # Prices that might become too stale are not memoized:
+        h2.max_staleness = '1H'
+        rel.add_historic_data(h2)
+        rel.get_rate(dtimes[0], 'XMR', 'EUR')
+        self.assertEqual(len(rel.rate_memo), 0)
+
+    def test_get_rates(self):
+        rel, h1, h2, dtimes = self.make_relation()
+        # In any order, through reciprocal hops with different intervals:
+        shuffled = dtimes[np.random.permutation(len(dtimes))]
+        self.assertTrue(np.allclose(
+            rel.get_rates(shuffled, 'EUR', 'XMR'),
+            [1 / rel.get_rate(t, 'XMR', 'EUR') for t in shuffled]))
+        self.assertTrue(np.allclose(
+            rel.get_rates(shuffled.asi8 // 10 ** 9, 'XMR', 'EUR'),
+            [rel.get_rate(t, 'XMR', 'EUR') for t in shuffled]))
+
+    def test_materialize(self):
+        rel, h1, h2, dtimes = self.make_relation()
+        expected = [h1.get_price(t) * h2.get_price(t) for t in dtimes]
+        self.assertEqual(rel.materialize([('btc', 'eur'), ('xmr', 'eur')],
+                                         dtimes[0], dtimes[-1]), 2)
+        self.assertEqual(len(rel.cross_rates), 2)
+        rel.rate_memo.clear()
+        self.assertTrue(np.allclose(
+            [rel.get_rate(t, 'XMR', 'EUR') for t in dtimes], expected))
+        self.assertEqual(len(rel.rate_memo), 0)
+        self.assertTrue(np.allclose(
+            1 / rel.get_rates(dtimes, 'EUR', 'XMR'), expected))
+        # Hot pairs are materialized automatically:
+        rel, h1, h2, dtimes = self.make_relation()
+        rel.materialize_after = 10
+        dtimes = pd.date_range('2017-01-02 22:00', periods=40, freq='3min',
+                               tz='UTC')
+        rates = [rel.get_rate(t, 'EUR', 'XMR') for t in dtimes]
+        self.assertEqual(len(rel.cross_rates), 1)
+        self.assertTrue(np.allclose(
+            rates, [1 / (h1.get_price(t) * h2.get_price(t)) for t in dtimes]))
+        # (only the first 9 rates were calculated, in two intervals:)
+        self.assertEqual(rel.rate_memo.misses, 2)
+        # New data invalidates the materialized rates:
+        rel.add_historic_data(h1)
+        self.assertEqual(len(rel.cross_rates), 0)
+
+    def test_materialize_partial_coverage(self):
+        class Counting(historic_data.HistoricData):
+            requests = 0
+            def prepare_request(self, dtime, resolution=None):
+                self.requests += 1
+                return super(Counting, self).prepare_request(
+                    dtime, resolution)
+        rel, h1, h2, dtimes = self.make_relation()
+        # Sparse data, without trades in every third interval, until
+        # 12:00 on the first day:
+        h3 = Counting('BTC/XMR')
+        h3.interval = '15min'
+        h3.data = h2.data[:48][np.arange(48) % 3 != 1]
+        rel.add_historic_data(h3)
+        day = pd.Timestamp('2017-01-01', tz='UTC')
+        self.assertEqual(rel.materialize([('XMR', 'EUR')], day, day), 1)
+        self.assertEqual(h3.requests, 1)
+        times, rates = rel.cross_rates.get(
+            ('XMR', 'EUR', day.value // relations._DAY))
+        covered = times < pd.Timestamp('2017-01-01 12:00', tz='UTC').value
+        self.assertTrue(np.isnan(rates[~covered]).all())
+        self.assertTrue(np.allclose(rates[covered], [
+            h1.get_price(t) * h3.get_price(t)
+            for t in pd.DatetimeIndex(times[covered], tz='UTC')]))
+        # Not covered prices are still requested like before:
+        with self.assertRaises(KeyError):
+            rel.get_rate(day + pd.Timedelta(hours=13), 'XMR', 'EUR')
+
+    def test_route_choice(self):
+        class Remote(historic_data.HistoricData):
+            def data_source(self, dtime):
+                return 'network'
+        rel, h1, h2, dtimes = self.make_relation()
+        rel.source_costs = {'memory': 0, 'disk': 1, 'network': 50}
+        h3 = historic_data.HistoricData('EUR/USD')
+        h4 = Remote('USD/XMR')
+        for hdata, price in ((h3, 0.9), (h4, 20)):
+            hdata.data = pd.Series(
+                price, index=pd.date_range('2017-01-01', periods=48,
+                                           freq='H', tz='UTC'))
+            rel.add_historic_data(hdata)
+        via_btc = [('BTC', 'EUR', True), ('XMR', 'BTC', True)]
+        via_usd = [('USD', 'EUR', True), ('XMR', 'USD', True)]
+        rel.pairs[('EUR', 'XMR')] = (2, via_usd)
+        routes = rel.explain_route(dtimes[0], 'eur', 'xmr')
+        self.assertListEqual(
+            [(r['recipe'], r['sources'], r['cost'], r['chosen'])
+             for r in routes],
+            [(via_btc, ['memory', 'memory'], 2, True),
+             (via_usd, ['memory', 'network'], 52, False)])
+        self.assertAlmostEqual(
+            rel.get_rate(dtimes[0], 'EUR', 'XMR'),
+            1 / (h1.get_price(dtimes[0]) * h2.get_price(dtimes[0])))
+        self.assertListEqual(
+            rel.route_choices[('EUR', 'XMR', dtimes[0].value // 86400e9)],
+            via_btc)
+        # Prices not available are avoided, too:
+        h2.data = h2.data[:4]
+        rel.add_historic_data(h2)
+        self.assertEqual(rel.get_rate(dtimes[0], 'XMR', 'EUR'), 18)
+        self.assertTrue(np.allclose(
+            rel.get_rates(dtimes[:3], 'XMR', 'EUR'), 18))
+        # Always use the routes in rel.pairs:
+        rel.source_costs = None
+        rel.pairs[('XMR', 'EUR')] = (2, relations._reverse(via_btc))
+        with self.assertRaises(KeyError):
+            rel.get_rate(dtimes[0], 'XMR', 'EUR')
+
+    def test_route_partially_covered(self):
+        class Remote(historic_data.HistoricData):
+            def data_source(self, dtime):
+                return 'network'
+        rel = relations.CurrencyRelation()
+        # A direct pair covering the whole day, and a route in memory
+        # only covering the first half of it:
+        for hdata, price, hours in ((Remote('EUR/XMR'), 5, 24),
+                                    (historic_data.HistoricData('EUR/BTC'),
+                                     100, 12),
+                                    (historic_data.HistoricData('BTC/XMR'),
+                                     0.1, 12)):
+            hdata.data = pd.Series(
+                price, index=pd.date_range('2017-01-01', periods=hours,
+                                           freq='H', tz='UTC'))
+            rel.add_historic_data(hdata)
+        morning = pd.Timestamp('2017-01-01 10:00', tz='UTC')
+        afternoon = pd.Timestamp('2017-01-01 15:00', tz='UTC')
+        # The direct pair is used by default:
+        self.assertEqual(rel.get_rate(morning, 'XMR', 'EUR'), 5)
+        rel.source_costs = {'memory': 0, 'disk': 1, 'network': 50}
+        rel.max_extra_hops = 1
+        self.assertAlmostEqual(rel.get_rate(morning, 'XMR', 'EUR'), 10)
+        # Falls back to the direct pair where the other route ends:
+        self.assertEqual(rel.get_rate(afternoon, 'XMR', 'EUR'), 5)
+        self.assertEqual(rel.get_rate(morning, 'XMR', 'EUR'), 5)
+        rel.route_choices.clear()
+        self.assertTrue(np.allclose(
+            rel.get_rates([morning, afternoon], 'XMR', 'EUR'), 5))
+        self.assertTrue(rel.explain_route(morning, 'XMR', 'EUR')[1]['chosen'])
+        # Sources missing in the costs cost nothing:
+        rel.source_costs = {'network': 50}
+        rel.route_choices.clear()
+        self.assertAlmostEqual(rel.get_rate(morning, 'XMR', 'EUR'), 10)
+        self.assertEqual(
+            rel.explain_route(morning, 'XMR', 'EUR')[0]['cost'], 2)
+
 
 if __name__ == '__main__':
     unittest.main()
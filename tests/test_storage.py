@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# ----------------------------------------------------------------------
+# ccGains - Create capital gains reports for cryptocurrency trading.
+# Copyright (C) 2017 Jürgen Probst
+#
+# This file is part of ccGains.
+#
+# ccGains is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ccGains is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with ccGains. If not, see <http://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+#
+# Get the latest version at: https://github.com/probstj/ccGains
+#
+
+import unittest
+import shutil
+import tempfile
+from os import path
+
+from ccgains import storage
+import pandas as pd
+import numpy as np
+
+
+def memory_mapped(values):
+    """Return whether the numpy array *values* is a view of a
+    memory-mapped file."""
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+class TestNpyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = path.join(self.folder, 'prices.npyd')
+        rng = pd.date_range('2017-01-01', periods=100, freq='H', tz='UTC')
+        self.series = pd.Series(np.linspace(1, 2, 100), index=rng)
+        self.frame = pd.DataFrame(
+            {'EUR/BTC': np.linspace(1, 2, 100), 'volume': np.ones(100)},
+            index=rng, columns=['EUR/BTC', 'volume'])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_put_get(self):
+        with storage.NpyStore(self.file_name) as store:
+            store.put('s', self.series, attrs={'csv_mtime': 12.5})
+            store.put('f', self.frame)
+        with storage.NpyStore(self.file_name, mode='r') as store:
+            self.assertListEqual(store.keys(), ['f', 's'])
+            s = store.get('s')
+            f = store.get('f')
+            # The data is memory-mapped, not copied:
+            self.assertIsInstance(s.values, np.memmap)
+            for column in f.columns:
+                self.assertTrue(memory_mapped(f[column].values))
+            self.assertDictEqual(store.get_attrs('s'), {'csv_mtime': 12.5})
+            with self.assertRaises(KeyError):
+                store.get('x')
+        self.assertTrue(s.equals(self.series))
+        self.assertEqual(s.index.freq, self.series.index.freq)
+        self.assertEqual(str(s.index.tz), 'UTC')
+        self.assertTrue(f.equals(self.frame))
+
+    def test_append_select(self):
+        with storage.NpyStore(self.file_name) as store:
+            store.append('f', self.frame[:30])
+            store.append('f', self.frame[30:])
+            self.assertTrue(store.is_appendable('f'))
+            self.assertListEqual(
+                [len(c) for c in store.select('f', chunksize=10)], [30, 70])
+            self.assertTrue(store.get('f').equals(self.frame))
+            store.remove('f')
+            self.assertNotIn('f', store)
+            self.assertListEqual(store.keys(), [])
+
+    def test_get_range(self):
+        start = pd.Timestamp('2017-01-02 10:00', tz='UTC')
+        end = pd.Timestamp('2017-01-03 09:30', tz='UTC')
+        for backend in (storage.NpyStore, storage.HDF5Store):
+            file_name = path.join(self.folder, 'range' + backend.extension)
+            with backend(file_name) as store:
+                store.put('f', self.frame, attrs={'a': 1}, indexed=True)
+                store.put('s', self.series)
+                f = store.get_range('f', start, end)
+                if backend is storage.NpyStore:
+                    # Only the rows in the range are wrapped, not copied:
+                    self.assertTrue(memory_mapped(f['volume'].values))
+                self.assertTrue(f.equals(self.frame[start:end]))
+                self.assertEqual(len(f), 24)
+                self.assertDictEqual(store.get_attrs('f'), {'a': 1})
+                self.assertTrue(
+                    store.get_range('s', end=start).equals(
+                        self.series[:start]))
+                with self.assertRaises(KeyError):
+                    store.get_range('x', start, end)
+
+    def test_read_only(self):
+        with self.assertRaises(IOError):
+            with storage.NpyStore(self.file_name, mode='r'):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()